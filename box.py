@@ -1,14 +1,17 @@
 import cv2
 import numpy
 import math
+from collections import namedtuple
 
 import geometry as g
 import colors
 
-class EmptyObject:
+# Rectangles whose angle is within this many degrees of the axes are stored as plain bounding boxes. Below
+# this, a rotated rectangle is within a pixel or so of its bounding box over the width of a line of text.
+AXIS_ALIGNED_TOLERANCE = 0.1
 
-    def __init__(self):
-        pass
+Corners = namedtuple('Corners', ['left', 'right'])
+Centers = namedtuple('Centers', ['left', 'right', 'center'])
 
 def distance(start, end):
 
@@ -36,23 +39,120 @@ def angle(start, end):
 
     return degrees
 
-class Box:
+def isNegligibleAngle(degrees, tolerance=AXIS_ALIGNED_TOLERANCE):
+    # minAreaRect reports angles in the range [-90, 0), so a rectangle is axis-aligned if its angle is
+    # close to either end of that range.
 
-    def __init__(self, points):
+    return abs(degrees) <= tolerance or abs(degrees + 90) <= tolerance
 
-        self.rect = cv2.minAreaRect(points)    # rect = ((center_x,center_y),(width,height),angle)
-        self.points = self.rectToPoints(self.rect)
+class Box(object):
 
-        self.setImportantPoints(self.points)    # sets up properties such as self.top.left, self.center.right, etc
+    __slots__ = ('bounds', 'width', 'height', 'area', 'angle', 'words', 'isLine',
+                 '_rect', '_points', '_top', '_bottom', '_center')
 
-        self.width = distance(self.center.left, self.center.right)
-        self.height = distance(self.top.left, self.bottom.left)
-        self.area = self.width * self.height
-        self.angle = angle(self.top.left, self.top.right)
+    def __init__(self, points, axisAligned=False):
+
+        self.reset()
+
+        # If the caller knows the page has been deskewed, we can skip minAreaRect entirely. Otherwise we
+        # still take the cheap path whenever the fitted rectangle turns out to be axis-aligned.
+        if axisAligned:
+            self.setBounds(cv2.boundingRect(points))
+            return
+
+        rect = cv2.minAreaRect(points)    # rect = ((center_x,center_y),(width,height),angle)
+        if isNegligibleAngle(rect[2]):
+            self.setBounds(cv2.boundingRect(points))
+        else:
+            self.setRotated(rect)
+
+    @classmethod
+    def fromBounds(cls, bounds):
+        # builds an axis-aligned box directly from an (x, y, width, height) tuple, e.g. from a BoxArray.
+
+        box = cls.__new__(cls)
+        box.reset()
+        box.setBounds(bounds)
+        return box
+
+    @classmethod
+    def fromRect(cls, rect):
+        # builds a box directly from a ((center_x,center_y),(width,height),angle) rect.
+
+        box = cls.__new__(cls)
+        box.reset()
+        box.setRotated(rect)
+        return box
+
+    def reset(self):
 
         self.words = []                         # children words, with a center of mass inside the box.
         self.isLine = False                     # temporary flag, until I set up a proper Lines class.
 
+        self._rect = None
+        self._points = None
+        self._top = None
+        self._bottom = None
+        self._center = None
+
+    def setBounds(self, bounds):
+        # Axis-aligned representation: everything else is derived lazily from (x, y, width, height).
+
+        self.bounds = bounds
+        self.width = float(bounds[2])
+        self.height = float(bounds[3])
+        self.area = self.width * self.height
+        self.angle = 0.0
+
+    def setRotated(self, rect):
+
+        self.bounds = None
+        self._rect = rect
+        self._points = self.rectToPoints(rect)
+
+        self.setImportantPoints(self._points)   # sets up properties such as self.top.left, self.center.right, etc
+
+        self.width = distance(self._center.left, self._center.right)
+        self.height = distance(self._top.left, self._bottom.left)
+        self.area = self.width * self.height
+        self.angle = angle(self._top.left, self._top.right)
+
+    @property
+    def rect(self):
+        if self._rect is None:
+            x, y, width, height = self.bounds
+            self._rect = ((x + width/2.0, y + height/2.0), (float(width), float(height)), 0.0)
+        return self._rect
+
+    @property
+    def points(self):
+        if self._points is None:
+            x, y, width, height = self.bounds
+            self._points = numpy.array([[x, y+height], [x, y], [x+width, y], [x+width, y+height]], numpy.int32)
+        return self._points
+
+    @property
+    def top(self):
+        if self._top is None:
+            self.setImportantPoints(self.points)
+        return self._top
+
+    @property
+    def bottom(self):
+        if self._bottom is None:
+            self.setImportantPoints(self.points)
+        return self._bottom
+
+    @property
+    def center(self):
+        if self._center is None:
+            self.setImportantPoints(self.points)
+        return self._center
+
+    @property
+    def isAxisAligned(self):
+        return self.bounds is not None
+
     def rectToPoints(self, rect):
 
         points = cv2.cv.BoxPoints(rect)             # Find four vertices of rectangle from above rect
@@ -63,24 +163,29 @@ class Box:
         # figures out which point is top-left, etc, and assigns each to one of: self.top.left, self.top.right,
         # self.bottom.left, and self.bottom.right
 
-        points  = sorted(points, key=lambda point: point[0]) # sort by x position.
-        left = sorted(points[:2], key=lambda point: point[1])  # [top-left, bottom-left]
-        right = sorted(points[2:], key=lambda point: point[1]) # [top-right, bottom-right]
+        if self.bounds is not None:
+            # no need to sort anything; we already know where each corner is.
+            x, y, width, height = self.bounds
+            left = [(x, y), (x, y+height)]
+            right = [(x+width, y), (x+width, y+height)]
+        else:
+            points  = sorted(points, key=lambda point: point[0]) # sort by x position.
+            left = sorted(points[:2], key=lambda point: point[1])  # [top-left, bottom-left]
+            right = sorted(points[2:], key=lambda point: point[1]) # [top-right, bottom-right]
 
-        self.top = EmptyObject()
-        self.top.left = left[0]
-        self.top.right = right[0]
+        self._top = Corners(left[0], right[0])
+        self._bottom = Corners(left[1], right[1])
 
-        self.bottom = EmptyObject()
-        self.bottom.left = left[1]
-        self.bottom.right = right[1]
+        centerLeft = midpoint(left[0], left[1])
+        centerRight = midpoint(right[0], right[1])
+        self._center = Centers(centerLeft, centerRight, midpoint(centerLeft, centerRight))
 
-        self.center = EmptyObject()
-        self.center.left = midpoint(self.top.left, self.bottom.left)
-        self.center.right = midpoint(self.top.right, self.bottom.right)
-        self.center.center = midpoint(self.center.left, self.center.right)
+    def isTouchingEdge(self, shape, closenessThreshold):
 
-    def isTouchingEdge(self, shape, closenessThreshold=200):
+        if self.bounds is not None:
+            x, y, width, height = self.bounds
+            return (x <= closenessThreshold or y <= closenessThreshold or
+                    x + width >= shape[1] - closenessThreshold or y + height >= shape[0] - closenessThreshold)
 
         isTouching = False
         shape = (shape[1], shape[0])    # switch width and height so that it matches the format of a Point()
@@ -99,7 +204,10 @@ class Box:
 
     def contains(self, word):
 
-        boxContour = numpy.array(self.points)
+        if self.bounds is not None:
+            x, y, width, height = self.bounds
+            return (x < word.center[0] < x + width) and (y < word.center[1] < y + height)
+
         retval = cv2.pointPolygonTest(numpy.array([self.points]), word.center, False)
 
         if retval > 0:
@@ -116,3 +224,174 @@ class Box:
         #image = g.Point(self.center.right).paint(image, colors.GREEN)
 
         return image
+
+
+class BoxArray(object):
+    # The same measurements as Box, but for many contours at once. Every property is a numpy array with one
+    # entry per contour, so that filters like (boxes.area > 50) become a single mask over the whole set.
+    # Individual Box instances are only built on demand, with boxes[i].
+
+    def __init__(self, contours, axisAligned=False):
+
+        self.contours = list(contours)
+        self.axisAligned = axisAligned
+
+        points, starts = self.flatten(self.contours)
+        self.bounds = self.getBounds(points, starts)
+        self.m00, self.centroids = self.getCentroids(points, starts)
+
+        if axisAligned or len(self.contours) == 0:
+            rects = self.boundsToRects(self.bounds)
+        else:
+            # minAreaRect has no batched form, but one C call per contour is cheap; everything we derive
+            # from the rectangles afterwards is done in bulk.
+            rects = numpy.array([ (cx, cy, w, h, a) for ((cx, cy), (w, h), a) in
+                                  [cv2.minAreaRect(contour) for contour in self.contours] ], numpy.float64)
+
+        self.rects = rects.reshape(-1, 5)  # one row per contour: center_x, center_y, width, height, angle
+        self.isAxisAligned = numpy.array([ axisAligned or isNegligibleAngle(a) for a in self.rects[:,4] ], bool)
+
+        self.setMeasurements()
+
+    def __len__(self):
+        return len(self.contours)
+
+    def __getitem__(self, index):
+
+        if self.isAxisAligned[index]:
+            return Box.fromBounds(tuple(int(value) for value in self.bounds[index]))
+
+        centerX, centerY, width, height, rectAngle = self.rects[index]
+        return Box.fromRect(((centerX, centerY), (width, height), rectAngle))
+
+    def __iter__(self):
+        for index in range(len(self)):
+            yield self[index]
+
+    def select(self, mask):
+        # returns a new BoxArray holding only the contours where mask is true.
+
+        subset = BoxArray.__new__(BoxArray)
+        subset.contours = [contour for contour, keep in zip(self.contours, mask) if keep]
+        subset.axisAligned = self.axisAligned
+
+        for name in ['bounds', 'm00', 'centroids', 'rects', 'isAxisAligned', 'corners', 'width', 'height',
+                     'area', 'angle']:
+            setattr(subset, name, getattr(self, name)[mask])
+
+        return subset
+
+    def isTouchingEdge(self, shape, closenessThreshold):
+        # Box.isTouchingEdge for every box at once, going by the bounding boxes.
+        return self.boundsTouchingEdge(self.bounds.reshape(-1, 4), shape, closenessThreshold)
+
+    @staticmethod
+    def boundsTouchingEdge(bounds, shape, closenessThreshold):
+        # which of an (n, 4) array of (x, y, width, height) bounds come within closenessThreshold of the
+        # edge of an image of the given shape.
+
+        x, y, width, height = bounds[:,0], bounds[:,1], bounds[:,2], bounds[:,3]
+        return (x <= closenessThreshold) | (y <= closenessThreshold) | \
+               (x + width >= shape[1] - closenessThreshold) | (y + height >= shape[0] - closenessThreshold)
+
+    @staticmethod
+    def flatten(contours):
+        # stacks every contour into one (n, 2) array, and records where each contour starts.
+
+        if len(contours) == 0:
+            return numpy.zeros((0, 2), numpy.float64), numpy.zeros(0, numpy.int64)
+
+        lengths = numpy.array([ len(contour) for contour in contours ])
+        starts = numpy.concatenate([[0], numpy.cumsum(lengths)[:-1]])
+        points = numpy.vstack([ numpy.reshape(contour, (-1, 2)) for contour in contours ]).astype(numpy.float64)
+
+        return points, starts
+
+    @staticmethod
+    def getBounds(points, starts):
+        # the equivalent of cv2.boundingRect for every contour.
+
+        if len(starts) == 0:
+            return numpy.zeros((0, 4), numpy.int64)
+
+        low = numpy.minimum.reduceat(points, starts, axis=0)
+        high = numpy.maximum.reduceat(points, starts, axis=0)
+
+        return numpy.hstack([low, high - low + 1]).astype(numpy.int64)
+
+    @staticmethod
+    def getCentroids(points, starts):
+        # The contour moments m00, m10 and m01 (as cv2.moments would calculate them) via the shoelace
+        # formula, for all contours at once. Contours with no area get a centroid of nan.
+
+        if len(starts) == 0:
+            return numpy.zeros(0), numpy.zeros((0, 2))
+
+        # the index of the point following each point, wrapping around within each contour.
+        following = numpy.arange(1, len(points)+1)
+        ends = numpy.concatenate([starts[1:], [len(points)]])
+        following[ends-1] = starts
+
+        x, y = points[:,0], points[:,1]
+        nextX, nextY = x[following], y[following]
+        cross = x*nextY - nextX*y
+
+        m00 = numpy.add.reduceat(cross, starts) / 2.0
+        m10 = numpy.add.reduceat((x + nextX) * cross, starts) / 6.0
+        m01 = numpy.add.reduceat((y + nextY) * cross, starts) / 6.0
+
+        with numpy.errstate(divide='ignore', invalid='ignore'):
+            centroids = numpy.column_stack([m10 / m00, m01 / m00])
+
+        return numpy.abs(m00), centroids
+
+    @staticmethod
+    def boundsToRects(bounds):
+
+        bounds = bounds.astype(numpy.float64)
+        x, y, width, height = bounds[:,0], bounds[:,1], bounds[:,2], bounds[:,3]
+        return numpy.column_stack([x + width/2.0, y + height/2.0, width, height, numpy.zeros(len(bounds))])
+
+    def setMeasurements(self):
+        # Vectorised versions of Box.rectToPoints and Box.setImportantPoints, followed by the width, height,
+        # area and angle calculations in Box.setRotated.
+
+        count = len(self.rects)
+        centerX, centerY, width, height, rectAngle = [ self.rects[:,i] for i in range(5) ]
+
+        # corners in the same order as cv2.cv.BoxPoints
+        b = numpy.cos(numpy.radians(rectAngle)) * 0.5
+        a = numpy.sin(numpy.radians(rectAngle)) * 0.5
+        first = numpy.column_stack([centerX - a*height - b*width, centerY + b*height - a*width])
+        second = numpy.column_stack([centerX + a*height - b*width, centerY - b*height - a*width])
+        center = numpy.column_stack([centerX, centerY])
+        corners = numpy.around(numpy.stack([first, second, 2*center - first, 2*center - second], axis=1))
+
+        # axis-aligned boxes use their bounding rect instead, just like Box does.
+        x, y, w, h = [ self.bounds[:,i] for i in range(4) ]
+        aligned = numpy.stack([numpy.column_stack([x, y+h]), numpy.column_stack([x, y]),
+                               numpy.column_stack([x+w, y]), numpy.column_stack([x+w, y+h])], axis=1)
+        corners = numpy.where(self.isAxisAligned[:,numpy.newaxis,numpy.newaxis], aligned, corners)
+        self.corners = corners.astype(numpy.int32).reshape(count, 4, 2)
+
+        # sort by x, then sort each of the left and right pairs by y
+        rows = numpy.arange(count)[:,numpy.newaxis]
+        byX = self.corners[rows, numpy.argsort(self.corners[:,:,0], axis=1, kind='mergesort')]
+        left = byX[:,:2].astype(numpy.float64)
+        right = byX[:,2:].astype(numpy.float64)
+        left = numpy.where((left[:,0,1] > left[:,1,1])[:,numpy.newaxis,numpy.newaxis], left[:,::-1], left)
+        right = numpy.where((right[:,0,1] > right[:,1,1])[:,numpy.newaxis,numpy.newaxis], right[:,::-1], right)
+
+        topLeft, bottomLeft = left[:,0], left[:,1]
+        topRight, bottomRight = right[:,0], right[:,1]
+        centerLeft = (topLeft + bottomLeft) / 2
+        centerRight = (topRight + bottomRight) / 2
+
+        rotatedWidth = numpy.hypot(*(centerRight - centerLeft).T)
+        rotatedHeight = numpy.hypot(*(bottomLeft - topLeft).T)
+        rotatedAngle = numpy.degrees(numpy.arctan2(*(topRight - topLeft).T[::-1]))
+
+        self.width = numpy.where(self.isAxisAligned, self.bounds[:,2], rotatedWidth).astype(numpy.float64)
+        self.height = numpy.where(self.isAxisAligned, self.bounds[:,3], rotatedHeight).astype(numpy.float64)
+        self.area = self.width * self.height
+        self.angle = numpy.where(self.isAxisAligned, 0.0, rotatedAngle)
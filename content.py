@@ -127,157 +127,183 @@ class ChapterStart:
 
 class Content:
 
-    def __init__(self, lines, isChapterStart=False):
+    def __init__(self, lines, isChapterStart=False, attributes=None, figureMinHeight=300):
+        # attributes is the dict of per-line boolean arrays returned by Margin.classifyLines. If it isn't
+        # given, the flags are read back off the lines, and lines taller than figureMinHeight are figures.
 
         self.lines = lines
         self.content = []
 
+        allLines = list(self.lines)
+        if attributes is None:
+            attributes = self.readAttributes(allLines, figureMinHeight)
+
         if isChapterStart:
             chapterStart = ChapterStart(self.lines)
             self.content.append(chapterStart)
 
-        self.stateMachine()
-
-    def stateMachine(self):
-
-        try:
-            newLine = self.lines.pull()
-        except IndexError:
-            return
-
-        if newLine.box.height > 300:
-            self.SM_newFigure(newLine)
-        elif newLine.isCentered:
-            self.SM_sectionTitle(newLine)
-        else:
-            self.SM_newParagraph(newLine)
-
-    def SM_newFigure(self, line):
-
-        figure = Figure()
-        figure.image = line
-
-        try:
-            newLine = self.lines.pull()
-        except IndexError:
-            self.content.append(figure)
-            return
-
-        if newLine.isCentered:
-            self.SM_addCaptionLine(newLine, figure)
-        else:
-            self.content.append(figure)
-            self.SM_newParagraph(newLine)
-
-    def SM_addCaptionLine(self, line, figure):
-
-        figure.caption.append(line)
-
-        try:
-            newLine = self.lines.pull()
-        except IndexError:
-            self.content.append(figure)
-            return
-
-        if newLine.isCentered:
-            self.SM_addCaptionLine(newLine, figure)
-        else:
-            self.content.append(figure)
-            self.SM_newParagraph(newLine)
-
-    def SM_newParagraph(self, line):
-
-        paragraph = Paragraph(line)
-
-        try:
-            newLine = self.lines.pull()
-        except IndexError:
-            self.content.append(paragraph)
-            return
-
-        if newLine.box.height > 300:
-            self.content.append(paragraph)
-            self.SM_newFigure(newLine)
-
-        elif newLine.isCentered:
-            self.content.append(paragraph)
-            self.SM_sectionTitle(newLine)
-
-        elif line.isParagraphEnd or newLine.isParagraphStart:
-            self.content.append(paragraph)
-            self.SM_newParagraph(newLine)
-
-        elif newLine.isParagraphEnd:
-            self.SM_paragraphEnd(newLine, paragraph)
-
-        else:
-            self.SM_paragraphBody(newLine, paragraph)
-
-    def SM_paragraphBody(self, line, paragraph):
-
-        paragraph.append(line)
-
-        try:
-            newLine = self.lines.pull()
-        except IndexError:
-            self.content.append(paragraph)
-            return
-
-        if newLine.box.height > 300:
-            self.content.append(paragraph)
-            self.SM_newFigure(newLine)
-
-        elif newLine.isCentered:
-            self.content.append(paragraph)
-            self.SM_sectionTitle(newLine)
-
-        elif newLine.isParagraphStart:
-            self.content.append(paragraph)
-            self.SM_newParagraph(newLine)
-
-        elif newLine.isParagraphEnd:
-            self.SM_paragraphEnd(newLine, paragraph)
-
-        else:
-            self.SM_paragraphBody(newLine, paragraph)
-
-    def SM_paragraphEnd(self, line, paragraph):
-
-        paragraph.append(line)
-
-        try:
-            newLine = self.lines.pull()
-        except IndexError:
-            self.content.append(paragraph)
-            return
-
-        if newLine.box.height > 300:
-            self.content.append(paragraph)
-            self.SM_newFigure(newLine)
-
-        elif newLine.isCentered:
-            self.content.append(paragraph)
-            self.SM_sectionTitle(newLine)
-
+        # ChapterStart takes lines off the front of the collection, so classify whatever is left.
+        firstLine = len(allLines) - len(self.lines)
+        remaining = dict( (name, values[firstLine:]) for name, values in attributes.items() )
+        lineObjects = allLines[firstLine:]
+
+        # the classifier's results are kept, so that update() can pick up part way down the page.
+        self.lineObjects = lineObjects
+        self.attributes = remaining
+        self.blocks, self.states = self.classify(remaining)
+        self.firstBlock = len(self.content)     # the index in self.content of the block for self.blocks[0]
+
+        for contentType, lineNumbers in self.blocks:
+            self.content.append(self.makeBlock(contentType, [ lineObjects[i] for i in lineNumbers ]))
+
+    def update(self, lines, attributes):
+        # Brings the content up to date after some of its lines have changed (see Page.reanalyse). lines is
+        # the new collection of lines (after any chapter start), and attributes is what Margin.classifyLines
+        # says about them. The classifier is only run again from the first line which
+        # is new or whose attributes have changed; the blocks before that line are kept. Returns the number
+        # of that line.
+
+        lineObjects = list(lines)
+        firstLine = 0
+        while firstLine < min(len(lineObjects), len(self.lineObjects)) and lineObjects[firstLine] is self.lineObjects[firstLine] \
+                and all( attributes[name][firstLine] == values[firstLine] for name, values in self.attributes.items() ):
+            firstLine += 1
+
+        # Keep the blocks which start before firstLine (cutting the last one short). The last of them may
+        # carry on past firstLine, so its content object is built again; the others are left alone.
+        blocks = []
+        for contentType, lineNumbers in self.blocks:
+            if lineNumbers[0] >= firstLine:
+                break
+            blocks.append((contentType, [ i for i in lineNumbers if i < firstLine ]))
+        keptBlocks = max(len(blocks) - 1, 0)
+
+        state = self.states[firstLine-1] if firstLine > 0 else None
+        self.blocks, states = self.classify(attributes, firstLine, state, blocks)
+        self.states = self.states[:firstLine] + states[firstLine:]
+        self.lines = lines
+        self.lineObjects = list(lines)
+        self.attributes = dict( (name, numpy.array(values)) for name, values in attributes.items() )
+
+        del self.content[self.firstBlock + keptBlocks:]
+        for contentType, lineNumbers in self.blocks[keptBlocks:]:
+            self.content.append(self.makeBlock(contentType, [ self.lineObjects[i] for i in lineNumbers ]))
+
+        return firstLine
+
+    def extend(self, other):
+        # adds another Content's blocks after this one's, e.g. those of the next column on the page.
+
+        self.content.extend(other.content)
+        for line in other.lines:
+            self.lines.append(line)
+
+    @staticmethod
+    def readAttributes(lines, figureMinHeight=300):
+
+        attributes = {}
+        for name in ['isCentered', 'isParagraphStart', 'isParagraphEnd', 'isHorizontalRule']:
+            attributes[name] = numpy.array([ getattr(line, name) for line in lines ], bool)
+        attributes['isFigure'] = numpy.array([ line.box.height > figureMinHeight or line.hasIllustration
+                                               for line in lines ], bool)
+
+        return attributes
+
+    @staticmethod
+    def classify(attributes, start=0, state=None, blocks=None):
+        # A state machine which groups lines into figures, paragraphs and section titles. It only looks at
+        # the attribute arrays, and returns a list of (contentType, [line numbers]) pairs along with the
+        # state after each line; the content objects themselves are built afterwards.
+        #
+        # To pick up part way through, start is the first line to look at, state is the state after the line
+        # before it, and blocks are the blocks found so far (the list is extended, and returned).
+        #
+        # States which start a new block: 'figure', 'sectionTitle', 'newParagraph'.
+        # States which add to the current block: 'caption', 'paragraphBody', 'paragraphEnd'.
+
+        isFigure = attributes['isFigure']
+        isCentered = attributes['isCentered']
+        isParagraphStart = attributes['isParagraphStart']
+        isParagraphEnd = attributes['isParagraphEnd']
+
+        blocks = [ (contentType, list(lineNumbers)) for contentType, lineNumbers in blocks or [] ]
+        states = [None] * start
+
+        for i in range(start, len(isFigure)):
+
+            if state is None:
+                if isFigure[i]:
+                    state = 'figure'
+                elif isCentered[i]:
+                    state = 'sectionTitle'
+                else:
+                    state = 'newParagraph'
+
+            elif state in ['figure', 'caption']:
+                if isCentered[i]:
+                    state = 'caption'
+                else:
+                    state = 'newParagraph'
+
+            elif state == 'sectionTitle':
+                if isFigure[i]:
+                    state = 'figure'
+                else:
+                    state = 'newParagraph'
+
+            elif isFigure[i]:
+                state = 'figure'
+
+            elif isCentered[i]:
+                state = 'sectionTitle'
+
+            elif state == 'newParagraph':
+                if isParagraphEnd[i-1] or isParagraphStart[i]:
+                    state = 'newParagraph'
+                elif isParagraphEnd[i]:
+                    state = 'paragraphEnd'
+                else:
+                    state = 'paragraphBody'
+
+            elif state == 'paragraphBody':
+                if isParagraphStart[i]:
+                    state = 'newParagraph'
+                elif isParagraphEnd[i]:
+                    state = 'paragraphEnd'
+                else:
+                    state = 'paragraphBody'
+
+            elif state == 'paragraphEnd':
+                state = 'newParagraph'
+
+            if state == 'figure':
+                blocks.append(('Figure', [i]))
+            elif state == 'sectionTitle':
+                blocks.append(('SectionTitle', [i]))
+            elif state == 'newParagraph':
+                blocks.append(('Paragraph', [i]))
+            else:
+                blocks[-1][1].append(i)
+
+            states.append(state)
+
+        return blocks, states
+
+    @staticmethod
+    def makeBlock(contentType, lines):
+
+        if contentType == 'Figure':
+            block = Figure()
+            block.image = lines[0]
+            block.caption = lines[1:]
+        elif contentType == 'SectionTitle':
+            block = SectionTitle()
+            block.lines = lines
         else:
-            self.content.append(paragraph)
-            self.SM_newParagraph(newLine)
-
-    def SM_sectionTitle(self, line):
-        sectionTitle = SectionTitle(line)
+            block = Paragraph()
+            block.lines = lines
 
-        try:
-            newLine = self.lines.pull()
-        except IndexError:
-            self.content.append(sectionTitle)
-            return
-
-        if newLine.box.height > 300:
-            self.content.append(sectionTitle)
-            self.SM_newFigure(newLine)
-        else:
-            self.content.append(sectionTitle)
-            self.SM_newParagraph(newLine)
+        return block
 
     def paint(self, image):
 
@@ -0,0 +1,186 @@
+import cv2
+import numpy
+from collections import namedtuple
+
+# Spots rescans: pages that are the same page as one already analysed, shot again after a fold or a blur.
+# Each page is summed up by a Fingerprint, taken from a small greyscale copy of it:
+#
+#  - a perceptual hash. The page is shrunk to 64x64, and the magnitudes of its lowest frequencies are
+#    compared with their median, giving 63 bits which barely change with blur, noise, exposure or the page
+#    moving on the scanner. Only pages whose hashes differ in a few bits are compared any further.
+#  - a thumbnail. Pages of text all look much alike at 64x64, so each candidate is lined up with the page
+#    by phase correlation of their thumbnails, and only taken to be the same page if the two then match
+#    closely. The shift found is how far the page has moved on the scanner, so the earlier page's
+#    structure can be moved by the same amount and used as it is (see structure.movePage).
+#  - a detail: a square from the middle of the page at full size. A thumbnail's pixel is several of the
+#    page's, so the shift is finished off by lining the detail up with the same part of the new page.
+#
+# A DuplicateIndex holds the fingerprints and structures of a book's pages as they're analysed.
+
+HASH_SIZE = 8           # the hash is taken from the lowest HASH_SIZE x HASH_SIZE frequencies
+THUMBNAIL_WIDTH = 256
+DETAIL_SIZE = 256
+MAX_DISTANCE = 12       # the most bits two hashes can differ by for the pages to be compared at all
+MAX_CANDIDATES = 8      # how many of the closest hashes are compared
+MIN_CORRELATION = 0.6   # how closely the thumbnails must match, once lined up
+MAX_SHIFT = 0.1         # the furthest a rescan can have moved, as a fraction of the page's width
+MAX_SIZE_CHANGE = 0.02  # rescans must be the same size as the page (as a fraction), as the structure is only moved
+
+Match = namedtuple('Match', ['name', 'arrays', 'shift'])
+
+class Fingerprint:
+
+    def __init__(self, greyscale, sourceShape):
+        # greyscale is the page as analysed, and sourceShape is the (height, width) of the scan, which
+        # the shift between two pages is given in.
+
+        height, width = greyscale.shape[:2]
+        thumbnailHeight = max(int(round(height * float(THUMBNAIL_WIDTH) / width)), 1)
+        self.thumbnail = cv2.resize(greyscale, (THUMBNAIL_WIDTH, thumbnailHeight), interpolation=cv2.INTER_AREA)
+        self.sourceShape = tuple(sourceShape[:2])
+        self.scale = float(sourceShape[1]) / width      # scan pixels per pixel of greyscale
+        self.hash = perceptualHash(self.thumbnail)
+
+        size = min(DETAIL_SIZE, height, width)
+        self.detailOrigin = ((width - size) // 2, (height - size) // 2)
+        self.detail = greyscale[self.detailOrigin[1]:self.detailOrigin[1]+size,
+                                self.detailOrigin[0]:self.detailOrigin[0]+size].copy()
+
+    def shiftFrom(self, other, greyscale=None):
+        # Lines this page up with another. Returns the (x, y) distance, in the scan's pixels, that the other
+        # page's contents have to be moved to land on this page's, or None if the pages don't match. If
+        # this page's greyscale is given, the shift is refined to the nearest pixel of it.
+
+        sizeChange = numpy.abs(numpy.subtract(self.sourceShape, other.sourceShape)) / numpy.array(self.sourceShape, float)
+        if numpy.any(sizeChange > MAX_SIZE_CHANGE):
+            return None
+
+        thumbnail = self.thumbnail.astype(numpy.float64)
+        otherThumbnail = other.thumbnail
+        if otherThumbnail.shape != thumbnail.shape:
+            otherThumbnail = cv2.resize(otherThumbnail, (thumbnail.shape[1], thumbnail.shape[0]), interpolation=cv2.INTER_AREA)
+        otherThumbnail = otherThumbnail.astype(numpy.float64)
+
+        shiftX, shiftY = phaseCorrelate(otherThumbnail, thumbnail)
+        if max(abs(shiftX), abs(shiftY)) > MAX_SHIFT * thumbnail.shape[1]:
+            return None
+        if overlapCorrelation(otherThumbnail, thumbnail, shiftX, shiftY) < MIN_CORRELATION:
+            return None
+
+        # the shift in pixels of greyscale, rather than of the thumbnail.
+        thumbnailScale = float(self.sourceShape[1]) / (thumbnail.shape[1] * self.scale)
+        shiftX, shiftY = shiftX * thumbnailScale, shiftY * thumbnailScale
+
+        if greyscale is not None:
+            shiftX, shiftY = other.refineShift(greyscale, shiftX, shiftY, thumbnailScale)
+
+        return (shiftX * self.scale, shiftY * self.scale)
+
+    def refineShift(self, greyscale, shiftX, shiftY, tolerance):
+        # Lines this page's detail up with the same part of another page's greyscale, which is about
+        # (shiftX, shiftY) pixels further along. A correction of more than the tolerance is taken to be
+        # wrong (the middle of the page may be blank), and the shift is left as it was.
+
+        size = self.detail.shape[0]
+        left = int(round(self.detailOrigin[0] + shiftX))
+        top = int(round(self.detailOrigin[1] + shiftY))
+        if left < 0 or top < 0 or top + size > greyscale.shape[0] or left + size > greyscale.shape[1]:
+            return shiftX, shiftY
+
+        region = greyscale[top:top+size, left:left+size].astype(numpy.float64)
+        correctionX, correctionY = phaseCorrelate(self.detail.astype(numpy.float64), region)
+        correctionX += left - self.detailOrigin[0] - shiftX
+        correctionY += top - self.detailOrigin[1] - shiftY
+        if max(abs(correctionX), abs(correctionY)) > tolerance:
+            return shiftX, shiftY
+
+        return shiftX + correctionX, shiftY + correctionY
+
+class DuplicateIndex:
+
+    def __init__(self, maxDistance=MAX_DISTANCE, maxCandidates=MAX_CANDIDATES):
+
+        self.maxDistance = maxDistance
+        self.maxCandidates = maxCandidates
+
+        self.names = []
+        self.hashes = []
+        self.fingerprints = []
+        self.structures = []    # the arrays of each page's structure, as from structure.pageToArrays
+
+    def __len__(self):
+        return len(self.names)
+
+    def add(self, name, fingerprint, arrays):
+        self.names.append(name)
+        self.hashes.append(fingerprint.hash)
+        self.fingerprints.append(fingerprint)
+        self.structures.append(arrays)
+
+    def find(self, fingerprint, greyscale=None):
+        # Returns a Match for the earlier page that this is a rescan of, or None if it isn't one. The
+        # match's shift is how far that page's structure has to be moved to fit this one; it is only
+        # accurate to the pixel if the page's greyscale is given.
+
+        if len(self.names) == 0:
+            return None
+
+        distances = hammingDistances(self.hashes, fingerprint.hash)
+        for i in numpy.argsort(distances, kind='mergesort')[:self.maxCandidates]:
+            if distances[i] > self.maxDistance:
+                break
+            shift = fingerprint.shiftFrom(self.fingerprints[i], greyscale)
+            if shift is not None:
+                return Match(self.names[i], self.structures[i], shift)
+
+        return None
+
+def perceptualHash(thumbnail):
+    # The hash is taken from the magnitudes of the page's lowest frequencies (leaving out their phases),
+    # which don't change when the page has moved on the scanner.
+
+    small = cv2.resize(thumbnail, (64, 64), interpolation=cv2.INTER_AREA).astype(numpy.float64)
+    window = numpy.outer(numpy.hanning(64), numpy.hanning(64))
+    magnitudes = numpy.abs(numpy.fft.fft2((small - small.mean()) * window))
+
+    # the magnitudes are symmetric (those of (u, v) and (-u, -v) are the same), so only the frequencies
+    # going down and to the right are used, and each of them is different. The first, (0, 0), is the
+    # page's overall brightness (which is zero anyway, once the mean is taken off), so it's left out.
+    frequencies = magnitudes[:HASH_SIZE, :HASH_SIZE].flatten()[1:]
+    bits = frequencies > numpy.median(frequencies)
+    return int(numpy.packbits(numpy.append(bits, False)).view('>u8')[0])
+
+def hammingDistances(hashes, pageHash):
+    differences = (numpy.asarray(hashes, numpy.uint64) ^ numpy.uint64(pageHash)).view(numpy.uint8)
+    return numpy.unpackbits(differences).reshape(-1, 64).sum(axis=1)
+
+def phaseCorrelate(first, second):
+    # The (x, y) shift that best lines first up with second, to the nearest pixel.
+
+    window = numpy.outer(numpy.hanning(first.shape[0]), numpy.hanning(first.shape[1]))
+    firstSpectrum = numpy.fft.fft2((first - first.mean()) * window)
+    secondSpectrum = numpy.fft.fft2((second - second.mean()) * window)
+
+    crossPower = secondSpectrum * numpy.conj(firstSpectrum)
+    crossPower /= numpy.maximum(numpy.abs(crossPower), 1e-9)
+    correlation = numpy.fft.ifft2(crossPower).real
+
+    shiftY, shiftX = numpy.unravel_index(numpy.argmax(correlation), correlation.shape)
+    height, width = correlation.shape
+    if shiftY > height // 2:
+        shiftY -= height
+    if shiftX > width // 2:
+        shiftX -= width
+
+    return int(shiftX), int(shiftY)
+
+def overlapCorrelation(first, second, shiftX, shiftY):
+    # the correlation coefficient of the two images where they overlap, once first is moved by the shift.
+
+    height, width = first.shape
+    firstPart = first[max(-shiftY, 0):height - max(shiftY, 0), max(-shiftX, 0):width - max(shiftX, 0)]
+    secondPart = second[max(shiftY, 0):height + min(shiftY, 0), max(shiftX, 0):width + min(shiftX, 0)]
+    if firstPart.size < 2 or firstPart.std() == 0 or secondPart.std() == 0:
+        return 0.0
+
+    return numpy.corrcoef(firstPart.ravel(), secondPart.ravel())[0, 1]
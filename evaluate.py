@@ -0,0 +1,124 @@
+import numpy
+from collections import namedtuple
+from scipy import spatial
+
+import structure
+
+# Compares two page structures (see structure.py), e.g. a new run against a reference one. Words, lines and
+# blocks are matched one to one by the overlap (intersection over union) of their bounding rectangles,
+# and characters by distance, so small shifts in geometry don't count as differences. Blocks also have to
+# agree on their type.
+
+Score = namedtuple('Score', ['matched', 'reference', 'candidate', 'precision', 'recall', 'f1'])
+
+LEVELS = ['characters', 'words', 'lines', 'blocks']
+
+def rectangles(corners):
+    # the (left, top, right, bottom) rectangle around each box in an (n, 4, 2) array of corners.
+
+    corners = numpy.asarray(corners, numpy.float64).reshape(-1, 4, 2)
+    return numpy.hstack([corners.min(axis=1), corners.max(axis=1)])
+
+def overlaps(reference, candidate):
+    # the intersection over union of every pair of rectangles, as a (len(reference), len(candidate)) array.
+
+    left = numpy.maximum(reference[:,None,0], candidate[None,:,0])
+    top = numpy.maximum(reference[:,None,1], candidate[None,:,1])
+    right = numpy.minimum(reference[:,None,2], candidate[None,:,2])
+    bottom = numpy.minimum(reference[:,None,3], candidate[None,:,3])
+    intersection = numpy.clip(right - left, 0, None) * numpy.clip(bottom - top, 0, None)
+
+    referenceArea = (reference[:,2] - reference[:,0]) * (reference[:,3] - reference[:,1])
+    candidateArea = (candidate[:,2] - candidate[:,0]) * (candidate[:,3] - candidate[:,1])
+    union = referenceArea[:,None] + candidateArea[None,:] - intersection
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        return numpy.where(union > 0, intersection / union, 0.0)
+
+def matchBoxes(reference, candidate, threshold=0.5):
+    # Pairs up boxes (as corner arrays) greedily, best overlap first, ignoring pairs that overlap by less
+    # than threshold. Returns the matched reference and candidate indices as two arrays.
+
+    if len(reference) == 0 or len(candidate) == 0:
+        return numpy.zeros(0, int), numpy.zeros(0, int)
+
+    iou = overlaps(rectangles(reference), rectangles(candidate))
+    rows, columns = numpy.nonzero(iou >= threshold)
+    order = numpy.argsort(-iou[rows, columns], kind='mergesort')
+
+    usedRows, usedColumns = set(), set()
+    matches = []
+    for row, column in zip(rows[order], columns[order]):
+        if row not in usedRows and column not in usedColumns:
+            usedRows.add(row)
+            usedColumns.add(column)
+            matches.append((row, column))
+
+    matches = numpy.array(matches, int).reshape(-1, 2)
+    return matches[:,0], matches[:,1]
+
+def matchPoints(reference, candidate, tolerance=3.0):
+    # pairs each candidate point with the nearest reference point, if it's within tolerance pixels.
+
+    if len(reference) == 0 or len(candidate) == 0:
+        return numpy.zeros(0, int), numpy.zeros(0, int)
+
+    distances, nearest = spatial.cKDTree(reference).query(candidate, distance_upper_bound=tolerance)
+    columns = numpy.flatnonzero(numpy.isfinite(distances))
+    rows = nearest[columns]
+
+    # if two candidates land on the same reference point, only the first one counts.
+    rows, first = numpy.unique(rows, return_index=True)
+    return rows, columns[first]
+
+def score(matched, referenceCount, candidateCount):
+
+    precision = float(matched) / candidateCount if candidateCount > 0 else 1.0
+    recall = float(matched) / referenceCount if referenceCount > 0 else 1.0
+    f1 = 2*precision*recall / (precision + recall) if precision + recall > 0 else 0.0
+
+    return Score(matched, referenceCount, candidateCount, precision, recall, f1)
+
+def blockCorners(page):
+    # a box around each content block of a PageStructure, as (n, 4, 2) corners.
+
+    corners = []
+    for blockNum in range(page.blockCount()):
+        x, y, width, height = page.blockBounds(blockNum)
+        corners.append([(x, y), (x + width, y), (x + width, y + height), (x, y + height)])
+
+    return numpy.array(corners, numpy.float64).reshape(-1, 4, 2)
+
+def compare(reference, candidate, threshold=0.5, tolerance=3.0):
+    # Compares two PageStructures (or Pages). Returns a dict of Scores, one per level in LEVELS, plus
+    # 'blockLabels': the fraction of matched blocks whose types agree. A block only counts towards the
+    # 'blocks' score if it matches in both position and type.
+
+    if not isinstance(reference, structure.PageStructure):
+        reference = structure.PageStructure(structure.pageToArrays(reference))
+    if not isinstance(candidate, structure.PageStructure):
+        candidate = structure.PageStructure(structure.pageToArrays(candidate))
+
+    results = {}
+
+    rows, columns = matchPoints(reference.characters, candidate.characters, tolerance)
+    results['characters'] = score(len(rows), len(reference.characters), len(candidate.characters))
+
+    rows, columns = matchBoxes(reference.wordBoxes, candidate.wordBoxes, threshold)
+    results['words'] = score(len(rows), len(reference.wordBoxes), len(candidate.wordBoxes))
+
+    rows, columns = matchBoxes(reference.lineBoxes, candidate.lineBoxes, threshold)
+    results['lines'] = score(len(rows), len(reference.lineBoxes), len(candidate.lineBoxes))
+
+    rows, columns = matchBoxes(blockCorners(reference), blockCorners(candidate), threshold)
+    agrees = numpy.array([ reference.blockTypes[row] == candidate.blockTypes[column]
+                           for row, column in zip(rows, columns) ], bool)
+    results['blocks'] = score(int(agrees.sum()), reference.blockCount(), candidate.blockCount())
+    results['blockLabels'] = agrees.mean() if len(agrees) > 0 else 1.0
+
+    return results
+
+def quality(results):
+    # a single number summarising a comparison: the mean f1 over every level.
+
+    return numpy.mean([ results[level].f1 for level in LEVELS ])
@@ -1,9 +1,14 @@
 import cv2
 import numpy
 import math
+from collections import namedtuple
 
 import colors
 
+# How far an 'infinite' line (like a margin edge) is extended either side of the point it's defined by, in
+# pixels. This is further than any page we scan is tall, even at 600 dpi.
+REACH = 10000
+
 class Angle:
 
     def __init__(self, guess=None, degrees=None, radians=None, gradient=None):
@@ -85,6 +90,86 @@ class Angle:
         rawAverage = sumOfRads / len(angles)
         return Angle(radians=Angle.sanitize(rawAverage))
 
+def dominantAngle(points, maxAngle=5.0, step=0.05, binSize=1.0):
+    # Finds the angle (in degrees, with y pointing down the page) of the rows that the points are arranged
+    # in. For each candidate angle we rotate the points and build a histogram of their vertical positions;
+    # when the angle matches the rows, the points of each row pile up into a few bins and the sum of squared
+    # bin counts peaks.
+
+    points = numpy.reshape(numpy.asarray(points, numpy.float64), (-1, 2))
+    if len(points) < 2:
+        return 0.0
+
+    candidates = numpy.radians(numpy.arange(-maxAngle, maxAngle + step/2, step))
+
+    # rotate every point by every candidate angle at once: rows are angles, columns are points.
+    rotatedY = numpy.outer(-numpy.sin(candidates), points[:,0]) + numpy.outer(numpy.cos(candidates), points[:,1])
+
+    bins = numpy.floor((rotatedY - rotatedY.min()) / binSize).astype(numpy.int64)
+    numBins = int(bins.max()) + 1
+    offsets = numpy.arange(len(candidates))[:,numpy.newaxis] * numBins
+
+    histograms = numpy.bincount((bins + offsets).ravel(), minlength=len(candidates)*numBins)
+    histograms = histograms.reshape(len(candidates), numBins).astype(numpy.float64)
+    scores = (histograms**2).sum(axis=1)
+
+    return math.degrees(candidates[scores.argmax()])
+
+# The result of fitLines: one entry per group. Angles are in degrees, and (x0, y0) is a point on each line.
+LineFit = namedtuple('LineFit', ['angles', 'slopes', 'intercepts', 'x0', 'y0'])
+
+def fitLines(points, offsets, robust=None, iterations=5, huberConstant=1.345):
+    # Fits a straight line to each of many groups of points at once. The points are given as one flat
+    # (n, 2) array, and group i is points[offsets[i]:offsets[i+1]]. Like cv2.fitLine with CV_DIST_L2, this
+    # minimises the perpendicular distance to each line, which copes with steep lines as well as flat ones.
+    #
+    # robust can be None (plain least squares), 'huber' or 'l1'. The robust versions re-weight the points
+    # by their distance from the line and re-fit a few times, so that outliers (such as the descenders
+    # along a baseline) have less pull.
+
+    points = numpy.reshape(numpy.asarray(points, numpy.float64), (-1, 2))
+    offsets = numpy.asarray(offsets, numpy.int64)
+    starts = offsets[:-1]
+    counts = numpy.diff(offsets)
+    groups = numpy.repeat(numpy.arange(len(counts)), counts)
+
+    x, y = points[:,0], points[:,1]
+    weights = numpy.ones(len(points))
+
+    for iteration in range(iterations if robust else 1):
+
+        totals = numpy.add.reduceat(weights, starts)
+        x0 = numpy.add.reduceat(weights*x, starts) / totals
+        y0 = numpy.add.reduceat(weights*y, starts) / totals
+
+        dx = x - x0[groups]
+        dy = y - y0[groups]
+        sxx = numpy.add.reduceat(weights*dx*dx, starts)
+        syy = numpy.add.reduceat(weights*dy*dy, starts)
+        sxy = numpy.add.reduceat(weights*dx*dy, starts)
+
+        # the direction of the principal axis of each group
+        radians = 0.5 * numpy.arctan2(2*sxy, sxx - syy)
+
+        if robust:
+            residuals = numpy.abs(-dx*numpy.sin(radians)[groups] + dy*numpy.cos(radians)[groups])
+            if robust == 'huber':
+                # scale the threshold by each group's mean absolute residual (x1.25 is the normal-distribution
+                # correction that turns it into a standard deviation).
+                scale = 1.2533 * numpy.add.reduceat(residuals, starts) / counts
+                threshold = numpy.maximum(huberConstant * scale, 1e-6)[groups]
+                weights = numpy.where(residuals <= threshold, 1.0, threshold / numpy.maximum(residuals, 1e-6))
+            elif robust == 'l1':
+                weights = 1.0 / numpy.maximum(residuals, 1e-6)
+            else:
+                raise ValueError("robust must be None, 'huber' or 'l1'")
+
+    with numpy.errstate(divide='ignore', invalid='ignore'):
+        slopes = numpy.tan(radians)
+        intercepts = y0 - slopes*x0
+
+    return LineFit(numpy.degrees(radians), slopes, intercepts, x0, y0)
+
 class PointArray:
 
     def __init__(self, points=[]):
@@ -261,6 +346,21 @@ class Line:
         self.points = PointArray(points)
         self.update()
 
+    @staticmethod
+    def fromFit(fit, index, multiplier=REACH):
+        # builds a line from one of the results of fitLines, with the same extent as leastSquaresLine uses.
+
+        line = Line()
+        radians = math.radians(fit.angles[index])
+        dx, dy = math.cos(radians), math.sin(radians)
+        x0, y0 = fit.x0[index], fit.y0[index]
+
+        line.start = Point(int(x0 - dx*multiplier), int(y0 - dy*multiplier))
+        line.end = Point(int(x0 + dx*multiplier), int(y0 + dy*multiplier))
+        line.angle = Angle(radians=radians)
+
+        return line
+
     def append(self, point):
 
         self.points.append(point)
@@ -309,7 +409,7 @@ class Line:
         # We find the line based on the angle and the first point. Note that in this case, the line
         # is effectively infinite.
 
-        hypotenuse = 4000
+        hypotenuse = REACH
         datum = self.points[0]
         angle = self.inputAngle + 90
 
@@ -331,7 +431,7 @@ class Line:
     def leastSquaresLine(self):
         # try to fit a least-squares trend line
 
-        multiplier = 2000
+        multiplier = REACH
         dx, dy, x0, y0 = cv2.fitLine(self.points.numpyArray(), cv2.cv.CV_DIST_L2, 0, 0.01, 0.01)
 
         self.start = Point(int(x0 - dx*multiplier), int(y0 - dy*multiplier))
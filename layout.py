@@ -0,0 +1,98 @@
+import numpy
+
+# Splits a page into columns and blocks with a recursive XY-cut. At each step the region is cut along every
+# blank gap in its horizontal or vertical projection profile, whichever has the more pronounced gaps, and
+# then each piece is split again, until no wide enough gaps are left. Cutting top to bottom before left to
+# right (and vice versa) gives the reading order for free, even on multi-column pages.
+#
+# The profiles are built from the bounding boxes of the page's characters rather than from the pixels, so
+# specks that were too small to be characters don't fill in the gaps, and every character ends up in
+# exactly one block.
+
+class Region:
+
+    def __init__(self, bounds, indices):
+
+        self.bounds = bounds        # (x, y, width, height)
+        self.indices = indices      # the items (usually characters) inside the region
+        self.direction = None       # 'rows' if split top to bottom, 'columns' if split side by side
+        self.children = []
+
+    def blocks(self):
+        # the regions that weren't split any further, in reading order.
+
+        if len(self.children) == 0:
+            return [self]
+        return [ block for child in self.children for block in child.blocks() ]
+
+    def columns(self):
+        # The regions which hold a single column of text, in reading order. A column may still be split
+        # into several blocks, but never side by side.
+
+        if not self.hasColumns():
+            return [self]
+        return [ column for child in self.children for column in child.columns() ]
+
+    def hasColumns(self):
+        return self.direction == 'columns' or any(child.hasColumns() for child in self.children)
+
+def xyCut(bounds, minBlockGap=24, minColumnGap=40, minColumnHeight=300):
+    # bounds is an (n, 4) array of (x, y, width, height) boxes, as in BoxArray.bounds. Gaps between blocks
+    # have to be at least minBlockGap rows, and gaps between columns at least minColumnGap pixels across.
+    # Only regions taller than minColumnHeight are split into columns, so that the gaps between the words
+    # of a short line (a running header, say) aren't taken for columns. Returns the root Region, or None if
+    # there are no boxes.
+
+    bounds = numpy.asarray(bounds, numpy.int64).reshape(-1, 4)
+    if len(bounds) == 0:
+        return None
+
+    return cut(bounds, numpy.arange(len(bounds)), minBlockGap, minColumnGap, minColumnHeight)
+
+def cut(bounds, indices, minBlockGap, minColumnGap, minColumnHeight):
+
+    left, top = bounds[indices, 0], bounds[indices, 1]
+    right, bottom = left + bounds[indices, 2], top + bounds[indices, 3]
+
+    x, y = int(left.min()), int(top.min())
+    width, height = int(right.max()) - x, int(bottom.max()) - y
+    region = Region((x, y, width, height), indices)
+
+    rowCuts = gaps(top - y, bottom - y, height, minBlockGap)
+    columnCuts = gaps(left - x, right - x, width, minColumnGap) if height > minColumnHeight else []
+
+    # split along whichever direction has the widest gap, relative to the smallest gap it allows.
+    rowScore = max([ size for position, size in rowCuts ] + [0]) / float(minBlockGap)
+    columnScore = max([ size for position, size in columnCuts ] + [0]) / float(minColumnGap)
+
+    if rowScore == 0 and columnScore == 0:
+        return region
+
+    if columnScore > rowScore:
+        region.direction = 'columns'
+        starts, cuts = left - x, columnCuts
+    else:
+        region.direction = 'rows'
+        starts, cuts = top - y, rowCuts
+
+    # every box lies wholly between two cuts, so its start says which piece it belongs to.
+    pieces = numpy.searchsorted([ position for position, size in cuts ], starts)
+    for piece in range(len(cuts) + 1):
+        region.children.append(cut(bounds, indices[pieces == piece], minBlockGap, minColumnGap, minColumnHeight))
+
+    return region
+
+def gaps(starts, ends, length, minGap):
+    # Finds the runs of at least minGap uncovered positions between 0 and length, given the start and
+    # (exclusive) end of each box along one axis. Returns a (middle, size) pair for each run.
+
+    coverage = numpy.zeros(length + 1, numpy.int64)
+    numpy.add.at(coverage, starts, 1)
+    numpy.add.at(coverage, ends, -1)
+    isBlank = numpy.cumsum(coverage)[:length] == 0
+
+    edges = numpy.diff(numpy.concatenate([[0], isBlank.astype(numpy.int8), [0]]))
+    runStarts, runEnds = numpy.flatnonzero(edges == 1), numpy.flatnonzero(edges == -1)
+    sizes = runEnds - runStarts
+
+    return [ (int(start + size // 2), int(size)) for start, size in zip(runStarts, sizes) if size >= minGap ]
@@ -2,24 +2,106 @@
 
 import sys
 import os
+import traceback
 from page import Page
+from pipeline import Pipeline
+from manifest import Manifest
+from duplicates import DuplicateIndex
+import structure
+import sources
 
 SHOW_STEPS = True    # change this to false if you just want to see the final output for each page.
 SAVE_OUTPUT = False
+SAVE_STRUCTURE = False  # save each page's structure as an .npz archive, plus a single book file for the folder.
+DESKEW = False       # straighten each page before analysing it.
+LAYOUT = False       # split each page into columns and blocks, and analyse those separately.
+ILLUSTRATIONS = False   # keep textured regions (engravings, halftones) out of the search for characters.
+DENOISE = False      # drop specks and scanning strips along the page edges before looking for characters.
+SOURCE_DPI = 300     # the resolution the pages were scanned at.
+WORKING_DPI = None   # analyse the pages at this (lower) resolution instead, e.g. 200 for 600 dpi scans.
+PREFETCH = 4         # how many images to decode ahead of the page being analysed.
+RESUME = True        # skip the pages that an earlier run has already finished (see manifest.py).
+SKIP_RESCANS = False # copy the structure of an earlier page to any rescan of it, rather than analysing it again.
+SKIP_BLANK = True    # don't look for characters on pages with next to no ink (blank versos, endpapers).
 
 inputFolder = os.path.join('../images')
 outputFolder = os.path.join('../output')
 
-for filename in os.listdir(inputFolder)[:]:
-#for filename in ['page332.jpg', 'page335.jpg']:
-    
-    inputPath = os.path.join(inputFolder, filename)
-    outputPath = os.path.join(outputFolder, filename)
+if not os.path.isdir(outputFolder):
+    os.makedirs(outputFolder)
 
-    page = Page(inputPath, SHOW_STEPS)
-    
-    if SAVE_OUTPUT:
-        page.save(outputPath)  # save a copy of what is displayed. Used for getting images for the paper.
-    
+# the manifest records each page as it's finished (or fails), so that a crashed run can pick up where it
+# left off. Failed pages are retried on the next run, up to a limit.
+manifestPath = os.path.join(outputFolder, 'manifest.json')
+if not RESUME and os.path.exists(manifestPath):
+    os.remove(manifestPath)
+manifest = Manifest(manifestPath)
+
+# the fingerprint and structure of each page analysed in this run, for spotting rescans (see duplicates.py).
+rescans = DuplicateIndex()
+
+def analyse(inputPath, image):
+    # returns the analysed Page or, for a rescan of an earlier page, a copy of that page's structure.
+
+    page = Page(inputPath, SHOW_STEPS, DESKEW, image, layout=LAYOUT, dpi=SOURCE_DPI, workingDpi=WORKING_DPI,
+                illustrations=ILLUSTRATIONS, denoise=DENOISE, skipBlank=SKIP_BLANK)
+
+    if SKIP_RESCANS:
+        match = rescans.find(page.fingerprint, page.greyscale)
+        if match is not None:
+            print "%s is a rescan of %s" %(manifest.key(inputPath), match.name)
+            return structure.PageStructure(structure.movePage(match.arrays, match.shift, page.path, page.image.shape))
+
+    page.analyse()
     page.show((800, 800))
 
+    if SKIP_RESCANS:
+        rescans.add(manifest.key(inputPath), page.fingerprint, structure.pageToArrays(page))
+
+    return page
+
+def output(inputPath, page):
+    # runs on the pipeline's output thread, so that writing files overlaps with analysing the next page.
+
+    outputPath = os.path.join(outputFolder, sources.pageName(inputPath))
+    outputs = []
+
+    if SAVE_OUTPUT and isinstance(page, Page):
+        page.save(outputPath)  # save a copy of what is displayed. Used for getting images for the paper.
+        outputs.append(outputPath)
+
+    if SAVE_STRUCTURE:
+        structurePath = os.path.splitext(outputPath)[0] + '.npz'
+        if isinstance(page, structure.PageStructure):
+            structure.saveArrays(page.arrays, structurePath)
+        else:
+            page.saveStructure(structurePath)
+        outputs.append(structurePath)
+
+    manifest.markDone(inputPath, outputs)
+
+def failed(inputPath, excInfo):
+    # a page that can't be read or analysed is noted in the manifest, and the run carries on without it.
+
+    error = ''.join(traceback.format_exception(*excInfo))
+    manifest.markFailed(inputPath, error)
+    print "failed on %s: %s" %(manifest.key(inputPath), traceback.format_exception_only(*excInfo[:2])[-1].strip())
+
+# every page of every file in the folder. Multi-page tiffs and pdfs are read a page at a time as they're
+# analysed (see sources.py), rather than split into separate images first.
+inputPaths = list(sources.folderPages(inputFolder))
+#inputPaths = [ os.path.join(inputFolder, filename) for filename in ['page332.jpg', 'page335.jpg'] ]
+
+Pipeline(analyse, output, prefetch=PREFETCH, onError=failed).run(manifest.pending(inputPaths))
+sources.closeAll()
+
+if SAVE_STRUCTURE:
+    # the book is made from every finished page's archive, including those from earlier runs.
+    archives = []
+    for structurePath in manifest.outputs(inputPaths, '.npz'):
+        with open(structurePath, 'rb') as archive:
+            archives.append(archive.read())
+    structure.writeBook(os.path.join(outputFolder, 'book.structor'), archives)
+
+for name, attempts, error in manifest.failures():
+    print "%s failed after %i attempts" %(name, attempts)
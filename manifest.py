@@ -0,0 +1,96 @@
+import os
+import json
+import threading
+
+# A record of how far a batch run has got, so that a run which is stopped part way through (or crashes) can
+# be started again without redoing the pages it has already finished. It holds one entry per page:
+#
+#   status    'done' or 'failed'
+#   outputs   the files written for the page, if it's done
+#   attempts  how many times the page has been tried
+#   error     the traceback of the last failure, if it failed
+#
+# The manifest is a JSON file, rewritten after every page. It is written to a temporary file which is then
+# renamed over the old one, so a crash part way through writing it never leaves it half written.
+
+MAX_ATTEMPTS = 3    # pages which have failed this many times are skipped, rather than tried again
+
+class Manifest:
+
+    def __init__(self, path, maxAttempts=MAX_ATTEMPTS):
+
+        self.path = path
+        self.maxAttempts = maxAttempts
+        self.lock = threading.Lock()    # pages are marked from both the analysis and the output threads
+
+        self.pages = {}
+        if os.path.exists(path):
+            with open(path) as manifestFile:
+                self.pages = json.load(manifestFile)
+
+    @staticmethod
+    def key(path):
+        # pages are known by their filename, so the input folder can be moved between runs.
+        return os.path.basename(path)
+
+    def isPending(self, path):
+        # true if the page hasn't been done yet, and hasn't run out of attempts.
+
+        entry = self.pages.get(self.key(path))
+        return entry is None or (entry['status'] == 'failed' and entry['attempts'] < self.maxAttempts)
+
+    def pending(self, paths):
+        return [ path for path in paths if self.isPending(path) ]
+
+    def markDone(self, path, outputs):
+
+        with self.lock:
+            entry = self.entry(path)
+            entry['status'] = 'done'
+            entry['outputs'] = list(outputs)
+            entry['error'] = None
+            self.save()
+
+    def markFailed(self, path, error):
+
+        with self.lock:
+            entry = self.entry(path)
+            entry['status'] = 'failed'
+            entry['error'] = error
+            self.save()
+
+    def entry(self, path):
+        # the page's entry, counting a new attempt at it.
+
+        entry = self.pages.setdefault(self.key(path), {'outputs': [], 'attempts': 0, 'error': None})
+        entry['attempts'] += 1
+        return entry
+
+    def outputs(self, paths, extension=None):
+        # the files written for each of the given pages which is done, in the order of the pages. extension
+        # picks out one kind of file, e.g. '.npz'.
+
+        outputs = []
+        for path in paths:
+            entry = self.pages.get(self.key(path))
+            if entry is None or entry['status'] != 'done':
+                continue
+            outputs.extend( output for output in entry['outputs']
+                            if extension is None or os.path.splitext(output)[1] == extension )
+
+        return outputs
+
+    def failures(self):
+        # (filename, attempts, error) for every page which failed on its last attempt.
+        return [ (name, entry['attempts'], entry['error']) for name, entry in sorted(self.pages.items())
+                 if entry['status'] == 'failed' ]
+
+    def save(self):
+
+        temporaryPath = self.path + '.tmp'
+        with open(temporaryPath, 'w') as output:
+            json.dump(self.pages, output, indent=1, sort_keys=True)
+
+        if os.name == 'nt' and os.path.exists(self.path):
+            os.remove(self.path)    # windows won't rename over an existing file
+        os.rename(temporaryPath, self.path)
@@ -1,20 +1,32 @@
 import cv2
+import numpy
 
 import colors
 import geometry as g
 from box import Box
+import skew
 import text
 
 class NaiveMargin:
     """ This is a simple approximation of the margin, used to get rid of marginal noise."""
 
-    def __init__(self, candidateLines):
+    def __init__(self, candidateLines, fullLineWidth=(1280, 1330)):
+        # lines whose width is between the two fullLineWidth limits are taken to run the full width of the text.
 
         self.candidateLines = candidateLines
 
-        fullLines = [line for line in self.candidateLines if 1280 < line.box.width < 1330]
-        left =  g.Line([ line.box.center.left  for line in fullLines ])
-        right = g.Line([ line.box.center.right for line in fullLines ])
+        minWidth, maxWidth = fullLineWidth
+        fullLines = [line for line in self.candidateLines if minWidth < line.box.width < maxWidth]
+        if len(fullLines) < 2:
+            # there aren't enough full-width lines to find the margin from, so we can't discard anything.
+            self.points = None
+            return
+
+        # fit both sides in one go
+        points = [ line.box.center.left for line in fullLines ] + [ line.box.center.right for line in fullLines ]
+        fit = g.fitLines(points, [0, len(fullLines), 2*len(fullLines)])
+        left = g.Line.fromFit(fit, 0)
+        right = g.Line.fromFit(fit, 1)
 
         # Make sure that 'start' means the same end for both geometric lines. This fixes a frustrating problem,
         # where in some pages most lines wouldn't be picked up.
@@ -25,10 +37,17 @@ class NaiveMargin:
 
         self.points = g.PointArray([left.start, left.end, right.end, right.start])
 
-    def selectLines(self):
+    def selectLines(self, lines=None):
+        # keeps the lines (by default, the ones the margin was fitted to) whose centers are inside the margin.
+
+        if lines is None:
+            lines = self.candidateLines
+
+        if self.points is None:
+            return text.LineCollection(lines)
 
         goodLines = text.LineCollection()
-        for line in self.candidateLines:
+        for line in lines:
             if self.contains(line.box.center.center):
                 goodLines.append(line)
 
@@ -56,6 +75,7 @@ class Margin:
         self.width = None
 
         self.angle = None
+        self.extents = None     # (left, right, top, bottom), measured along and across the margin's angle
 
         if lineCollection:
             self.fit(lineCollection)
@@ -71,6 +91,10 @@ class Margin:
 
         self.angle = lines.avgAngle
 
+        if abs(g.Angle(self.angle).degrees()) <= skew.TOLERANCE:
+            self.fitAxisAligned(borderPoints)
+            return
+
         # interestingly, it's faster to sort the whole list, which is theoretical O(n log n), than it is
         # to do a min operation followed by a max operation, both of which are O(n).
         sortedHorizontally = sorted(borderPoints, key=lambda point: point.rotate(self.angle).x)
@@ -89,6 +113,81 @@ class Margin:
         self.height = abs( topPoint.rotate(self.angle).y - bottomPoint.rotate(self.angle).y )
         self.width  = abs( leftPoint.rotate(self.angle).x - rightPoint.rotate(self.angle).x )
 
+        self.extents = (leftPoint.rotate(self.angle).x, rightPoint.rotate(self.angle).x,
+                        topPoint.rotate(self.angle).y, bottomPoint.rotate(self.angle).y)
+
+    def fitAxisAligned(self, borderPoints):
+        # On a deskewed page the margin is (near enough) axis-aligned, so the extreme points can be read
+        # straight off the raw coordinates, without rotating or sorting anything.
+
+        coordinates = numpy.array([[point.x, point.y] for point in borderPoints])
+        xs = coordinates[:,0]
+        ys = coordinates[:,1]
+
+        leftPoint = borderPoints[int(xs.argmin())]
+        rightPoint = borderPoints[int(xs.argmax())]
+        topPoint = borderPoints[int(ys.argmin())]
+        bottomPoint = borderPoints[int(ys.argmax())]
+
+        self.left = g.Line([leftPoint], self.angle)
+        self.right = g.Line([rightPoint], self.angle)
+        self.top = g.Line([topPoint], self.angle+90)
+        self.bottom = g.Line([bottomPoint], self.angle+90)
+
+        self.height = abs( topPoint.y - bottomPoint.y )
+        self.width  = abs( leftPoint.x - rightPoint.x )
+
+        self.extents = (leftPoint.x, rightPoint.x, topPoint.y, bottomPoint.y)
+
+    def classifyLines(self, lines, figureMinHeight=300):
+        # Works out the role of every line on the page at once, from where each line sits relative to the
+        # margin. Distances are measured in multiples of the typical line height, so that they don't depend
+        # on the resolution of the scan. Returns a dict of boolean arrays (one entry per line), and also sets
+        # the same flags on the lines themselves.
+
+        corners = numpy.array([ line.box.points for line in lines ], numpy.float64).reshape(-1, 4, 2)
+        radians = g.Angle(self.angle).radians()
+        sin, cos = numpy.sin(radians), numpy.cos(radians)
+
+        # line extents, measured along and across the margin's angle (the same frame as self.extents)
+        rotatedX = corners[:,:,0]*cos + corners[:,:,1]*sin
+        rotatedY = -corners[:,:,0]*sin + corners[:,:,1]*cos
+        left, right = rotatedX.min(axis=1), rotatedX.max(axis=1)
+        width = right - left
+        height = rotatedY.max(axis=1) - rotatedY.min(axis=1)
+
+        attributes = {}
+        attributes['isFigure'] = numpy.array([ line.box.height > figureMinHeight or line.hasIllustration
+                                               for line in lines ], bool)
+
+        lineHeight = numpy.median(height) if len(lines) > 0 else 0.0
+        attributes['isHorizontalRule'] = (height < 0.5*lineHeight) & (width > 10*height)
+
+        isText = ~(attributes['isFigure'] | attributes['isHorizontalRule'])
+
+        # The margin is fitted to the outermost points of the text, so a single speck of noise can push it
+        # out. Most lines run the full width of the text block, so their typical edges are a steadier
+        # reference; we only fall back on the margin itself if there's no text to measure.
+        if numpy.any(isText):
+            marginLeft, marginRight = numpy.median(left[isText]), numpy.median(right[isText])
+        else:
+            marginLeft, marginRight = self.extents[0], self.extents[1]
+        indent = left - marginLeft
+        rightGap = marginRight - right
+
+        attributes['isCentered'] = isText & (indent > 2*lineHeight) & (rightGap > 2*lineHeight) & \
+                                   (numpy.abs(indent - rightGap) < lineHeight)
+
+        isBody = isText & ~attributes['isCentered']
+        attributes['isParagraphStart'] = isBody & (indent > 0.5*lineHeight) & (indent < 3*lineHeight)
+        attributes['isParagraphEnd'] = isBody & (rightGap > lineHeight)
+
+        for i, line in enumerate(lines):
+            for name, values in attributes.items():
+                setattr(line, name, bool(values[i]))
+
+        return attributes
+
     def selectBorderWords(self, lines):
 
         borderWords = []
@@ -3,51 +3,540 @@ import math
 import numpy
 import subprocess
 import os
+from multiprocessing.pool import ThreadPool
 
 import colors
+import duplicates
 import geometry as g
+import layout
+import render
+import sources
+from content import Content
+import skew
+import structure
 import text
+import texture
+from box import BoxArray
 from dimension import Dimension
+from margin import Margin, NaiveMargin
+from parameters import Parameters, REFERENCE_DPI
 from stopwatch import Stopwatch
 import numpy
 
 stopwatch = Stopwatch()
 
-class Page:
+UNKNOWN = object()      # marks a part of the page that hasn't been worked out yet (None is a valid result)
 
-    def __init__(self, path, showSteps=False):
+class Page(object):
+
+    def __init__(self, path, showSteps=False, deskew=False, image=None, threads=1, parameters=None, boxes=None,
+                 layout=False, dpi=REFERENCE_DPI, workingDpi=None, illustrations=False, denoise=False,
+                 skipBlank=False):
+        # image is the already-decoded colour image, if the caller has it (see pipeline.py). threads > 1
+        # splits the page into bands and works on them in parallel, for when one page needs to be fast.
+        # parameters overrides the tuning defaults (see parameters.py), and boxes is a cached BoxArray of the
+        # page's contours (see sweep.py), so that they don't have to be traced again. With layout, the page
+        # is first split into columns and blocks (see layout.py), and those are analysed separately. With
+        # illustrations, textured regions such as engravings are found up front (see texture.py) and kept out
+        # of the search for characters; each one goes through the rest of the analysis as a single outline.
+        # denoise drops specks and the dark strips along the page's edges as soon as the contours are traced,
+        # rather than leaving them for NaiveMargin to throw out once they've been made into lines. With
+        # skipBlank, a page with next to no ink on it (see texture.isBlank) isn't searched for characters,
+        # and so comes out with an empty structure.
+        #
+        # dpi is the resolution of the scan. If workingDpi is lower, the page is shrunk to that resolution
+        # before it's analysed, which is much faster for high resolution scans. Everything the analysis finds
+        # (characters, figures, words, lines, margin, content) is then in working coordinates, so that it can
+        # be compared with the parameters and the greyscale page; toSource() maps them back to the scan (as the
+        # renderer and structure files do), and sourceFigures, sourceWords and sourceLines give their boxes
+        # at the scan's resolution.
+        #
+        # Nothing is analysed here. Each part of the page's structure (binary, characters, words, lines,
+        # margin, content, boilerplate) is worked out the first time it's asked for, along with whatever it
+        # depends on, and then kept. A job that only wants the figures never pays for finding words, for
+        # instance. analyse() works out everything at once.
 
         stopwatch.reset(path)
 
+        self.path = path
         self.showSteps = showSteps
-        greyscaleImage = cv2.imread(path, cv2.CV_LOAD_IMAGE_GRAYSCALE)
-        colorImage = cv2.imread(path, cv2.CV_LOAD_IMAGE_COLOR)
+        self.deskew = deskew
+        self.threads = threads
+        self.dpi = dpi
+        self.workingDpi = min(workingDpi, dpi) if workingDpi is not None else dpi
+        self.scale = float(self.workingDpi) / dpi   # working coordinates per source coordinate
+
+        # the parameters, with their sizes converted to pixels at the working resolution.
+        if parameters is None:
+            parameters = Parameters()
+        self.parameters = parameters.atResolution(self.workingDpi)
+        self.useLayout = layout
+        self.maskIllustrations = illustrations
+        self.denoise = denoise
+        self.skipBlank = skipBlank
+        self.isAxisAligned = deskew     # a deskewed page is straight, so boxes can skip minAreaRect.
+
+        self.sourceImage = image    # as decoded, before any deskewing
+        self.cachedBoxes = boxes
+
+        self._image = None          # each of these is filled in by the property of the same name
+        self._greyscale = None
+        self._skewAngle = None
+        self._binary = None
+        self._isBlank = None
+        self._fingerprint = None
+        self._illustrations = None
+        self._characters = None
+        self._characterBounds = None
+        self._layout = UNKNOWN
+        self._figures = None
+        self._words = None
+        self._lines = None
+        self._margin = UNKNOWN
+        self._columns = None
+        self._textAngle = None      # these two are set along with the lines, and kept for reanalyse()
+        self._naiveMargin = None
+        self._content = UNKNOWN
+        self._boilerplate = UNKNOWN
+
+        self.overlays = {}          # cached render.Overlay instances, by scale
+        self.timings = []           # (stage, seconds) pairs, in the order the stages ran
+
+    def lap(self, message, name=None):
+        # records how long the stage that just finished took.
+
+        stopwatch.lap(message, name)
+        self.timings.append(stopwatch.laps[-1])
+
+    def analyse(self):
+        # works out every part of the page's structure, if it hasn't been already.
+
+        self.image
+        self.boilerplate
+
+        stopwatch.endRun()
+        return self
+
+    def toSource(self, points):
+        # maps points (or any array of coordinates) found by the analysis back to the scan's resolution.
+        return numpy.asarray(points, numpy.float64) / self.scale
+
+    def sourceCorners(self, boxes):
+        # the corners of each box (or word or line) as an (n, 4, 2) array, at the scan's resolution.
+        points = [ getattr(box, 'box', box).points for box in boxes ]
+        return self.toSource(numpy.array(points, numpy.float64).reshape(-1, 4, 2))
+
+    @property
+    def sourceFigures(self):
+        return self.sourceCorners(self.figures)
+
+    @property
+    def sourceWords(self):
+        return self.sourceCorners(self.words if self.words is not None else [])
+
+    @property
+    def sourceLines(self):
+        return self.sourceCorners(self.lines if self.lines is not None else [])
+
+    @property
+    def image(self):
+        # the colour page at the scan's resolution, straightened if we're deskewing.
+        if self._image is None:
+            self.prepareImages()
+        return self._image
+
+    @property
+    def greyscale(self):
+        # the greyscale page at the working resolution. This is what the analysis works on.
+        if self._greyscale is None:
+            self.prepareImages()
+        return self._greyscale
+
+    @property
+    def skewAngle(self):
+        if self._skewAngle is None:
+            self.prepareImages()
+        return self._skewAngle
+
+    def prepareImages(self):
+
+        stopwatch.restart()
+
+        # decode the file once, and derive the greyscale version from the colour one (shrinking it first, if
+        # we're working at a lower resolution).
+        colorImage = self.sourceImage
+        if colorImage is None:
+            colorImage = sources.decode(self.path)
+
+        workingImage = colorImage
+        if self.scale < 1:
+            height, width = colorImage.shape[:2]
+            size = (int(round(width * self.scale)), int(round(height * self.scale)))
+            workingImage = cv2.resize(colorImage, size, interpolation=cv2.INTER_AREA)
+        greyscaleImage = cv2.cvtColor(workingImage, cv2.COLOR_BGR2GRAY)
+
+        # If requested, straighten the page before doing anything else. Every later stage then works in
+        # axis-aligned coordinates, rather than having to rotate its points to match the page.
+        self._skewAngle = 0.0
+        if self.deskew:
+            self._skewAngle = skew.estimateSkew(greyscaleImage)
+            if abs(self._skewAngle) > skew.TOLERANCE:
+                greyscaleImage = skew.rotate(greyscaleImage, self._skewAngle)
+                colorImage = skew.rotate(colorImage, self._skewAngle)
+            self.lap("deskewed page by %.2f degrees" %self._skewAngle, "deskewed page")
 
         if False:
             self.display(colorImage)
 
-        self.characters = text.CharacterSet(greyscaleImage)
-        self.words = self.characters.getWords()
+        self._image = colorImage
+        self._greyscale = greyscaleImage
 
-        self.image = colorImage
+    @property
+    def fingerprint(self):
+        # a summary of how the page looks, for spotting rescans of pages that have already been analysed
+        # (see duplicates.py). It's taken from the greyscale page, so it costs little more than decoding.
+        if self._fingerprint is None:
+            greyscaleImage = self.greyscale
+            stopwatch.restart()
+            self._fingerprint = duplicates.Fingerprint(greyscaleImage, self.image.shape)
+            self.lap("fingerprinted page")
+        return self._fingerprint
+
+    @property
+    def binary(self):
+        # the page thresholded the same way as for finding characters: ink is white, paper is black.
+        if self._binary is None:
+            self._binary = text.binarise(self.greyscale)
+        return self._binary
+
+    @property
+    def isBlank(self):
+        # true if the page has next to no ink on it. This is checked on a shrunken copy of the page, so it
+        # costs next to nothing.
+        if self._isBlank is None:
+            greyscaleImage = self.greyscale
+            stopwatch.restart()
+            self._isBlank = texture.isBlank(greyscaleImage, self.parameters.blankSampleSize,
+                    self.parameters.edgeCloseness, self.parameters.maxBlankInk, self.parameters.maxBlankComponents)
+            self.lap("checked for a blank page")
+        return self._isBlank
+
+    @property
+    def illustrations(self):
+        # (x, y, width, height) rectangles around the textured parts of the page, which are likely to be
+        # illustrations. These are found from the pixels alone, without tracing any contours.
+        if self._illustrations is None:
+            binaryImage = self.binary
+            stopwatch.restart()
+            self._illustrations = texture.findIllustrations(binaryImage, self.greyscale,
+                    self.parameters.textureCellSize, self.parameters.minCellComponents,
+                    self.parameters.minIllustrationCells)
+            self.lap("found illustrations")
+        return self._illustrations
+
+    @property
+    def characters(self):
+        if self._characters is None:
+            greyscaleImage = self.greyscale
+            boxes = self.cachedBoxes
+            illustrations = None
+            if self.skipBlank and self.isBlank:
+                boxes = BoxArray([], self.isAxisAligned)    # nothing to trace, so every later stage has nothing to do
+            elif self.maskIllustrations:
+                illustrations = self.illustrations
+            stopwatch.restart()
+            self._characters = text.CharacterSet(greyscaleImage, self.isAxisAligned, self.threads, self.parameters,
+                                                 boxes, illustrations, self.denoise)
+            self.lap("found characters")
+        return self._characters
+
+    @property
+    def characterBounds(self):
+        # the (x, y, width, height) box around each character.
+        if self._characterBounds is None:
+            contours = [ character.contour for character in self.characters.characters ]
+            self._characterBounds = BoxArray(contours, axisAligned=True).bounds.reshape(-1, 4)
+        return self._characterBounds
+
+    @property
+    def layout(self):
+        # the root layout.Region, cut along the gaps between the characters (None if there aren't any).
+        if self._layout is UNKNOWN:
+            bounds = self.characterBounds
+            stopwatch.restart()
+            self._layout = layout.xyCut(bounds, self.parameters.minBlockGap, self.parameters.minColumnGap,
+                                        self.parameters.minColumnHeight)
+            self.lap("found layout")
+        return self._layout
+
+    @property
+    def figures(self):
+        # Boxes around the likely figures on the page: any outline taller than a figure is allowed to be,
+        # unless it's up against the edge of the page, where scanning leaves dark strips. This only needs
+        # the characters' outlines, so it skips the neighbour search and everything after it. Like words and
+        # lines, these are in working coordinates (see sourceFigures).
+        if self._figures is None:
+            bounds = self.characterBounds
+            characters = self.characters.characters
+            shape = self.greyscale.shape
+
+            isTall = numpy.flatnonzero(bounds[:,3] > self.parameters.figureMinHeight)
+            boxes = BoxArray([ characters[i].contour for i in isTall ], self.isAxisAligned)
+            self._figures = [ box for box in boxes if not box.isTouchingEdge(shape, self.parameters.edgeCloseness) ]
+        return self._figures
+
+    @property
+    def words(self):
+        if self._words is None:
+            characters = self.characters
+            groups = None
+            if self.useLayout and self.layout is not None:
+                groups = [ block.indices for block in self.layout.blocks() ]
+
+            stopwatch.restart()
+            self._words = characters.getWords(groups)
+            self.lap("found words")
+        return self._words
+
+    @property
+    def lines(self):
+        if self._lines is None:
+            self.getBuildingBlocks()
+        return self._lines
+
+    @property
+    def margin(self):
+        if self._margin is UNKNOWN:
+            self.getBuildingBlocks()
+        return self._margin
+
+    @property
+    def content(self):
+        if self._content is UNKNOWN:
+            self.getContent()
+        return self._content
+
+    @property
+    def boilerplate(self):
+        # Nothing finds the boilerplate yet, so this is always None. It is worked out after the content,
+        # since that's where it will come from.
+        if self._boilerplate is UNKNOWN:
+            self.content
+            self._boilerplate = None
+        return self._boilerplate
+
+    def getBuildingBlocks(self):
+        # group words into lines, discard marginal noise, and fit a margin around what's left. With a layout,
+        # lines are found block by block, and each column gets its own margin and content.
+
+        words = self.words
+        if self.useLayout and self.layout is not None:
+            stopwatch.restart()
+            self._columns = self.getColumnLines()
+        else:
+            stopwatch.restart()
+            self._textAngle = self.getTextAngle(words)
+            self._columns = [text.getLines(words, self.isAxisAligned, self._textAngle)]
+
+        allLines = text.LineCollection([ line for column in self._columns for line in column ])
+        self._naiveMargin = NaiveMargin(allLines, self.parameters.fullLineWidth)
+        self._lines = self._naiveMargin.selectLines()
+
+        self._margin = None
+        if len(self._lines) > 0:
+            self._margin = Margin(self._lines)
+
+        self.lap("found lines and margin")
+
+    def getContent(self):
+        # classify the lines of each column as figures, paragraphs and so on.
+
+        margin = self.margin
+        stopwatch.restart()
+
+        self._content = None
+        if margin is None:
+            return
+
+        goodLines = set( id(line) for line in self.lines )
+        for column in self._columns:
+            columnLines = text.LineCollection([ line for line in column if id(line) in goodLines ])
+            if len(columnLines) == 0:
+                continue
+
+            # usually every line is in one column (the others being noise), and the page margin will do.
+            columnMargin = margin if len(columnLines) == len(self.lines) else Margin(columnLines)
+            attributes = columnMargin.classifyLines(columnLines, self.parameters.figureMinHeight)
+            content = Content(columnLines.copy(), attributes=attributes)
+
+            if self._content is None:
+                self._content = content
+            else:
+                self._content.extend(content)
+
+        self.lap("found content")
+
+    def getColumnLines(self):
+        # Finds the lines in each block of the layout separately. The text's angle is measured once for the
+        # whole page, since a small block has too few words to measure it from. Returns a list of lines for
+        # each column, in reading order.
+
+        angle = self._textAngle = self.getTextAngle(self.words)
+
+        # each word was found within one block, so any of its characters says which block it's in.
+        characterBlock = {}
+        blocks = self.layout.blocks()
+        for blockNum, block in enumerate(blocks):
+            for index in block.indices:
+                characterBlock[id(self.characters.characters[index])] = blockNum
+
+        blockWords = [ [] for block in blocks ]
+        for word in self.words:
+            character = next(iter(word.characters))
+            blockWords[characterBlock[id(character)]].append(word)
+
+        findLines = lambda words: text.getLines(words, self.isAxisAligned, angle)
+        if self.threads > 1:
+            pool = ThreadPool(self.threads)
+            try:
+                blockLines = pool.map(findLines, blockWords)
+            finally:
+                pool.close()
+        else:
+            blockLines = map(findLines, blockWords)
+
+        blockNumbers = dict( (id(block), blockNum) for blockNum, block in enumerate(blocks) )
+        return [ [ line for block in column.blocks() for line in blockLines[blockNumbers[id(block)]] ]
+                 for column in self.layout.columns() ]
+
+    def reanalyse(self, region, figure=False):
+        # Updates the page after an operator has corrected one (x, y, width, height) region of it, given in
+        # the scan's coordinates. With figure, everything in the region is one figure (one that was missed,
+        # say). Otherwise the region is text, and its characters are traced again (where an illustration
+        # was masked out by mistake, say).
+        #
+        # Only the characters, words and lines around the region are worked out again, and the content is
+        # classified again from the first line that has changed, so this takes milliseconds rather than the
+        # second or so that a whole page does. The margin is kept as it was. A page with a layout is redone
+        # from its characters on instead, since any change can move the cuts between blocks.
+
+        self.content    # everything up to the content has to have been worked out first
+        stopwatch.restart()
+
+        x, y, width, height = [ value * self.scale for value in region ]
+        region = (int(math.floor(x)), int(math.floor(y)), int(math.ceil(width)), int(math.ceil(height)))
+        removed, added = self.characters.reanalyseRegion(self.greyscale, region, figure)
+
+        self._characterBounds = None
+        self._layout = UNKNOWN
+        self._figures = None
+        self.overlays = {}
+
+        if self.useLayout or self._content is None or len(self._columns) != 1:
+            for character in self.characters.characters:
+                character.nearestNeighbours = []
+                character.parentWord = None
+            self._words = None
+            self._lines = None
+            self._margin = UNKNOWN
+            self._columns = None
+            self._content = UNKNOWN
+            self._boilerplate = UNKNOWN
+            self.lap("reanalysed region")
+            return self
+
+        oldWords, newWords = self.characters.regroupWords(self._words, removed, added)
+        isGone = set( id(word) for word in oldWords )
+        self._words = [ word for word in self._words if id(word) not in isGone ] + newWords
+
+        # Find the lines again for the words which have changed, along with the rest of the words in their
+        # lines and in any line the new words are next to.
+        column = self._columns[0]
+        isAffected = set( id(line) for line in column if any(id(word) in isGone for word in line.words) )
+        if len(newWords) > 0:
+            corners = numpy.array([ word.box.points for word in newWords ], numpy.float64).reshape(-1, 2)
+            reach = self.characters.maxDistance
+            low, high = corners.min(axis=0) - reach, corners.max(axis=0) + reach
+            for line in column:
+                points = numpy.array(line.box.points, numpy.float64).reshape(-1, 2)
+                if numpy.all(points.min(axis=0) <= high) and numpy.all(points.max(axis=0) >= low):
+                    isAffected.add(id(line))
+
+        words = newWords + [ word for line in column if id(line) in isAffected
+                             for word in line.words if id(word) not in isGone ]
+        newLines = list(text.getLines(words, self.isAxisAligned, self._textAngle))
+        keptLines = [ line for line in column if id(line) not in isAffected ]
+
+        # slot the new lines in among the others, from the top of the page down.
+        radians = math.radians(self._textAngle or 0.0)
+        row = lambda line: numpy.dot(numpy.mean(line.box.points, axis=0), [-math.sin(radians), math.cos(radians)])
+        newLines.sort(key=row)
+        allLines = []
+        while len(keptLines) > 0 or len(newLines) > 0:
+            if len(newLines) == 0 or (len(keptLines) > 0 and row(keptLines[0]) <= row(newLines[0])):
+                allLines.append(keptLines.pop(0))
+            else:
+                allLines.append(newLines.pop(0))
+
+        self._columns = [allLines]
+        self._lines = self._naiveMargin.selectLines(allLines)
+
+        if len(self._lines) > 0:
+            attributes = self._margin.classifyLines(self._lines, self.parameters.figureMinHeight)
+            self._content.update(self._lines.copy(), attributes)
+        else:
+            self._content = None
+
+        self.lap("reanalysed region")
+        return self
+
+    def getTextAngle(self, words):
+        # the angle of the lines of text, found from the words' centers (zero if the page is straight).
+
+        if self.isAxisAligned:
+            return 0.0
+        if len(words) == 0:
+            return None
+        return g.dominantAngle(numpy.array([ word.center for word in words ]), binSize=2.0)
 
-        stopwatch.lap("finished analysing page")
-        stopwatch.endRun()
-        
-    
     def paint(self, image):
 
         print len(self.words)
         for word in self.words:
             image = word.paint(image, colors.RED)
 
+        if self.lines is not None:
+            image = self.lines.paint(image, colors.GREEN)
+        if self.margin is not None:
+            image = self.margin.paint(image, colors.BLUE)
+        if self.content is not None:
+            image = self.content.paint(image)
+
         return image
 
+    def render(self, scale=1.0):
+        # Draws the page's structure over a copy of the page, scaled by `scale`. The overlay for each scale
+        # is drawn once and kept, so redrawing the same page (e.g. in a viewer) only costs a resize.
+
+        if scale not in self.overlays:
+            self.overlays[scale] = render.fromPage(self, scale)
+            self.overlays[scale].render()
+
+        if scale == 1.0:
+            image = self.image.copy()
+        else:
+            image = cv2.resize(self.image, self.overlays[scale].size, interpolation=cv2.INTER_AREA)
+
+        return self.overlays[scale].composite(image)
+
     def save(self, path):
 
-        image = self.image.copy()
-        image = self.paint(image)
-        cv2.imwrite(path, image)
+        cv2.imwrite(path, self.render())
+
+    def saveStructure(self, path):
+        # save the page's structure (rather than a picture of it) for use by other tools.
+
+        structure.savePage(self, path)
 
     def display(self, image, boundingBox=(800,800), title='Image'):
 
@@ -67,12 +556,18 @@ class Page:
 
     def show(self, boundingBox=None, title="Image"):    #textImage
 
-        #image = numpy.zeros(self.image.shape, numpy.uint8)
-        image = self.image.copy()
-        
-        image = self.paint(image)
+        # draw straight at the size it will be displayed at, rather than painting the full-size page and
+        # then shrinking it.
+        scale = 1.0
+        if boundingBox:
+            maxDimension = Dimension(boundingBox[0], boundingBox[1])
+            displayDimension = Dimension(self.image.shape[1], self.image.shape[0])
+            displayDimension.fitInside(maxDimension)
+            scale = float(displayDimension.x) / self.image.shape[1]
+
+        image = self.render(scale)
 
-        self.display(image, boundingBox, title)
+        self.display(image, None, title)
 
     def extractWords(self, sourceImage):
 
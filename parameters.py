@@ -0,0 +1,79 @@
+REFERENCE_DPI = 300     # the resolution that the pixel measurements below are given at
+
+# The parameters which are measured in pixels, and so have to be scaled with the resolution. Thin strokes
+# break up into more specks the finer the scan, so minCellComponents grows with the resolution too.
+LENGTHS = ['fullLineWidth', 'figureMinHeight', 'edgeCloseness', 'minBlockGap', 'minColumnGap', 'minColumnHeight',
+           'textureCellSize', 'minCellComponents', 'blankSampleSize', 'bandOverlap']
+AREAS = ['minCharacterArea']
+
+class Parameters:
+    # The tunable numbers that drive the analysis, gathered in one place so that they can be swept and
+    # tuned (see sweep.py). Parameters() gives the defaults; Parameters(minCharacterArea=80) overrides one.
+    #
+    # Sizes are in pixels at REFERENCE_DPI, which is what our scans come in at. atResolution converts them
+    # for a page scanned (or analysed) at another resolution.
+
+    defaults = {
+        'minCharacterArea': 50,             # contours with a smaller box (in square pixels) are ignored
+        'neighbourCount': 2,                # how many nearest neighbours to look at (including the point itself)
+        'neighbourDistanceFactor': 2.0,     # neighbours further than this many average NN distances are ignored
+        'fullLineWidth': (1280, 1330),      # lines between these widths are full lines, for NaiveMargin
+        'figureMinHeight': 300,             # lines taller than this are figures
+        'edgeCloseness': 50,                # outlines this close to the page edge are scanning noise, not figures
+        'minBlockGap': 24,                  # blank rows needed between two blocks, for layout.xyCut
+        'minColumnGap': 40,                 # blank columns needed between two columns of text
+        'minColumnHeight': 300,             # regions shorter than this aren't split into columns
+        'textureCellSize': 32,              # the size of the grid cells that illustrations are found in (texture.py)
+        'minCellComponents': 40,            # cells with at least this many specks of ink are part of an illustration
+        'minIllustrationCells': 4,          # illustrations smaller than this many cells are ignored
+        'blankSampleSize': 4,               # the page is shrunk by this much to check whether it's blank
+        'maxBlankInk': 0.001,               # pages with less ink than this (as a fraction) are blank,
+        'maxBlankComponents': 50,           # as long as it's in fewer than this many specks
+        'bandOverlap': 120,                 # rows traced past each cut when a page is split into bands (text.py)
+    }
+
+    def __init__(self, **overrides):
+
+        for name in overrides:
+            if name not in self.defaults:
+                raise TypeError('unknown parameter: %s' %name)
+
+        for name, value in self.defaults.items():
+            setattr(self, name, overrides.get(name, value))
+
+        self.dpi = REFERENCE_DPI
+
+    def atResolution(self, dpi):
+        # a copy with every size converted to pixels at the given resolution.
+
+        scale = float(dpi) / self.dpi
+        values = self.asDict()
+
+        for name in LENGTHS:
+            if isinstance(values[name], tuple):
+                values[name] = tuple( value * scale for value in values[name] )
+            else:
+                values[name] = values[name] * scale
+        for name in AREAS:
+            values[name] = values[name] * scale * scale
+
+        parameters = Parameters(**values)
+        parameters.dpi = dpi
+        return parameters
+
+    def copy(self, **overrides):
+
+        values = self.asDict()
+        values.update(overrides)
+
+        parameters = Parameters(**values)
+        parameters.dpi = self.dpi
+        return parameters
+
+    def asDict(self):
+        return dict( (name, getattr(self, name)) for name in self.defaults )
+
+    def __repr__(self):
+        changed = [ '%s=%r' %(name, value) for name, value in sorted(self.asDict().items())
+                    if value != self.defaults[name] ]
+        return 'Parameters(%s)' %', '.join(changed)
@@ -0,0 +1,129 @@
+import sys
+import threading
+import Queue
+from multiprocessing.pool import ThreadPool
+
+from sources import decode
+
+# A three stage pipeline for working through many pages:
+#
+#   decode  -- a small thread pool reads and decodes the next few images ahead of time
+#   analyse -- runs in the calling thread, one page at a time
+#   output  -- a background thread writes results, so analysis never waits on the disk
+#
+# The stages are joined by bounded queues, so at most `prefetch` decoded images and `outputQueueSize`
+# finished pages are held in memory at once. cv2 releases the GIL while decoding and encoding images, so
+# on a slow (e.g. network) share the reads and writes overlap with the analysis instead of adding to it.
+# This is plain threads rather than asyncio, since we're on Python 2.7.
+
+DONE = object()     # marks the end of a queue
+
+class Pipeline:
+
+    def __init__(self, analyse, output=None, prefetch=4, decodeThreads=2, outputQueueSize=4, decoder=decode,
+                 onError=None):
+        # Paths can be pages of multi-page files (see sources.py), which decode reads one at a time.
+        # analyse(path, image) returns a result (usually a Page), which is then passed to output(path, result).
+        # Normally the first error (in decoding, analysing or output) stops the run and is raised by run(). If
+        # onError is given, it is called as onError(path, sys.exc_info()) instead, and the run carries on
+        # with the next page.
+
+        self.analyse = analyse
+        self.output = output
+        self.prefetch = prefetch
+        self.decodeThreads = decodeThreads
+        self.outputQueueSize = outputQueueSize
+        self.decoder = decoder
+        self.onError = onError
+
+        self.error = None
+
+    def run(self, paths):
+
+        pool = ThreadPool(self.decodeThreads)
+        decoded = Queue.Queue(self.prefetch)        # holds (path, AsyncResult) pairs, in page order
+        finished = Queue.Queue(self.outputQueueSize)
+        self.stopping = threading.Event()
+
+        feeder = threading.Thread(target=self.feed, args=(paths, pool, decoded))
+        feeder.daemon = True
+        feeder.start()
+
+        writer = threading.Thread(target=self.write, args=(finished,))
+        writer.daemon = True
+        writer.start()
+
+        try:
+            while self.error is None:
+                try:
+                    item = decoded.get(timeout=0.1)
+                except Queue.Empty:
+                    continue
+                if item is DONE:
+                    break
+
+                path, pendingImage = item
+                try:
+                    result = self.analyse(path, pendingImage.get())
+                except Exception:
+                    if self.onError is None:
+                        raise
+                    self.onError(path, sys.exc_info())
+                    continue
+                self.offer(finished, (path, result))
+        finally:
+            self.stopping.set()
+            finished.put(DONE)      # the writer always drains this queue, so this can't block for long
+            writer.join()
+            pool.terminate()
+
+        if self.error is not None:
+            raise self.error[0], self.error[1], self.error[2]
+
+    def offer(self, queue, item):
+        # like queue.put, but gives up if another stage has failed (or we're stopping), rather than blocking
+        # forever.
+
+        while self.error is None and not self.stopping.is_set():
+            try:
+                queue.put(item, timeout=0.1)
+                return True
+            except Queue.Full:
+                pass
+
+        return False
+
+    def feed(self, paths, pool, decoded):
+        # Submits decode jobs, staying at most `prefetch` images ahead of the analysis (the queue blocks
+        # when it's full).
+
+        try:
+            for path in paths:
+                if self.stopping.is_set():
+                    return
+                pendingImage = pool.apply_async(self.decoder, (path,))
+                if not self.offer(decoded, (path, pendingImage)):
+                    return
+        except Exception:
+            self.error = sys.exc_info()     # e.g. the list of paths came from a generator that failed
+            return
+
+        self.offer(decoded, DONE)
+
+    def write(self, finished):
+
+        while True:
+            item = finished.get()
+            if item is DONE:
+                return
+            if self.output is None or self.error is not None:
+                continue
+
+            path, result = item
+            try:
+                self.output(path, result)
+            except Exception:
+                if self.onError is None:
+                    self.error = sys.exc_info()
+                else:
+                    self.onError(path, sys.exc_info())
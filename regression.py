@@ -0,0 +1,139 @@
+#!/usr/bin/python
+
+import os
+import sys
+import json
+
+import evaluate
+import page as pageModule
+import pipeline
+import structure
+from page import Page
+
+# Checks that a change to the analysis doesn't change its results. `record` saves the structure of every
+# page in a folder (characters, words, lines and blocks, see structure.py) as the reference, along with how
+# long each stage took. `check` analyses the pages again, matches the new structure against the reference
+# (see evaluate.py), and reports the accuracy and timing of every stage next to the reference ones.
+#
+#   regression.py record [image folder] [reference folder]
+#   regression.py check [image folder] [reference folder]
+#
+# check exits with status 1 if the results have drifted too far from the reference.
+
+MIN_AVERAGE_F1 = 0.99   # every level's f1, averaged over the pages, has to be at least this
+MIN_PAGE_F1 = 0.95      # and no single page can fall below this on any level
+
+TIMINGS_FILE = 'timings.json'
+
+def imagePaths(inputFolder):
+    return [ os.path.join(inputFolder, filename) for filename in sorted(os.listdir(inputFolder))
+             if os.path.isfile(os.path.join(inputFolder, filename)) ]
+
+def referencePath(imagePath, referenceFolder):
+    return os.path.join(referenceFolder, os.path.splitext(os.path.basename(imagePath))[0] + '.npz')
+
+def analyse(paths):
+    # yields each page once it has been analysed. The image is decoded first, so that reading it isn't
+    # part of the timings.
+
+    pageModule.stopwatch.verbose = False
+
+    for path in paths:
+        page = Page(path, image=pipeline.decode(path)).analyse()
+        yield page
+
+def record(paths, referenceFolder):
+
+    if not os.path.isdir(referenceFolder):
+        os.makedirs(referenceFolder)
+
+    timings = {}
+    for page in analyse(paths):
+        structure.savePage(page, referencePath(page.path, referenceFolder))
+        timings[os.path.basename(page.path)] = page.timings
+        print "recorded %s" %os.path.basename(page.path)
+
+    with open(os.path.join(referenceFolder, TIMINGS_FILE), 'w') as output:
+        json.dump(timings, output, indent=1)
+
+def check(paths, referenceFolder):
+    # Returns True if every page matches its reference closely enough.
+
+    with open(os.path.join(referenceFolder, TIMINGS_FILE)) as timingsFile:
+        referenceTimings = json.load(timingsFile)
+
+    scores = dict( (level, []) for level in evaluate.LEVELS )
+    labelAgreement = []
+    failures = []
+    stages = []                 # stage names, in the order they ran
+    times = {}                  # stage -> (reference seconds, new seconds) summed over all pages
+
+    for page in analyse(paths):
+        name = os.path.basename(page.path)
+        reference = structure.loadPage(referencePath(page.path, referenceFolder))
+        results = evaluate.compare(reference, page)
+
+        for level in evaluate.LEVELS:
+            scores[level].append(results[level])
+            if results[level].f1 < MIN_PAGE_F1:
+                failures.append('%s: %s f1 is %.3f' %(name, level, results[level].f1))
+        labelAgreement.append(results['blockLabels'])
+
+        for stage, seconds in page.timings:
+            if stage not in times:
+                stages.append(stage)
+                times[stage] = [0.0, 0.0]
+            times[stage][1] += seconds
+        for stage, seconds in referenceTimings.get(name, []):
+            if stage in times:
+                times[stage][0] += seconds
+
+        print "checked %s\t%s" %(name, '\t'.join('%s %.3f' %(level, results[level].f1) for level in evaluate.LEVELS))
+
+    print
+    print "level\t\tprecision\trecall\tf1\tworst f1\tcount change"
+    for level in evaluate.LEVELS:
+        levelScores = scores[level]
+        average = lambda field: sum(getattr(score, field) for score in levelScores) / len(levelScores)
+        countChange = sum(score.candidate - score.reference for score in levelScores)
+
+        print "%-12s\t%.4f\t\t%.4f\t%.4f\t%.4f\t\t%+i" %(level, average('precision'), average('recall'),
+                average('f1'), min(score.f1 for score in levelScores), countChange)
+
+        if average('f1') < MIN_AVERAGE_F1:
+            failures.append('%s: average f1 is %.4f' %(level, average('f1')))
+
+    print "block labels agree on %.2f%% of matched blocks" %(100.0 * sum(labelAgreement) / len(labelAgreement))
+
+    print
+    print "stage\t\t\t\treference\tnow\tchange"
+    for stage in stages:
+        referenceSeconds, seconds = times[stage]
+        referenceSeconds, seconds = referenceSeconds / len(paths), seconds / len(paths)
+        change = '%+.0f%%' %(100.0 * (seconds - referenceSeconds) / referenceSeconds) if referenceSeconds > 0 else '-'
+        print "%-24s\t%.3f\t\t%.3f\t%s" %(stage, referenceSeconds, seconds, change)
+
+    print
+    if failures:
+        print "FAILED"
+        for failure in failures:
+            print "  " + failure
+        return False
+
+    print "passed"
+    return True
+
+if __name__ == '__main__':
+
+    if len(sys.argv) < 2 or sys.argv[1] not in ('record', 'check'):
+        print "usage: regression.py record|check [image folder] [reference folder]"
+        sys.exit(2)
+
+    inputFolder = sys.argv[2] if len(sys.argv) > 2 else 'images'
+    referenceFolder = sys.argv[3] if len(sys.argv) > 3 else 'reference'
+    paths = imagePaths(inputFolder)
+
+    if sys.argv[1] == 'record':
+        record(paths, referenceFolder)
+    elif not check(paths, referenceFolder):
+        sys.exit(1)
@@ -0,0 +1,155 @@
+import cv2
+import numpy
+
+import colors
+import structure
+from box import Box
+
+# A faster way of drawing a page's structure than calling paint() on every object. Primitives are first
+# collected into arrays (grouped by colour and thickness), then drawn with one cv2.polylines call per group.
+# Dots are stamped into a mask and grown into discs with a single dilation, rather than drawn one circle
+# at a time. Everything is drawn directly at the target scale, onto a transparent layer that can be cached
+# and laid over the page image as often as needed.
+
+class Overlay:
+
+    def __init__(self, shape, scale=1.0, pointScale=1.0):
+        # shape is the (height, width) of the full-resolution page. pointScale is the scale that the points
+        # being drawn are at, relative to that page (e.g. if the page was analysed at a lower resolution).
+
+        self.scale = scale
+        self.pointScale = pointScale
+        self.size = (int(round(shape[1]*scale)), int(round(shape[0]*scale)))    # (width, height), like cv2
+        self.groups = []        # (kind, style, list of point arrays), drawn in the order they were first added
+        self.groupIndex = {}    # (kind, style) -> position in self.groups
+        self.layer = None
+        self.mask = None
+
+    def group(self, kind, style):
+
+        key = (kind, style)
+        if key not in self.groupIndex:
+            self.groupIndex[key] = len(self.groups)
+            self.groups.append((kind, style, []))
+
+        self.layer = None
+        return self.groups[self.groupIndex[key]][2]
+
+    def addPolygons(self, polygons, color, thickness=5):
+        # polygons is an (n, k, 2) array (or a list of (k, 2) arrays) of closed outlines, such as box corners.
+        self.group('polylines', (color, thickness, True)).extend(polygons)
+
+    def addSegments(self, starts, ends, color, thickness=4):
+        # draws a straight line from each start point to the matching end point.
+        segments = numpy.stack([numpy.reshape(starts, (-1, 2)), numpy.reshape(ends, (-1, 2))], axis=1)
+        self.group('polylines', (color, thickness, False)).extend(segments)
+
+    def addDots(self, points, color, radius=4):
+        self.group('dots', (color, radius)).append(numpy.reshape(points, (-1, 2)))
+
+    def scaled(self, points):
+        return numpy.around(numpy.asarray(points, numpy.float64) * self.scale / self.pointScale).astype(numpy.int32)
+
+    def thickness(self, thickness):
+        return max(1, int(round(thickness * self.scale)))
+
+    def render(self):
+        # draws everything onto a transparent layer: a colour image plus a mask of the pixels that were drawn.
+
+        width, height = self.size
+        self.layer = numpy.zeros((height, width, 3), numpy.uint8)
+        self.mask = numpy.zeros((height, width), numpy.uint8)
+
+        for kind, style, shapes in self.groups:
+            if len(shapes) == 0:
+                continue
+
+            if kind == 'polylines':
+                color, thickness, isClosed = style
+                points = [ self.scaled(shape).reshape(-1, 1, 2) for shape in shapes ]
+                cv2.polylines(self.layer, points, isClosed, color, self.thickness(thickness), cv2.CV_AA)
+                cv2.polylines(self.mask, points, isClosed, colors.greyscale.WHITE, self.thickness(thickness))
+
+            else:
+                color, radius = style
+                points = self.scaled(numpy.vstack(shapes))
+                inside = (points[:,0] >= 0) & (points[:,0] < width) & (points[:,1] >= 0) & (points[:,1] < height)
+                points = points[inside]
+
+                dots = numpy.zeros((height, width), numpy.uint8)
+                dots[points[:,1], points[:,0]] = colors.greyscale.WHITE
+                diameter = 2*self.thickness(radius) + 1
+                dots = cv2.dilate(dots, cv2.getStructuringElement(cv2.MORPH_ELLIPSE, (diameter, diameter)))
+
+                self.layer[dots > 0] = color
+                self.mask |= dots
+
+        return self.layer, self.mask
+
+    def composite(self, image):
+        # lays the overlay over an image that is already at the overlay's scale.
+
+        if self.layer is None:
+            self.render()
+
+        isDrawn = self.mask > 0
+        image[isDrawn] = self.layer[isDrawn]
+        return image
+
+def linePolygons(lines):
+    return structure.linePoints(lines)
+
+def boundingPolygon(points):
+    # the corners of the box around a set of points, exactly as Box.paint would draw it.
+    return Box(numpy.reshape(points, (-1, 1, 2)).astype(numpy.int32)).points
+
+def addWords(overlay, words, color):
+    # a dot on each character and a line to each of its neighbours, as Word.paint draws them.
+
+    characters = [ character for word in words for character in word.characters ]
+    if len(characters) == 0:
+        return
+
+    overlay.addDots([ character.coordinate for character in characters ], color)
+    pairs = [ (character.coordinate, neighbour.coordinate)
+              for character in characters for neighbour in character.nearestNeighbours ]
+    if len(pairs) > 0:
+        overlay.addSegments([ pair[0] for pair in pairs ], [ pair[1] for pair in pairs ], color)
+
+def fromPage(page, scale=1.0):
+    # Collects the same primitives that Page.paint draws, in the same colours.
+
+    overlay = Overlay(page.image.shape[:2], scale, getattr(page, 'scale', 1.0))
+
+    addWords(overlay, page.words, colors.RED)
+
+    if page.lines is not None and len(page.lines) > 0:
+        overlay.addPolygons(linePolygons(page.lines), colors.GREEN)
+
+    if page.margin is not None:
+        sides = [page.margin.left, page.margin.right, page.margin.top, page.margin.bottom]
+        overlay.addSegments([ list(side.start) for side in sides ], [ list(side.end) for side in sides ], colors.BLUE)
+
+    if page.content is not None:
+        for block in page.content.content:
+            addBlock(overlay, block)
+
+    return overlay
+
+def addBlock(overlay, block):
+
+    if block.contentType == 'Paragraph':
+        points = numpy.vstack([ word.contour for line in block.lines for word in line.words ])
+        overlay.addPolygons([boundingPolygon(points)], colors.RED)
+        overlay.addSegments([ line.box.center.left for line in block.lines ],
+                            [ line.box.center.right for line in block.lines ], colors.BURNT_YELLOW)
+
+    elif block.contentType == 'SectionTitle':
+        overlay.addPolygons(linePolygons(block.lines), colors.MAGENTA)
+
+    elif block.contentType == 'Figure':
+        overlay.addPolygons(linePolygons([block.image] + list(block.caption)), colors.CYAN)
+
+    elif block.contentType == 'ChapterStart':
+        overlay.addPolygons(linePolygons(block.titleLines + block.quoteLines), colors.ORANGE)
+        addWords(overlay, block.chapterNum.words, colors.ORANGE)
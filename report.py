@@ -0,0 +1,144 @@
+import os
+import sys
+import cgi
+import cv2
+import numpy
+
+import colors
+import sources
+import structure
+from store import Store
+
+# Builds a QA report for a whole book from its saved structure (a Store folder or a structure.Book file),
+# without re-running any analysis. Each page becomes a small JPEG thumbnail with an SVG overlay of the
+# word, line, margin and block outlines drawn on top in full-resolution coordinates, so the outlines stay
+# sharp at any zoom. index.html shows every page, loading each one only when it scrolls into view.
+
+THUMBNAIL_WIDTH = 400
+THUMBNAIL_QUALITY = 70
+
+BLOCK_COLORS = {
+    'Paragraph': colors.RED,
+    'SectionTitle': colors.MAGENTA,
+    'Figure': colors.CYAN,
+    'ChapterStart': colors.ORANGE,
+}
+
+def cssColor(color):
+    # our colours are BGR tuples, for OpenCV
+    return '#%02x%02x%02x' %(color[2], color[1], color[0])
+
+def polygonPoints(corners):
+    return ' '.join( '%i,%i' %(x, y) for x, y in numpy.reshape(corners, (-1, 2)) )
+
+def openPages(path):
+    # yields (pageNum, PageStructure) pairs from a store folder or a book file.
+
+    if os.path.isdir(path):
+        store = Store(path)
+        for pageNum in store.pages():
+            yield pageNum, store.page(pageNum)
+        store.close()
+    else:
+        book = structure.Book(path)
+        for pageNum in range(len(book)):
+            yield pageNum, book[pageNum]
+        book.close()
+
+def writeThumbnail(page, path, width=THUMBNAIL_WIDTH):
+
+    try:
+        image = sources.decode(page.source)     # the source may be a page of a multi-page file
+    except (IOError, ImportError):
+        return False
+
+    height = int(round(image.shape[0] * float(width) / image.shape[1]))
+    thumbnail = cv2.resize(image, (width, height), interpolation=cv2.INTER_AREA)
+    cv2.imwrite(path, thumbnail, [cv2.IMWRITE_JPEG_QUALITY, THUMBNAIL_QUALITY])
+    return True
+
+def pageSvg(page, thumbnailName):
+
+    height, width = page.shape
+    parts = []
+    parts.append('<svg xmlns="http://www.w3.org/2000/svg" xmlns:xlink="http://www.w3.org/1999/xlink" '
+                 'viewBox="0 0 %i %i" preserveAspectRatio="xMidYMid meet">' %(width, height))
+    parts.append('<style>polygon, line { fill: none; stroke-width: 1.5; vector-effect: non-scaling-stroke; }</style>')
+
+    if thumbnailName is not None:
+        parts.append('<image xlink:href="%s" x="0" y="0" width="%i" height="%i" preserveAspectRatio="none"/>'
+                     %(cgi.escape(thumbnailName, True), width, height))
+
+    parts.append('<g class="words" stroke="%s" stroke-opacity="0.5">' %cssColor(colors.YELLOW))
+    for corners in page.wordBoxes:
+        parts.append('<polygon points="%s"/>' %polygonPoints(corners))
+    parts.append('</g>')
+
+    parts.append('<g class="lines" stroke="%s">' %cssColor(colors.GREEN))
+    for corners in page.lineBoxes:
+        parts.append('<polygon points="%s"/>' %polygonPoints(corners))
+    parts.append('</g>')
+
+    parts.append('<g class="margin" stroke="%s">' %cssColor(colors.BLUE))
+    for (startX, startY), (endX, endY) in page.margin:
+        parts.append('<line x1="%i" y1="%i" x2="%i" y2="%i"/>' %(startX, startY, endX, endY))
+    parts.append('</g>')
+
+    for blockNum, blockType in enumerate(page.blockTypes):
+        x, y, blockWidth, blockHeight = page.blockBounds(blockNum)
+        parts.append('<g class="%s" stroke="%s"><title>%s</title><polygon points="%s"/></g>'
+                     %(blockType, cssColor(BLOCK_COLORS[blockType]), blockType,
+                       polygonPoints([[x, y], [x+blockWidth, y], [x+blockWidth, y+blockHeight], [x, y+blockHeight]])))
+
+    parts.append('</svg>')
+    return '\n'.join(parts)
+
+def writeReport(source, outputFolder, thumbnailWidth=THUMBNAIL_WIDTH):
+    # source is a Store folder or a book file. Returns the path of the index page.
+
+    if not os.path.isdir(outputFolder):
+        os.makedirs(outputFolder)
+
+    entries = []
+    for pageNum, page in openPages(source):
+
+        name = 'page%04i' %pageNum
+        thumbnailName = name + '.jpg'
+        if not writeThumbnail(page, os.path.join(outputFolder, thumbnailName), thumbnailWidth):
+            thumbnailName = None    # the scan has moved; still show the outlines.
+
+        with open(os.path.join(outputFolder, name + '.svg'), 'w') as output:
+            output.write(pageSvg(page, thumbnailName))
+
+        counts = ', '.join( '%i %s' %(page.blockTypes.count(blockType), blockType)
+                            for blockType in structure.BLOCK_TYPES if blockType in page.blockTypes )
+        entries.append((pageNum, name, page.shape, os.path.basename(page.source), counts))
+
+    # iframes (unlike <object>) can be lazy-loaded, and unlike <img> they let the SVG load its thumbnail.
+    html = ['<!DOCTYPE html>', '<html><head><meta charset="utf-8"><title>Structure report</title>',
+            '<style>',
+            'body { font-family: sans-serif; }',
+            '.page { display: inline-block; margin: 8px; vertical-align: top; }',
+            '.page iframe { border: 1px solid #ccc; }',
+            '</style></head><body>']
+    for pageNum, name, (height, width), sourceName, counts in entries:
+        frameHeight = int(round(height * float(thumbnailWidth) / width))
+        html.append('<div class="page"><a href="%s.svg">page %i</a> <small>%s</small><br>' %(name, pageNum, cgi.escape(sourceName)))
+        html.append('<iframe src="%s.svg" width="%i" height="%i" loading="lazy" scrolling="no"></iframe>'
+                    %(name, thumbnailWidth, frameHeight))
+        html.append('<br><small>%s</small></div>' %cgi.escape(counts))
+    html.append('</body></html>')
+
+    indexPath = os.path.join(outputFolder, 'index.html')
+    with open(indexPath, 'w') as output:
+        output.write('\n'.join(html))
+
+    return indexPath
+
+if __name__ == '__main__':
+
+    if len(sys.argv) != 3:
+        print 'usage: report.py <store folder or book file> <output folder>'
+        sys.exit(1)
+
+    print writeReport(sys.argv[1], sys.argv[2])
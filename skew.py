@@ -0,0 +1,35 @@
+import cv2
+
+import box
+import colors
+import geometry as g
+import text
+
+# Angles (in degrees) smaller than this are treated as zero. Below this, a rotated rectangle is within a
+# pixel or so of its axis-aligned bounding box over the width of a full line of text.
+TOLERANCE = box.AXIS_ALIGNED_TOLERANCE
+
+def centroids(binaryImage):
+    # returns an (n, 2) array holding the center of mass of each outer contour in the image.
+
+    contours, hierarchy = cv2.findContours(binaryImage.copy(), cv2.RETR_EXTERNAL, cv2.CHAIN_APPROX_SIMPLE)
+
+    boxes = box.BoxArray(contours, axisAligned=True)   # we only want the centroids, so skip minAreaRect.
+    return boxes.centroids[boxes.m00 > 0]
+
+def estimateSkew(greyscaleImage, maxAngle=5.0, scale=0.5):
+    # Estimates the skew of the page (in degrees, using the same convention as Box.angle) from the
+    # distribution of character centroids, which are found on a reduced-size copy of the page.
+
+    small = cv2.resize(greyscaleImage, (0, 0), fx=scale, fy=scale, interpolation=cv2.INTER_AREA)
+    return g.dominantAngle(centroids(text.threshold(small)), maxAngle)
+
+def rotate(image, angle, borderValue=colors.WHITE):
+    # rotates the image about its center so that lines at the given angle become horizontal. This is a
+    # single warp of the whole page, so that later stages can work in axis-aligned coordinates.
+
+    height, width = image.shape[:2]
+    matrix = cv2.getRotationMatrix2D((width/2.0, height/2.0), angle, 1.0)
+
+    return cv2.warpAffine(image, matrix, (width, height), flags=cv2.INTER_LINEAR,
+                          borderMode=cv2.BORDER_CONSTANT, borderValue=borderValue)
@@ -0,0 +1,203 @@
+import os
+import threading
+
+import cv2
+import numpy
+
+try:
+    from PIL import Image       # for multi-page tiffs
+except ImportError:
+    Image = None
+
+try:
+    import fitz                 # PyMuPDF, for pdfs
+except ImportError:
+    fitz = None
+
+# Reads pages out of multi-page files (tiffs and pdfs, as scanners produce) as well as single images, one
+# page at a time, so a book never has to be split into separate image files first. Each page of a
+# multi-page file is known by the file's path and the page's index, as 'scans/book.tif#3' (counting from
+# zero). These page paths can go anywhere a path to an image can: decode() reads them, the page's structure
+# records them as its source, and pageName() gives a name for the files written for them.
+#
+# Only the page being asked for is decoded. Image-only pdfs hold one image per page, which is taken out as
+# it is (so a JPEG is decoded once, not decoded and compressed again); any other pdf page is rendered. An
+# image only counts as the scan if it covers most of the page the right way round, so a text page with a
+# logo on it, or a rotated page, is rendered too.
+
+PAGE_SEPARATOR = '#'
+TIFF_EXTENSIONS = ['.tif', '.tiff']
+PDF_EXTENSIONS = ['.pdf']
+RENDER_DPI = 300        # the resolution pdf pages without a single scanned image are rendered at
+SCAN_COVERAGE = 0.9     # the fraction of a pdf page that its one image has to cover to be taken as the scan
+
+pdfLock = threading.Lock()      # MuPDF can't be used from more than one thread at once
+pdfDocuments = {}               # the open pdf, by path, so that each page doesn't open the file again
+
+def isTiff(path):
+    return os.path.splitext(path)[1].lower() in TIFF_EXTENSIONS
+
+def isPdf(path):
+    return os.path.splitext(path)[1].lower() in PDF_EXTENSIONS
+
+def pagePath(path, index):
+    return '%s%s%i' %(path, PAGE_SEPARATOR, index)
+
+def splitPath(path):
+    # Returns (path of the file, index of the page), where the index is None for a single image.
+
+    filePath, separator, index = path.rpartition(PAGE_SEPARATOR)
+    if separator and index.isdigit() and (isTiff(filePath) or isPdf(filePath)):
+        return filePath, int(index)
+    return path, None
+
+def pageName(path):
+    # The file name to save a page's results under, e.g. 'page332.jpg', or 'book.tif-0003.png' for a page
+    # of a multi-page file. Output images are written with whatever extension this has.
+
+    filePath, index = splitPath(path)
+    if index is None:
+        return os.path.basename(path)
+    return '%s-%04i.png' %(os.path.basename(filePath), index)
+
+def pageCount(path):
+
+    if isPdf(path):
+        with pdfLock:
+            return len(openPdf(path))
+
+    if isTiff(path) and Image is not None:
+        image = Image.open(path)
+        try:
+            return getattr(image, 'n_frames', 1)
+        finally:
+            image.close()
+
+    return 1
+
+def pages(paths):
+    # Yields the path of every page in the given files, in order. Files with more than one page are
+    # opened to count them, but none of their pages are decoded here. Single-page files keep their paths.
+
+    warned = False
+    for path in paths:
+        if isTiff(path) and Image is None and not warned:
+            print "PIL isn't installed, so only the first page of each tiff will be read"
+            warned = True
+
+        count = pageCount(path)
+        if count == 1 and not isPdf(path):
+            yield path
+        else:
+            for index in range(count):
+                yield pagePath(path, index)
+
+def folderPages(folder):
+    # the pages of every file in a folder, in filename order.
+    return pages([ os.path.join(folder, filename) for filename in sorted(os.listdir(folder)) ])
+
+def decode(path):
+    # Reads a page as a colour (BGR) image, as cv2.imread does.
+
+    filePath, index = splitPath(path)
+
+    if index is not None and isPdf(filePath):
+        image = decodePdfPage(filePath, index)
+    elif index is not None:
+        image = decodeTiffPage(filePath, index)
+    else:
+        image = cv2.imread(path, cv2.CV_LOAD_IMAGE_COLOR)
+
+    if image is None:
+        raise IOError('could not read an image from %s' %path)
+    return image
+
+def decodeTiffPage(path, index):
+
+    if Image is None:
+        raise ImportError('PIL is needed to read page %i of %s' %(index, path))
+
+    image = Image.open(path)
+    try:
+        image.seek(index)
+        rgb = numpy.asarray(image.convert('RGB'))
+    finally:
+        image.close()
+
+    return cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
+
+def openPdf(path):
+    # must be called with pdfLock held. Only the last pdf opened is kept open, since books are read one
+    # after another.
+
+    if fitz is None:
+        raise ImportError('PyMuPDF is needed to read %s' %path)
+
+    if path not in pdfDocuments:
+        for document in pdfDocuments.values():
+            document.close()
+        pdfDocuments.clear()
+        pdfDocuments[path] = fitz.open(path)
+    return pdfDocuments[path]
+
+def scanImage(page):
+    # must be called with pdfLock held. The xref of the image making up a scanned page, or None if the page
+    # isn't one: it has to hold a single image, placed upright and unrotated over most of the page, so that
+    # the image's pixels are the page as it's shown.
+
+    if page.rotation % 360 != 0:
+        return None
+
+    images = page.getImageList(full=True)
+    if len(images) != 1:
+        return None
+
+    xref, width, height = images[0][0], images[0][2], images[0][3]
+    placed = page.getImageBbox(images[0])
+    if placed.isInfinite or placed.isEmpty:
+        return None
+
+    covered = placed & page.rect
+    if covered.width * covered.height < SCAN_COVERAGE * page.rect.width * page.rect.height:
+        return None
+
+    # an image turned a quarter turn by its transform still fills its box, but with its sides swapped.
+    if (width > height) != (placed.width > placed.height) and abs(width - height) > 0.1 * max(width, height):
+        return None
+
+    return xref
+
+def decodePdfPage(path, index):
+
+    # a scanned page is a single image covering the page, which is decoded straight from its bytes.
+    with pdfLock:
+        document = openPdf(path)
+        xref = scanImage(document[index])
+        extracted = document.extractImage(xref) if xref is not None else None
+
+    if extracted:
+        image = cv2.imdecode(numpy.frombuffer(extracted['image'], numpy.uint8), cv2.CV_LOAD_IMAGE_COLOR)
+        if image is not None:
+            return image
+
+    with pdfLock:   # not a scan, or one in a format cv2 can't read (JBIG2, say)
+        return renderPdfPage(openPdf(path)[index])
+
+def renderPdfPage(page):
+    # must be called with pdfLock held.
+
+    zoom = RENDER_DPI / 72.0
+    pixmap = page.getPixmap(matrix=fitz.Matrix(zoom, zoom), alpha=False)
+    rgb = numpy.frombuffer(pixmap.samples, numpy.uint8).reshape(pixmap.height, pixmap.width, pixmap.n)
+
+    if pixmap.n == 1:
+        return cv2.cvtColor(rgb, cv2.COLOR_GRAY2BGR)
+    return cv2.cvtColor(rgb, cv2.COLOR_RGB2BGR)
+
+def closeAll():
+    # closes the pdfs that decode() has opened.
+
+    with pdfLock:
+        for document in pdfDocuments.values():
+            document.close()
+        pdfDocuments.clear()
@@ -5,6 +5,7 @@ class Stopwatch:
     def __init__(self, message=None):
 
         self.initialised = False
+        self.verbose = True     # set this to false to keep timing without printing anything
 
         self.startTime = time.time()
         self.lastLapTime = time.time()
@@ -13,6 +14,7 @@ class Stopwatch:
         self.pauseDuration = 0
         self.totalPauseDurationInRun = 0
         self.runTimes = []
+        self.laps = []          # (name, seconds) for each lap in the current run
 
         if message is not None:
             self.lap(message)
@@ -21,16 +23,27 @@ class Stopwatch:
         currentTime = time.time()
         return currentTime - self.startTime - self.totalPauseDurationInRun
 
-    def lap(self, message):
+    def lap(self, message, name=None):
+        # name is what the lap is recorded as in self.laps, if it shouldn't be the message itself.
 
         currentTime = time.time()
         lapTime = currentTime - self.lastLapTime - self.pauseDuration
+        self.laps.append((name if name is not None else message, lapTime))
 
-        print "%.2f\t%.2f\t%s" %(self.__getTotalRunTime(), lapTime, message)
+        if self.verbose:
+            print "%.2f\t%.2f\t%s" %(self.__getTotalRunTime(), lapTime, message)
         self.lastLapTime = currentTime
         self.pauseStartTime = None
         self.pauseDuration = 0
 
+    def restart(self):
+        # starts the next lap from now, leaving out the time since the last one (e.g. while a lazily worked out
+        # stage wasn't needed yet).
+
+        self.lastLapTime = time.time()
+        self.pauseStartTime = None
+        self.pauseDuration = 0
+
     def pause(self):
 
         self.pauseStartTime = time.time()
@@ -48,8 +61,9 @@ class Stopwatch:
 
         self.runTimes.append(self.__getTotalRunTime())
         average = sum(self.runTimes) / (len(self.runTimes))
-        print "average time: %.2f" %average
-        print
+        if self.verbose:
+            print "average time: %.2f" %average
+            print
 
         self.pauseStartTime = None
         self.pauseDuration = 0
@@ -67,3 +81,4 @@ class Stopwatch:
         self.startTime = time.time()
         self.lastLapTime = time.time()
         self.lap(message)
+        self.laps = []
@@ -0,0 +1,191 @@
+import os
+import mmap
+import numpy
+from contextlib import contextmanager
+
+try:
+    import fcntl
+except ImportError:     # windows
+    fcntl = None
+    import msvcrt
+
+import structure
+
+# A results store for a whole book. It is a folder holding three append-only files:
+#
+#   pages.dat   page archives (see structure.py), one after another
+#   pages.idx   one PAGE_RECORD per archive, saying which page it is and where to find it
+#   blocks.idx  one BLOCK_RECORD per content block or boilerplate line, so that queries like "all section
+#               titles in pages 100-200" can be answered from the index alone
+#
+# Any number of processes can append at once (appends are serialised with a lock file), and readers
+# memory-map the files, so opening a store doesn't decode anything. If a page is appended more than once,
+# the most recent copy wins.
+
+PAGE_RECORD = numpy.dtype([('page', '<u4'), ('offset', '<u8'), ('length', '<u8')])
+
+BLOCK_RECORD = numpy.dtype([('page', '<u4'), ('type', 'u1'), ('item', '<u2'),
+                            ('x', '<i4'), ('y', '<i4'), ('width', '<i4'), ('height', '<i4'),
+                            ('offset', '<u8')])
+
+# content blocks first, followed by the boilerplate fields. For content blocks, a record's 'item' is the
+# block's position on the page; for boilerplate it is the line number.
+BLOCK_TYPES = structure.BLOCK_TYPES + structure.BOILERPLATE_FIELDS
+
+def blockRecords(pageNum, arrays, offset):
+
+    page = structure.PageStructure(arrays)
+    records = []
+
+    for blockNum, blockType in enumerate(page.blockTypes):
+        bounds = page.blockBounds(blockNum)
+        records.append((pageNum, BLOCK_TYPES.index(blockType), blockNum) + bounds + (offset,))
+
+    for field in structure.BOILERPLATE_FIELDS:
+        lineNum = int(page.boilerplate[field])
+        if lineNum >= 0:
+            bounds = structure.bounds(page.lineBoxes[lineNum])
+            records.append((pageNum, BLOCK_TYPES.index(field), lineNum) + bounds + (offset,))
+
+    return numpy.array(records, BLOCK_RECORD)
+
+def mapRecords(path, dtype):
+    # memory-maps a file of fixed-size records. A writer may be half way through appending a record, so
+    # we only map the complete ones.
+
+    count = os.path.getsize(path) // dtype.itemsize if os.path.exists(path) else 0
+    if count == 0:
+        return numpy.zeros(0, dtype)
+
+    return numpy.memmap(path, dtype, mode='r', shape=(count,))
+
+class Store:
+
+    def __init__(self, path):
+
+        self.path = path
+        if not os.path.isdir(path):
+            try:
+                os.makedirs(path)
+            except OSError:     # another process got there first
+                pass
+
+        self.dataPath = os.path.join(path, 'pages.dat')
+        self.pageIndexPath = os.path.join(path, 'pages.idx')
+        self.blockIndexPath = os.path.join(path, 'blocks.idx')
+        self.lockPath = os.path.join(path, 'lock')
+
+        self.dataFile = None
+        self.data = None
+        self.refresh()
+
+    @contextmanager
+    def lock(self):
+
+        with open(self.lockPath, 'a+b') as lockFile:
+            if fcntl is not None:
+                fcntl.flock(lockFile.fileno(), fcntl.LOCK_EX)
+            else:
+                lockFile.seek(0)
+                msvcrt.locking(lockFile.fileno(), msvcrt.LK_LOCK, 1)
+            try:
+                yield
+            finally:
+                if fcntl is not None:
+                    fcntl.flock(lockFile.fileno(), fcntl.LOCK_UN)
+                else:
+                    lockFile.seek(0)
+                    msvcrt.locking(lockFile.fileno(), msvcrt.LK_UNLCK, 1)
+
+    def append(self, pageNum, page):
+        # page is either a Page instance or the arrays returned by structure.pageToArrays.
+
+        arrays = page if isinstance(page, dict) else structure.pageToArrays(page)
+        blob = structure.arraysToBytes(arrays)
+
+        with self.lock():
+            offset = os.path.getsize(self.dataPath) if os.path.exists(self.dataPath) else 0
+
+            # the page data goes in before the index entries that point to it, so that readers never see
+            # an index entry for data that isn't there yet.
+            with open(self.dataPath, 'ab') as output:
+                output.write(blob)
+            with open(self.pageIndexPath, 'ab') as output:
+                output.write(numpy.array([(pageNum, offset, len(blob))], PAGE_RECORD).tostring())
+            with open(self.blockIndexPath, 'ab') as output:
+                output.write(blockRecords(pageNum, arrays, offset).tostring())
+
+    def refresh(self):
+        # (re)maps the store's files, picking up anything appended since the store was opened.
+
+        self.close()
+
+        if os.path.exists(self.dataPath) and os.path.getsize(self.dataPath) > 0:
+            self.dataFile = open(self.dataPath, 'rb')
+            self.data = mmap.mmap(self.dataFile.fileno(), 0, access=mmap.ACCESS_READ)
+
+        self.pageIndex = mapRecords(self.pageIndexPath, PAGE_RECORD)
+        self.blockIndex = mapRecords(self.blockIndexPath, BLOCK_RECORD)
+
+        # only index entries whose data was complete when we mapped the data file are usable.
+        dataSize = len(self.data) if self.data is not None else 0
+        self.pageIndex = self.pageIndex[self.pageIndex['offset'] + self.pageIndex['length'] <= dataSize]
+
+        # later copies of a page replace earlier ones.
+        self.pageTable = {}
+        for row in range(len(self.pageIndex)):
+            self.pageTable[int(self.pageIndex['page'][row])] = row
+
+        currentOffsets = self.pageIndex['offset'][sorted(self.pageTable.values())]
+        self.blockIndex = self.blockIndex[numpy.in1d(self.blockIndex['offset'], currentOffsets)]
+
+    def close(self):
+
+        if self.data is not None:
+            self.data.close()
+            self.dataFile.close()
+        self.data = None
+        self.dataFile = None
+
+    def __len__(self):
+        return len(self.pageTable)
+
+    def __contains__(self, pageNum):
+        return pageNum in self.pageTable
+
+    def pages(self):
+        return sorted(self.pageTable.keys())
+
+    def page(self, pageNum):
+
+        record = self.pageIndex[self.pageTable[pageNum]]
+        offset, length = int(record['offset']), int(record['length'])
+        return structure.loadPage(self.data[offset:offset+length])
+
+    def blocks(self, blockType=None, pages=None, region=None):
+        # Returns the index records of matching blocks. blockType is one of BLOCK_TYPES (or a list of them),
+        # pages is an inclusive (first, last) range, and region is an (x, y, width, height) rectangle that
+        # the block must overlap.
+
+        records = self.blockIndex
+        mask = numpy.ones(len(records), bool)
+
+        if blockType is not None:
+            if isinstance(blockType, basestring):
+                blockType = [blockType]
+            mask &= numpy.in1d(records['type'], [ BLOCK_TYPES.index(name) for name in blockType ])
+
+        if pages is not None:
+            first, last = pages
+            mask &= (records['page'] >= first) & (records['page'] <= last)
+
+        if region is not None:
+            x, y, width, height = region
+            mask &= (records['x'] < x + width) & (records['x'] + records['width'] > x)
+            mask &= (records['y'] < y + height) & (records['y'] + records['height'] > y)
+
+        return records[mask]
+
+    @staticmethod
+    def blockType(record):
+        return BLOCK_TYPES[record['type']]
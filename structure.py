@@ -0,0 +1,262 @@
+import io
+import mmap
+import struct
+import numpy
+
+# Version 2 of the page structure format. Each page is a compressed .npz archive of flat arrays; anything
+# with a variable number of children (words in a line, lines in a block, ...) is stored as one flat index
+# array plus an offsets array, so that the children of item i are flat[offsets[i]:offsets[i+1]].
+#
+# Version 2 added wordBoxes. Readers fill in anything missing from older archives with empty arrays.
+VERSION = 2
+
+BLOCK_TYPES = ['Paragraph', 'SectionTitle', 'Figure', 'ChapterStart']
+
+BOILERPLATE_FIELDS = ['pageNum', 'chapterTitle', 'bookTitle']
+
+ARCHIVE_MAGIC = b'PK\x03\x04'   # every page archive is a zip file
+
+# A book is a single file holding many page archives: a fixed header, then a table with one
+# (offset, length) pair per page, then the page archives themselves. Readers can mmap the file and jump
+# straight to page N.
+BOOK_MAGIC = 'STRUCTOR'
+BOOK_HEADER = struct.Struct('<8sII')     # magic, version, page count
+BOOK_ENTRY = numpy.dtype([('offset', '<u8'), ('length', '<u8')])
+
+def ragged(groups, dtype=numpy.int32):
+    # turns a list of lists into a (flat, offsets) pair.
+
+    lengths = [ len(group) for group in groups ]
+    offsets = numpy.concatenate([[0], numpy.cumsum(lengths)]).astype(numpy.int64)
+    flat = numpy.array([ item for group in groups for item in group ], dtype)
+
+    return flat, offsets
+
+def blockLines(block):
+    # every text line belonging to a content block, in reading order.
+
+    if block.contentType == 'Figure':
+        return [block.image] + list(block.caption)
+    elif block.contentType == 'ChapterStart':
+        return [block.chapterNum] + list(block.titleLines) + list(block.quoteLines)
+    else:
+        return list(block.lines)
+
+def linePoints(lines, scale=1.0):
+    # Stacks the corner points of many line (or word) boxes into one array, as used for box outlines. The
+    # points are divided by scale, to map them from a page's working resolution back to its scan.
+
+    points = numpy.array([ line.box.points for line in lines ], numpy.float64).reshape(-1, 4, 2)
+    return numpy.around(points / scale).astype(numpy.int32)
+
+def pageToArrays(page):
+    # Everything is stored in the coordinates of the original scan, even if the page was analysed at a lower
+    # resolution.
+
+    scale = getattr(page, 'scale', 1.0)
+
+    arrays = {}
+    arrays['version'] = numpy.array(VERSION)
+    arrays['source'] = numpy.array(page.path)
+    arrays['shape'] = numpy.array(page.image.shape[:2], numpy.int32)
+
+    characters = page.characters.characters if page.characters is not None else []
+    coordinates = numpy.array([ char.coordinate for char in characters ], numpy.float64).reshape(-1, 2)
+    arrays['characters'] = numpy.around(coordinates / scale).astype(numpy.int32)
+    characterIndex = dict( (id(char), i) for i, char in enumerate(characters) )
+
+    words = page.words if page.words is not None else []
+    arrays['wordCharacters'], arrays['wordOffsets'] = ragged(
+        [ sorted(characterIndex[id(char)] for char in word.characters) for word in words ])
+    arrays['wordBoxes'] = linePoints(words, scale)
+    wordIndex = dict( (id(word), i) for i, word in enumerate(words) )
+
+    lines = list(page.lines) if page.lines is not None else []
+    arrays['lineBoxes'] = linePoints(lines, scale)
+    arrays['lineWords'], arrays['lineOffsets'] = ragged(
+        [ [ wordIndex[id(word)] for word in line.words if id(word) in wordIndex ] for line in lines ])
+    lineIndex = dict( (id(line), i) for i, line in enumerate(lines) )
+
+    # the margin is stored as the start and end points of its left, right, top and bottom lines.
+    if page.margin is not None:
+        sides = [page.margin.left, page.margin.right, page.margin.top, page.margin.bottom]
+        margin = numpy.array([ [list(side.start), list(side.end)] for side in sides ], numpy.float64)
+        arrays['margin'] = margin / scale
+    else:
+        arrays['margin'] = numpy.zeros((0, 2, 2), numpy.float64)
+
+    blocks = page.content.content if page.content is not None else []
+    arrays['blockTypes'] = numpy.array([ BLOCK_TYPES.index(block.contentType) for block in blocks ], numpy.uint8)
+    arrays['blockLines'], arrays['blockOffsets'] = ragged(
+        [ [ lineIndex.get(id(line), -1) for line in blockLines(block) ] for block in blocks ])
+
+    # the index of each boilerplate line in the line table, or -1 if it isn't set.
+    boilerplate = [ getattr(page.boilerplate, field, None) for field in BOILERPLATE_FIELDS ]
+    arrays['boilerplate'] = numpy.array([ lineIndex.get(id(line), -1) for line in boilerplate ], numpy.int32)
+
+    return arrays
+
+def arraysToBytes(arrays):
+
+    buffer = io.BytesIO()
+    numpy.savez_compressed(buffer, **arrays)
+    return buffer.getvalue()
+
+def pageToBytes(page):
+
+    return arraysToBytes(pageToArrays(page))
+
+def savePage(page, path):
+
+    saveArrays(pageToArrays(page), path)
+
+def saveArrays(arrays, path):
+
+    with open(path, 'wb') as output:
+        output.write(arraysToBytes(arrays))
+
+def movePage(arrays, shift, source, shape):
+    # A copy of a page's arrays for another scan of the same page (see duplicates.py), on which everything
+    # is (x, y) pixels further along. source and shape are the other scan's.
+
+    moved = dict(arrays)
+    moved['source'] = numpy.array(source)
+    moved['shape'] = numpy.array(shape[:2], numpy.int32)
+
+    offset = numpy.around(shift).astype(numpy.int32)
+    moved['characters'] = arrays['characters'] + offset
+    moved['wordBoxes'] = arrays['wordBoxes'] + offset
+    moved['lineBoxes'] = arrays['lineBoxes'] + offset
+    moved['margin'] = arrays['margin'] + numpy.asarray(shift, numpy.float64)
+
+    return moved
+
+def loadPage(source):
+    # source can be a filename, a file object, or the raw bytes of a page archive.
+
+    # filenames are bytes too, so raw archives are told apart by the zip header they start with.
+    if isinstance(source, bytearray) or (isinstance(source, bytes) and source.startswith(ARCHIVE_MAGIC)):
+        source = io.BytesIO(source)
+
+    archive = numpy.load(source)
+    arrays = dict( (name, archive[name]) for name in archive.files )
+    archive.close()
+
+    version = int(arrays['version'])
+    if version > VERSION:
+        raise ValueError('page structure version %i is newer than this reader (%i)' %(version, VERSION))
+
+    return PageStructure(arrays)
+
+class PageStructure:
+    # A page's structure as plain arrays, loaded from a page archive. This is what downstream tools get
+    # instead of a full Page, so that they don't need to re-run the analysis.
+
+    def __init__(self, arrays):
+
+        self.arrays = arrays
+        self.version = int(arrays['version'])
+        self.source = str(arrays['source'])
+        self.shape = tuple(arrays['shape'])
+
+        self.characters = arrays['characters']
+        self.wordBoxes = arrays.get('wordBoxes', numpy.zeros((0, 4, 2), numpy.int32))
+        self.lineBoxes = arrays['lineBoxes']
+        self.margin = arrays['margin']
+        self.blockTypes = [ BLOCK_TYPES[code] for code in arrays['blockTypes'] ]
+        self.boilerplate = dict(zip(BOILERPLATE_FIELDS, arrays['boilerplate']))
+
+    @staticmethod
+    def group(flat, offsets, index):
+        return flat[offsets[index]:offsets[index+1]]
+
+    def wordCount(self):
+        return len(self.arrays['wordOffsets']) - 1
+
+    def lineCount(self):
+        return len(self.arrays['lineOffsets']) - 1
+
+    def blockCount(self):
+        return len(self.blockTypes)
+
+    def wordCharacters(self, wordNum):
+        return self.characters[self.group(self.arrays['wordCharacters'], self.arrays['wordOffsets'], wordNum)]
+
+    def lineWords(self, lineNum):
+        return self.group(self.arrays['lineWords'], self.arrays['lineOffsets'], lineNum)
+
+    def blockLines(self, blockNum):
+        return self.group(self.arrays['blockLines'], self.arrays['blockOffsets'], blockNum)
+
+    def blockBoxes(self, blockNum):
+        # the corner points of every line in the block. Lines that aren't in the line table are skipped.
+        lines = self.blockLines(blockNum)
+        return self.lineBoxes[lines[lines >= 0]]
+
+    def blockBounds(self, blockNum):
+        # the (x, y, width, height) rectangle around every line in the block.
+        return bounds(self.blockBoxes(blockNum))
+
+def bounds(corners):
+    # the axis-aligned (x, y, width, height) rectangle around a set of box corners, or all zeros if empty.
+
+    points = numpy.reshape(corners, (-1, 2))
+    if len(points) == 0:
+        return (0, 0, 0, 0)
+
+    low = points.min(axis=0)
+    high = points.max(axis=0)
+    return (int(low[0]), int(low[1]), int(high[0] - low[0]), int(high[1] - low[1]))
+
+def writeBook(path, pages):
+    # pages is a sequence of Page instances or raw page archives (as returned by pageToBytes).
+
+    blobs = [ page if isinstance(page, bytes) else pageToBytes(page) for page in pages ]
+
+    table = numpy.zeros(len(blobs), BOOK_ENTRY)
+    offset = BOOK_HEADER.size + table.nbytes
+    for i, blob in enumerate(blobs):
+        table[i] = (offset, len(blob))
+        offset += len(blob)
+
+    with open(path, 'wb') as output:
+        output.write(BOOK_HEADER.pack(BOOK_MAGIC, VERSION, len(blobs)))
+        output.write(table.tostring())
+        for blob in blobs:
+            output.write(blob)
+
+class Book:
+    # Read-only access to a book file. The file is memory-mapped, so opening it only reads the header and
+    # page table; each page is decoded when it is asked for.
+
+    def __init__(self, path):
+
+        self.file = open(path, 'rb')
+        self.map = mmap.mmap(self.file.fileno(), 0, access=mmap.ACCESS_READ)
+
+        magic, self.version, pageCount = BOOK_HEADER.unpack_from(self.map, 0)
+        if magic != BOOK_MAGIC:
+            raise ValueError('%s is not a structure book' %path)
+        if self.version > VERSION:
+            raise ValueError('book version %i is newer than this reader (%i)' %(self.version, VERSION))
+
+        self.table = numpy.frombuffer(self.map, BOOK_ENTRY, pageCount, BOOK_HEADER.size)
+
+    def __len__(self):
+        return len(self.table)
+
+    def pageBytes(self, pageNum):
+        offset, length = self.table[pageNum]
+        return self.map[int(offset):int(offset+length)]
+
+    def __getitem__(self, pageNum):
+        return loadPage(self.pageBytes(pageNum))
+
+    def __iter__(self):
+        for pageNum in range(len(self)):
+            yield self[pageNum]
+
+    def close(self):
+        self.table = None
+        self.map.close()
+        self.file.close()
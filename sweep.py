@@ -0,0 +1,204 @@
+#!/usr/bin/python
+
+import os
+import sys
+import time
+import random
+import itertools
+import cPickle
+import multiprocessing
+
+import evaluate
+import page as pageModule
+import pipeline
+import regression
+import structure
+from page import Page
+from parameters import Parameters
+
+# Tries many combinations of the analysis parameters (see parameters.py) over a folder of pages, and
+# reports how well and how fast each one does. Quality is measured against the reference structure of each
+# page (see evaluate.py), as recorded by regression.py or checked by hand, and pages without one are left
+# out. If no page has a reference, candidates can only be scored on their agreement with a run using the
+# default parameters, which says how much they change the results but not whether they're better; the
+# output is then labelled as agreement, and the defaults always score 1.0.
+#
+# Pages are spread over a pool of processes. Each job handles one page for every candidate, so the page is
+# decoded and its contours are traced once, then only the later stages are re-run per candidate. The
+# contours can also be cached on disk, so later sweeps over the same pages skip tracing altogether. The
+# timings are of the stages that are re-run; tracing the contours costs the same for every candidate.
+
+GRID = {
+    'minCharacterArea': [30, 50, 80, 120],
+    'neighbourCount': [2, 3],
+    'neighbourDistanceFactor': [1.5, 2.0, 2.5],
+    'fullLineWidth': [(1280, 1330), (1250, 1360)],
+    'figureMinHeight': [200, 300, 400],
+}
+
+def grid(ranges):
+    # every combination of the values in ranges, a dict of {parameter name: [values]}.
+
+    names = sorted(ranges.keys())
+    combinations = itertools.product(*[ ranges[name] for name in names ])
+    return [ Parameters(**dict(zip(names, values))) for values in combinations ]
+
+def sample(ranges, count, seed=0):
+    # a random subset of the grid, for when the full grid is too big.
+
+    candidates = grid(ranges)
+    if count >= len(candidates):
+        return candidates
+    return random.Random(seed).sample(candidates, count)
+
+def loadBoxes(path, cacheFolder, deskew):
+
+    if cacheFolder is None:
+        return None
+
+    cachePath = cacheFile(path, cacheFolder, deskew)
+    if not os.path.exists(cachePath):
+        return None
+
+    with open(cachePath, 'rb') as cache:
+        return cPickle.load(cache)
+
+def saveBoxes(boxes, path, cacheFolder, deskew):
+
+    if cacheFolder is None or boxes is None:
+        return
+
+    cachePath = cacheFile(path, cacheFolder, deskew)
+    with open(cachePath + '.tmp', 'wb') as cache:
+        cPickle.dump(boxes, cache, cPickle.HIGHEST_PROTOCOL)
+    os.rename(cachePath + '.tmp', cachePath)    # so that a half-written cache is never read
+
+def cacheFile(path, cacheFolder, deskew):
+
+    name = os.path.splitext(os.path.basename(path))[0]
+    return os.path.join(cacheFolder, '%s%s.boxes' %(name, '-deskewed' if deskew else ''))
+
+def referencePaths(paths, referenceFolder):
+    # the reference structure of each page that has one, by image path.
+
+    if referenceFolder is None:
+        return {}
+
+    references = {}
+    for path in paths:
+        referencePath = regression.referencePath(path, referenceFolder)
+        if os.path.exists(referencePath):
+            references[path] = referencePath
+    return references
+
+def sweepPage(job):
+    # Runs every candidate over one page. Returns the page's path and a list of (quality, seconds, comparison)
+    # tuples, one per candidate. Without a reference structure, the page is compared with a run using the
+    # default parameters instead.
+
+    path, candidates, cacheFolder, deskew, referencePath = job
+    pageModule.stopwatch.verbose = False
+
+    image = pipeline.decode(path)
+    boxes = loadBoxes(path, cacheFolder, deskew)
+
+    traced = Page(path, deskew=deskew, image=image, boxes=boxes)
+    if referencePath is not None:
+        reference = structure.loadPage(referencePath)
+    else:
+        reference = traced.analyse()
+
+    if boxes is None:
+        boxes = traced.characters.boxes
+        saveBoxes(boxes, path, cacheFolder, deskew)
+
+    results = []
+    for parameters in candidates:
+        startTime = time.time()
+        page = Page(path, deskew=deskew, image=image, parameters=parameters, boxes=boxes).analyse()
+        seconds = time.time() - startTime
+
+        comparison = evaluate.compare(reference, page)
+        results.append((evaluate.quality(comparison), seconds, comparison))
+
+    return path, results
+
+def sweep(paths, candidates, processes=None, cacheFolder=None, deskew=False, referenceFolder=None):
+    # Returns what the candidates were scored on, 'quality' (against the reference structures) or
+    # 'agreement' (with the defaults), and one (parameters, mean score, mean seconds per page, worst score)
+    # tuple per candidate.
+
+    if cacheFolder is not None and not os.path.isdir(cacheFolder):
+        os.makedirs(cacheFolder)
+
+    references = referencePaths(paths, referenceFolder)
+    if references:
+        measure = 'quality'
+        if len(references) < len(paths):
+            print "leaving out %i of %i pages, which have no reference" %(len(paths) - len(references), len(paths))
+        paths = [ path for path in paths if path in references ]
+    else:
+        measure = 'agreement'
+        print "no reference structures, so scoring agreement with the default parameters"
+
+    jobs = [ (path, candidates, cacheFolder, deskew, references.get(path)) for path in paths ]
+    qualities = [ [] for candidate in candidates ]
+    times = [ [] for candidate in candidates ]
+
+    pool = multiprocessing.Pool(processes)
+    try:
+        for pageNum, (path, results) in enumerate(pool.imap_unordered(sweepPage, jobs)):
+            print "%i/%i\t%s" %(pageNum+1, len(paths), os.path.basename(path))
+            for i, (quality, seconds, comparison) in enumerate(results):
+                qualities[i].append(quality)
+                times[i].append(seconds)
+        pool.close()
+    finally:
+        pool.terminate()
+
+    return measure, [ (candidates[i], sum(qualities[i])/len(qualities[i]), sum(times[i])/len(times[i]),
+                       min(qualities[i])) for i in range(len(candidates)) ]
+
+def tradeOff(summary):
+    # The candidates which aren't beaten on both quality and speed by another one, fastest first. These
+    # are the only ones worth choosing from.
+
+    best = []
+    for candidate in sorted(summary, key=lambda row: (row[2], -row[1])):
+        if len(best) == 0 or candidate[1] > best[-1][1]:
+            best.append(candidate)
+
+    return best
+
+def writeCsv(summary, path, measure='quality'):
+
+    names = sorted(Parameters.defaults.keys())
+    with open(path, 'w') as output:
+        output.write(','.join(names + [measure, 'seconds', 'worst' + measure.capitalize()]) + '\n')
+        for parameters, quality, seconds, worst in summary:
+            values = [ str(getattr(parameters, name)).replace(',', ' ') for name in names ]
+            output.write(','.join(values + ['%.4f' %quality, '%.4f' %seconds, '%.4f' %worst]) + '\n')
+
+def printTable(summary, measure='quality'):
+
+    print "%s\tworst\tseconds\tparameters" %measure
+    for parameters, quality, seconds, worst in summary:
+        print "%.3f\t%.3f\t%.3f\t%r" %(quality, worst, seconds, parameters)
+
+if __name__ == '__main__':
+    # usage: sweep.py [image folder] [output csv] [number of candidates] [reference folder]
+
+    inputFolder = sys.argv[1] if len(sys.argv) > 1 else os.path.join('images')
+    outputPath = sys.argv[2] if len(sys.argv) > 2 else 'sweep.csv'
+    count = int(sys.argv[3]) if len(sys.argv) > 3 else None
+    referenceFolder = sys.argv[4] if len(sys.argv) > 4 else 'reference'
+
+    paths = [ os.path.join(inputFolder, filename) for filename in sorted(os.listdir(inputFolder)) ]
+    candidates = sample(GRID, count) if count is not None else grid(GRID)
+
+    measure, summary = sweep(paths, candidates, cacheFolder='sweep-cache', referenceFolder=referenceFolder)
+    writeCsv(summary, outputPath, measure)
+
+    print
+    print "%s vs runtime trade-off (%i of %i candidates):" %(measure, len(tradeOff(summary)), len(summary))
+    printTable(tradeOff(summary), measure)
@@ -0,0 +1,28 @@
+import numpy
+
+import structure
+
+def pageArrays(source, blockTypes=('Paragraph',), shape=(2400, 1600)):
+    # The arrays of a made-up page (see structure.pageToArrays), with one line of one word in each block.
+    # Block i sits 100 pixels further down the page than block i-1.
+
+    blockCount = len(blockTypes)
+    tops = numpy.arange(blockCount) * 100 + 100
+
+    arrays = {}
+    arrays['version'] = numpy.array(structure.VERSION)
+    arrays['source'] = numpy.array(source)
+    arrays['shape'] = numpy.array(shape, numpy.int32)
+    arrays['characters'] = numpy.array([ (200, top + 20) for top in tops ], numpy.int32).reshape(-1, 2)
+    arrays['wordCharacters'], arrays['wordOffsets'] = structure.ragged([ [i] for i in range(blockCount) ])
+    boxes = numpy.array([ [(100, top), (900, top), (900, top + 40), (100, top + 40)] for top in tops ],
+                        numpy.int32).reshape(-1, 4, 2)
+    arrays['wordBoxes'] = boxes
+    arrays['lineBoxes'] = boxes.copy()
+    arrays['lineWords'], arrays['lineOffsets'] = structure.ragged([ [i] for i in range(blockCount) ])
+    arrays['margin'] = numpy.zeros((0, 2, 2), numpy.float64)
+    arrays['blockTypes'] = numpy.array([ structure.BLOCK_TYPES.index(name) for name in blockTypes ], numpy.uint8)
+    arrays['blockLines'], arrays['blockOffsets'] = structure.ragged([ [i] for i in range(blockCount) ])
+    arrays['boilerplate'] = numpy.array([-1] * len(structure.BOILERPLATE_FIELDS), numpy.int32)
+
+    return arrays
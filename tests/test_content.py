@@ -0,0 +1,233 @@
+import unittest
+
+import numpy
+
+from content import Content, Figure, Paragraph, SectionTitle
+from text import LineCollection
+
+NAMES = ['isFigure', 'isCentered', 'isParagraphStart', 'isParagraphEnd', 'isHorizontalRule']
+
+def randomAttributes(count, random):
+    # each flag is set on about one line in four, so that every transition comes up.
+    return dict( (name, random.rand(count) < 0.25) for name in NAMES )
+
+class OldContent:
+    # The recursive state machine that Content used before classify, kept here to check that classify
+    # still groups the lines the same way. Returns (contentType, [line numbers]) pairs.
+
+    def __init__(self, attributes):
+
+        self.attributes = attributes
+        self.next = 0
+        self.blocks = []
+
+        newLine = self.pull()
+        if newLine is None:
+            return
+        if self.flag('isFigure', newLine):
+            self.newFigure(newLine)
+        elif self.flag('isCentered', newLine):
+            self.sectionTitle(newLine)
+        else:
+            self.newParagraph(newLine)
+
+    def pull(self):
+        if self.next == len(self.attributes['isFigure']):
+            return None
+        self.next += 1
+        return self.next - 1
+
+    def flag(self, name, line):
+        return self.attributes[name][line]
+
+    def newFigure(self, line):
+
+        figure = ('Figure', [line])
+        newLine = self.pull()
+        if newLine is None:
+            self.blocks.append(figure)
+        elif self.flag('isCentered', newLine):
+            self.addCaptionLine(newLine, figure)
+        else:
+            self.blocks.append(figure)
+            self.newParagraph(newLine)
+
+    def addCaptionLine(self, line, figure):
+
+        figure[1].append(line)
+        newLine = self.pull()
+        if newLine is None:
+            self.blocks.append(figure)
+        elif self.flag('isCentered', newLine):
+            self.addCaptionLine(newLine, figure)
+        else:
+            self.blocks.append(figure)
+            self.newParagraph(newLine)
+
+    def newParagraph(self, line):
+
+        paragraph = ('Paragraph', [line])
+        newLine = self.pull()
+        if newLine is None:
+            self.blocks.append(paragraph)
+        elif self.flag('isFigure', newLine):
+            self.blocks.append(paragraph)
+            self.newFigure(newLine)
+        elif self.flag('isCentered', newLine):
+            self.blocks.append(paragraph)
+            self.sectionTitle(newLine)
+        elif self.flag('isParagraphEnd', line) or self.flag('isParagraphStart', newLine):
+            self.blocks.append(paragraph)
+            self.newParagraph(newLine)
+        elif self.flag('isParagraphEnd', newLine):
+            self.paragraphEnd(newLine, paragraph)
+        else:
+            self.paragraphBody(newLine, paragraph)
+
+    def paragraphBody(self, line, paragraph):
+
+        paragraph[1].append(line)
+        newLine = self.pull()
+        if newLine is None:
+            self.blocks.append(paragraph)
+        elif self.flag('isFigure', newLine):
+            self.blocks.append(paragraph)
+            self.newFigure(newLine)
+        elif self.flag('isCentered', newLine):
+            self.blocks.append(paragraph)
+            self.sectionTitle(newLine)
+        elif self.flag('isParagraphStart', newLine):
+            self.blocks.append(paragraph)
+            self.newParagraph(newLine)
+        elif self.flag('isParagraphEnd', newLine):
+            self.paragraphEnd(newLine, paragraph)
+        else:
+            self.paragraphBody(newLine, paragraph)
+
+    def paragraphEnd(self, line, paragraph):
+
+        paragraph[1].append(line)
+        newLine = self.pull()
+        self.blocks.append(paragraph)
+        if newLine is None:
+            return
+        elif self.flag('isFigure', newLine):
+            self.newFigure(newLine)
+        elif self.flag('isCentered', newLine):
+            self.sectionTitle(newLine)
+        else:
+            self.newParagraph(newLine)
+
+    def sectionTitle(self, line):
+
+        newLine = self.pull()
+        self.blocks.append(('SectionTitle', [line]))
+        if newLine is None:
+            return
+        elif self.flag('isFigure', newLine):
+            self.newFigure(newLine)
+        else:
+            self.newParagraph(newLine)
+
+class ClassifyTest(unittest.TestCase):
+
+    def testMatchesOldStateMachine(self):
+
+        random = numpy.random.RandomState(0)
+        for trial in range(500):
+            attributes = randomAttributes(random.randint(0, 40), random)
+            blocks, states = Content.classify(attributes)
+            self.assertEqual(blocks, OldContent(attributes).blocks)
+            self.assertEqual(len(states), len(attributes['isFigure']))
+
+    def testPage(self):
+
+        # a title, a paragraph of three lines, a figure with a two-line caption, and a one-line paragraph.
+        flags = {
+            'isCentered':       [1, 0, 0, 0, 0, 1, 1, 0],
+            'isFigure':         [0, 0, 0, 0, 1, 0, 0, 0],
+            'isParagraphStart': [0, 1, 0, 0, 0, 0, 0, 1],
+            'isParagraphEnd':   [0, 0, 0, 1, 0, 0, 0, 1],
+            'isHorizontalRule': [0, 0, 0, 0, 0, 0, 0, 0],
+        }
+        attributes = dict( (name, numpy.array(values, bool)) for name, values in flags.items() )
+        lines = [ object() for i in range(8) ]
+
+        content = Content(LineCollection(lines), attributes=attributes)
+        self.assertEqual(content.blocks, [('SectionTitle', [0]), ('Paragraph', [1, 2, 3]), ('Figure', [4, 5, 6]),
+                                          ('Paragraph', [7])])
+        self.assertEqual([ block.__class__ for block in content.content ], [SectionTitle, Paragraph, Figure, Paragraph])
+        self.assertIs(content.content[2].image, lines[4])
+        self.assertEqual(content.content[2].caption, lines[5:7])
+        self.assertEqual(content.content[1].lines, lines[1:4])
+
+    def testPickingUpPartWay(self):
+
+        random = numpy.random.RandomState(1)
+        for trial in range(200):
+            attributes = randomAttributes(random.randint(1, 40), random)
+            blocks, states = Content.classify(attributes)
+
+            start = random.randint(0, len(states) + 1)
+            state = states[start-1] if start > 0 else None
+            before = []
+            for contentType, lineNumbers in blocks:
+                if lineNumbers[0] < start:
+                    before.append((contentType, [ i for i in lineNumbers if i < start ]))
+            self.assertEqual(Content.classify(attributes, start, state, before), (blocks, [None]*start + states[start:]))
+
+class UpdateTest(unittest.TestCase):
+
+    def blockLines(self, block):
+        if isinstance(block, Figure):
+            return [block.image] + list(block.caption)
+        return list(block.lines)
+
+    def testMatchesClassifyingAgain(self):
+
+        random = numpy.random.RandomState(2)
+        for trial in range(200):
+            count = random.randint(1, 40)
+            attributes = randomAttributes(count, random)
+            lines = [ object() for i in range(count) ]
+            content = Content(LineCollection(lines), attributes=attributes)
+
+            # replace a run of lines with new ones, as reanalysing a region of the page does.
+            start = random.randint(0, count + 1)
+            end = random.randint(start, count + 1)
+            added = random.randint(0, 4)
+            newLines = lines[:start] + [ object() for i in range(added) ] + lines[end:]
+            newAttributes = randomAttributes(added, random)
+            newAttributes = dict( (name, numpy.concatenate([values[:start], newAttributes[name], values[end:]]))
+                                  for name, values in attributes.items() )
+
+            oldBlocks = list(content.content)
+            firstLine = content.update(LineCollection(newLines), newAttributes)
+            fresh = Content(LineCollection(newLines), attributes=newAttributes)
+
+            if end > start or added > 0:
+                self.assertLessEqual(firstLine, start)
+            self.assertEqual(content.blocks, fresh.blocks)
+            self.assertEqual([ block.__class__ for block in content.content ], [ block.__class__ for block in fresh.content ])
+            for block, freshBlock in zip(content.content, fresh.content):
+                self.assertEqual(self.blockLines(block), self.blockLines(freshBlock))
+
+            # the blocks which end before the first changed line are kept as they were.
+            for block, oldBlock in zip(content.content, oldBlocks):
+                if lines.index(self.blockLines(oldBlock)[-1]) + 1 >= firstLine:
+                    break
+                self.assertIs(block, oldBlock)
+
+    def testNothingChanged(self):
+
+        attributes = randomAttributes(10, numpy.random.RandomState(3))
+        lines = [ object() for i in range(10) ]
+        content = Content(LineCollection(lines), attributes=attributes)
+        blocks = list(content.content)
+
+        self.assertEqual(content.update(LineCollection(lines), attributes), 10)
+        self.assertEqual(content.content[:-1], blocks[:-1])
+        self.assertEqual(content.blocks, Content.classify(attributes)[0])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,74 @@
+import math
+import unittest
+
+import cv2
+import numpy
+
+import geometry as g
+
+def linePoints(angle, x0, y0, count, noise=0.0, seed=0):
+    # points spread along a line through (x0, y0) at `angle` degrees, moved off it by up to `noise`.
+
+    random = numpy.random.RandomState(seed)
+    radians = math.radians(angle)
+    distances = numpy.linspace(-100, 100, count)
+    offsets = random.uniform(-noise, noise, count)
+    x = x0 + distances*math.cos(radians) - offsets*math.sin(radians)
+    y = y0 + distances*math.sin(radians) + offsets*math.cos(radians)
+    return numpy.column_stack([x, y])
+
+def angleDifference(first, second):
+    # the difference between two line angles in degrees, where a line at 180 is the same as at 0.
+    difference = (first - second) % 180
+    return min(difference, 180 - difference)
+
+class FitLinesTest(unittest.TestCase):
+
+    def fit(self, groups, robust=None):
+        offsets = numpy.cumsum([0] + [ len(group) for group in groups ])
+        return g.fitLines(numpy.vstack(groups), offsets, robust)
+
+    def testExactLines(self):
+
+        fit = self.fit([linePoints(0, 10, 20, 5), linePoints(30, 0, 0, 7), linePoints(-45, 50, 50, 3)])
+
+        for angle, expected in zip(fit.angles, [0, 30, -45]):
+            self.assertAlmostEqual(angleDifference(angle, expected), 0, places=6)
+        self.assertAlmostEqual(fit.slopes[0], 0, places=6)
+        self.assertAlmostEqual(fit.intercepts[0], 20, places=6)
+        self.assertAlmostEqual(fit.slopes[1], math.tan(math.radians(30)), places=6)
+        self.assertAlmostEqual(fit.intercepts[1], 0, places=6)
+        self.assertAlmostEqual(fit.x0[2], 50, places=6)
+        self.assertAlmostEqual(fit.y0[2], 50, places=6)
+
+    def testVerticalLine(self):
+
+        fit = self.fit([linePoints(90, 5, 0, 10)])
+        self.assertAlmostEqual(angleDifference(fit.angles[0], 90), 0, places=6)
+        self.assertAlmostEqual(fit.x0[0], 5, places=6)
+
+    def testMatchesFitLine(self):
+
+        groups = [ linePoints(angle, 100, 200, 40, noise=5, seed=i) for i, angle in enumerate([-60, -5, 0, 12, 80]) ]
+        fit = self.fit(groups)
+
+        for angle, group in zip(fit.angles, groups):
+            vx, vy, x0, y0 = numpy.ravel(cv2.fitLine(group.astype(numpy.float32), cv2.cv.CV_DIST_L2, 0, 0.01, 0.01))
+            self.assertLess(angleDifference(angle, math.degrees(math.atan2(vy, vx))), 0.01)
+
+    def testRobustFitsIgnoreOutliers(self):
+
+        group = linePoints(0, 0, 100, 30, noise=1)
+        group[::6, 1] += 40         # a few descenders far off the baseline
+
+        plain = self.fit([group]).angles[0]
+        for robust in ['huber', 'l1']:
+            fit = self.fit([group], robust)
+            self.assertLess(abs(fit.y0[0] - 100), abs(self.fit([group]).y0[0] - 100))
+            self.assertLessEqual(angleDifference(fit.angles[0], 0), angleDifference(plain, 0) + 1e-9)
+
+    def testUnknownRobustness(self):
+        self.assertRaises(ValueError, self.fit, [linePoints(0, 0, 0, 5)], 'cauchy')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,64 @@
+import unittest
+
+import numpy
+
+import layout
+
+def block(x, y, columns, rows):
+    # the (x, y, width, height) boxes of a block of text: characters 20x30 pixels, 25 pixels apart along a
+    # line, and lines 40 pixels apart, so neither gap is wide enough to cut along.
+    return [ (x + 25*column, y + 40*row, 20, 30) for row in range(rows) for column in range(columns) ]
+
+class XYCutTest(unittest.TestCase):
+
+    def cut(self, *blocks):
+        bounds = numpy.array([ box for boxes in blocks for box in boxes ])
+        return layout.xyCut(bounds, minBlockGap=24, minColumnGap=40, minColumnHeight=300)
+
+    def testNoBoxes(self):
+        self.assertIsNone(layout.xyCut(numpy.zeros((0, 4))))
+
+    def testSingleBlock(self):
+
+        root = self.cut(block(100, 100, 20, 15))
+        self.assertEqual(root.children, [])
+        self.assertEqual(root.bounds, (100, 100, 25*19 + 20, 40*14 + 30))
+        self.assertEqual(sorted(root.indices), range(300))
+
+    def testParagraphs(self):
+
+        root = self.cut(block(100, 100, 20, 5), block(100, 400, 20, 5))
+        self.assertEqual(root.direction, 'rows')
+        self.assertEqual([ sorted(region.indices) for region in root.blocks() ], [range(100), range(100, 200)])
+        self.assertFalse(root.hasColumns())
+        self.assertEqual(len(root.columns()), 1)
+
+    def testColumnsUnderHeading(self):
+
+        heading = block(100, 50, 30, 1)
+        left, right = block(100, 150, 12, 20), block(500, 150, 12, 20)
+        root = self.cut(heading, left, right)
+
+        self.assertEqual(root.direction, 'rows')
+        self.assertTrue(root.hasColumns())
+        self.assertEqual(root.children[1].direction, 'columns')
+        self.assertEqual([ sorted(region.indices) for region in root.blocks() ],
+                         [range(30), range(30, 270), range(270, 510)])
+        self.assertEqual([ region.bounds[0] for region in root.columns() ], [100, 100, 500])
+
+    def testShortLinesAreNotColumns(self):
+
+        # a running header: two short groups of words far apart, but only one line tall.
+        root = self.cut(block(100, 50, 5, 1), block(1000, 50, 3, 1))
+        self.assertEqual(root.children, [])
+
+    def testNarrowGapsAreNotCut(self):
+
+        # 20 rows apart (less than minBlockGap) and 35 pixels across (less than minColumnGap).
+        root = self.cut(block(100, 100, 10, 10), block(100, 100 + 40*9 + 30 + 20, 10, 10))
+        self.assertEqual(root.children, [])
+        root = self.cut(block(100, 100, 10, 10), block(100 + 25*9 + 20 + 35, 100, 10, 10))
+        self.assertEqual(root.children, [])
+
+if __name__ == '__main__':
+    unittest.main()
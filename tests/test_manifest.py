@@ -0,0 +1,82 @@
+import os
+import json
+import shutil
+import tempfile
+import unittest
+
+from manifest import Manifest
+
+class ManifestTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'manifest.json')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def testEverythingPendingAtFirst(self):
+
+        manifest = Manifest(self.path)
+        paths = ['images/page1.jpg', 'images/page2.jpg']
+        self.assertEqual(manifest.pending(paths), paths)
+        self.assertEqual(manifest.failures(), [])
+        self.assertFalse(os.path.exists(self.path))
+
+    def testResumesAfterRestart(self):
+
+        manifest = Manifest(self.path)
+        manifest.markDone('images/page1.jpg', ['out/page1.jpg', 'out/page1.npz'])
+        manifest.markFailed('images/page2.jpg', 'Traceback: ...')
+
+        # a new run, with the images moved to another folder.
+        manifest = Manifest(self.path)
+        paths = ['moved/page1.jpg', 'moved/page2.jpg', 'moved/page3.jpg']
+        self.assertEqual(manifest.pending(paths), ['moved/page2.jpg', 'moved/page3.jpg'])
+        self.assertEqual(manifest.failures(), [('page2.jpg', 1, 'Traceback: ...')])
+        self.assertFalse(os.path.exists(self.path + '.tmp'))
+        with open(self.path) as manifestFile:
+            self.assertEqual(sorted(json.load(manifestFile)), ['page1.jpg', 'page2.jpg'])
+
+    def testGivesUpAfterMaxAttempts(self):
+
+        manifest = Manifest(self.path, maxAttempts=2)
+        manifest.markFailed('page.jpg', 'first')
+        self.assertTrue(manifest.isPending('page.jpg'))
+        manifest.markFailed('page.jpg', 'second')
+        self.assertFalse(manifest.isPending('page.jpg'))
+        self.assertEqual(manifest.failures(), [('page.jpg', 2, 'second')])
+
+        # more attempts are allowed on a later run, if it asks for them.
+        self.assertTrue(Manifest(self.path, maxAttempts=3).isPending('page.jpg'))
+
+    def testSuccessAfterFailure(self):
+
+        manifest = Manifest(self.path)
+        manifest.markFailed('page.jpg', 'error')
+        manifest.markDone('page.jpg', ['page.npz'])
+
+        self.assertFalse(manifest.isPending('page.jpg'))
+        self.assertEqual(manifest.failures(), [])
+        self.assertEqual(manifest.pages['page.jpg']['attempts'], 2)
+        self.assertIsNone(manifest.pages['page.jpg']['error'])
+
+    def testOutputs(self):
+
+        manifest = Manifest(self.path)
+        manifest.markDone('b.jpg', ['out/b.jpg', 'out/b.npz'])
+        manifest.markDone('a.jpg', ['out/a.jpg', 'out/a.npz'])
+        manifest.markFailed('c.jpg', 'error')
+
+        paths = ['a.jpg', 'b.jpg', 'c.jpg', 'd.jpg']
+        self.assertEqual(manifest.outputs(paths), ['out/a.jpg', 'out/a.npz', 'out/b.jpg', 'out/b.npz'])
+        self.assertEqual(manifest.outputs(paths, '.npz'), ['out/a.npz', 'out/b.npz'])
+
+    def testPagesOfOneFileAreSeparate(self):
+
+        manifest = Manifest(self.path)
+        manifest.markDone('scans/book.tif#0', ['book.tif-0000.png'])
+        self.assertEqual(manifest.pending(['scans/book.tif#0', 'scans/book.tif#1']), ['scans/book.tif#1'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,53 @@
+import unittest
+
+import numpy
+
+import colors
+import page as pageModule
+from page import Page
+
+def figurePage():
+    # a 300 dpi page with a framed figure in the middle, and a few lines of blocks for text.
+
+    image = numpy.empty((1200, 900, 3), numpy.uint8)
+    image[:] = colors.greyscale.WHITE
+    image[300:900, 200:700] = colors.greyscale.BLACK
+    image[310:890, 210:690] = colors.greyscale.WHITE
+
+    for top in range(960, 1120, 50):
+        for left in range(100, 800, 40):
+            image[top:top+30, left:left+24] = colors.greyscale.BLACK
+    return image
+
+class SourceCoordinatesTest(unittest.TestCase):
+
+    def setUp(self):
+        pageModule.stopwatch.verbose = False
+
+    def testFiguresAtLowerWorkingDpi(self):
+
+        image = figurePage()
+        full = Page('figure.png', image=image, dpi=300)
+        half = Page('figure.png', image=image, dpi=300, workingDpi=150)
+
+        self.assertEqual(len(full.figures), 1)
+        self.assertEqual(len(half.figures), 1)
+        numpy.testing.assert_allclose(full.sourceFigures, full.figures[0].points[None])
+        numpy.testing.assert_allclose(half.sourceFigures, half.figures[0].points[None] * 2.0)
+        numpy.testing.assert_allclose(half.sourceFigures, full.sourceFigures, atol=3)
+
+    def testWordsAndLinesAtLowerWorkingDpi(self):
+
+        image = figurePage()
+        full = Page('figure.png', image=image, dpi=300)
+        half = Page('figure.png', image=image, dpi=300, workingDpi=150)
+
+        for name in ['sourceWords', 'sourceLines']:
+            fullCorners, halfCorners = getattr(full, name), getattr(half, name)
+            self.assertEqual(fullCorners.shape, halfCorners.shape)
+            self.assertGreater(len(fullCorners), 0)
+            order = lambda corners: corners[numpy.lexsort(corners[:,1].T[::-1])]
+            numpy.testing.assert_allclose(order(halfCorners), order(fullCorners), atol=3)
+
+if __name__ == '__main__':
+    unittest.main()
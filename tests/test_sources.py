@@ -0,0 +1,70 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import cv2
+import numpy
+
+import sources
+
+WIDTH, HEIGHT = 612, 792        # a letter page, in points
+
+def pngBytes(width, height):
+
+    image = numpy.zeros((height, width, 3), numpy.uint8)
+    image[:,:width/2] = 255
+    return cv2.imencode('.png', image)[1].tostring()
+
+@unittest.skipIf(sources.fitz is None, 'PyMuPDF is not installed')
+class PdfPageTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'book.pdf')
+
+    def tearDown(self):
+        sources.closeAll()
+        shutil.rmtree(self.folder)
+
+    def decode(self, addPage):
+
+        document = sources.fitz.open()
+        page = document.newPage(width=WIDTH, height=HEIGHT)
+        addPage(page)
+        document.save(self.path)
+        document.close()
+
+        return sources.decode(sources.pagePath(self.path, 0))
+
+    def rendered(self, width=WIDTH, height=HEIGHT):
+        return (height * sources.RENDER_DPI / 72, width * sources.RENDER_DPI / 72, 3)
+
+    def testScanIsTakenOut(self):
+
+        image = self.decode(lambda page: page.insertImage(page.rect, stream=pngBytes(306, 396)))
+        self.assertEqual(image.shape, (396, 306, 3))
+
+    def testLogoOnTextPageIsRendered(self):
+
+        def addPage(page):
+            page.insertText((72, 144), 'A page of text with a logo on it.')
+            page.insertImage(sources.fitz.Rect(72, 36, 144, 72), stream=pngBytes(200, 100))
+
+        self.assertEqual(self.decode(addPage).shape, self.rendered())
+
+    def testRotatedPageIsRendered(self):
+
+        def addPage(page):
+            page.insertImage(page.rect, stream=pngBytes(306, 396))
+            page.setRotation(90)
+
+        self.assertEqual(self.decode(addPage).shape, self.rendered(HEIGHT, WIDTH))
+
+    def testRotatedImageIsRendered(self):
+
+        image = self.decode(lambda page: page.insertImage(page.rect, stream=pngBytes(396, 306), rotate=90))
+        self.assertEqual(image.shape, self.rendered())
+
+if __name__ == '__main__':
+    unittest.main()
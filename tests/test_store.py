@@ -0,0 +1,107 @@
+import os
+import shutil
+import tempfile
+import unittest
+
+import numpy
+
+from store import Store, PAGE_RECORD
+from tests import fakes
+
+class StoreTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.path = os.path.join(self.folder, 'store')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def testEmpty(self):
+
+        store = Store(self.path)
+        self.assertEqual(len(store), 0)
+        self.assertEqual(store.pages(), [])
+        self.assertEqual(len(store.blocks()), 0)
+        store.close()
+
+    def testReadBack(self):
+
+        store = Store(self.path)
+        store.append(3, fakes.pageArrays('three.jpg', ['SectionTitle', 'Paragraph']))
+        store.append(1, fakes.pageArrays('one.jpg'))
+        store.refresh()
+
+        self.assertEqual(store.pages(), [1, 3])
+        self.assertIn(3, store)
+        self.assertNotIn(2, store)
+        page = store.page(3)
+        self.assertEqual(page.source, 'three.jpg')
+        self.assertEqual(page.blockTypes, ['SectionTitle', 'Paragraph'])
+        store.close()
+
+    def testLaterCopyWins(self):
+
+        store = Store(self.path)
+        store.append(0, fakes.pageArrays('first.jpg', ['Paragraph', 'Paragraph']))
+        store.append(0, fakes.pageArrays('second.jpg', ['Figure']))
+        store.refresh()
+
+        self.assertEqual(len(store), 1)
+        self.assertEqual(store.page(0).source, 'second.jpg')
+        self.assertEqual([ Store.blockType(record) for record in store.blocks() ], ['Figure'])
+        store.close()
+
+    def testBlockQueries(self):
+
+        store = Store(self.path)
+        for pageNum in range(5):
+            store.append(pageNum, fakes.pageArrays('page%i.jpg' %pageNum, ['SectionTitle', 'Paragraph', 'Figure']))
+        store.refresh()
+
+        titles = store.blocks('SectionTitle')
+        self.assertEqual(list(titles['page']), range(5))
+        self.assertEqual(set(titles['item']), set([0]))
+
+        self.assertEqual(len(store.blocks(['Paragraph', 'Figure'], pages=(1, 2))), 4)
+
+        # fake blocks are 800x40 boxes at y = 100, 200 and 300, so this only overlaps the paragraphs.
+        inRegion = store.blocks(region=(0, 210, 200, 50))
+        self.assertEqual([ Store.blockType(record) for record in inRegion ], ['Paragraph'] * 5)
+        store.close()
+
+    def testOtherWritersAreSeenAfterRefresh(self):
+
+        reader = Store(self.path)
+        writer = Store(self.path)
+        writer.append(7, fakes.pageArrays('seven.jpg'))
+
+        self.assertEqual(len(reader), 0)
+        reader.refresh()
+        self.assertEqual(reader.pages(), [7])
+        reader.close()
+        writer.close()
+
+    def testHalfWrittenRecordsAreIgnored(self):
+
+        store = Store(self.path)
+        store.append(0, fakes.pageArrays('zero.jpg'))
+        store.close()
+
+        # writers have got part of the way through two more pages: one has written an index record for
+        # data that isn't all there, and the other half of its record.
+        dataPath = os.path.join(self.path, 'pages.dat')
+        size = os.path.getsize(dataPath)
+        with open(dataPath, 'ab') as output:
+            output.write('partial')
+        with open(os.path.join(self.path, 'pages.idx'), 'ab') as output:
+            output.write(numpy.array([(1, size, 1000)], PAGE_RECORD).tostring())
+            output.write('\0' * (PAGE_RECORD.itemsize // 2))
+
+        store = Store(self.path)
+        self.assertEqual(store.pages(), [0])
+        self.assertEqual(store.page(0).source, 'zero.jpg')
+        store.close()
+
+if __name__ == '__main__':
+    unittest.main()
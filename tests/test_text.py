@@ -0,0 +1,107 @@
+import unittest
+
+import cv2
+import numpy
+
+import colors
+from text import CharacterSet
+
+def page(lineTops, lineHeight=20, shape=(800, 600)):
+    # a white page with a dark scanning strip down its left edge and a black bar for each line of text.
+
+    image = numpy.empty(shape, numpy.uint8)
+    image[:] = colors.greyscale.WHITE
+    image[:, :10] = 20
+    for top in lineTops:
+        image[top:top+lineHeight, 80:520] = colors.greyscale.BLACK
+    return image
+
+class GetBandsTest(unittest.TestCase):
+
+    def bands(self, image, count):
+        return CharacterSet(image).getBands(image, count)
+
+    def testCutsBetweenLinesDespiteEdgeStrip(self):
+
+        lineTops = range(30, 780, 40)
+        image = page(lineTops)
+        bands = self.bands(image, 4)
+
+        self.assertEqual(len(bands), 4)
+        self.assertEqual(bands[0][0], 0)
+        self.assertEqual(bands[-1][1], image.shape[0])
+        for (top, bottom), (nextTop, nextBottom) in zip(bands[:-1], bands[1:]):
+            self.assertEqual(bottom, nextTop)
+            self.assertFalse(any(lineTop <= bottom < lineTop + 20 for lineTop in lineTops))
+
+    def testCutsAtLeastInkWithoutBlankRow(self):
+
+        # the text fills the page, except for a thin gap just above the middle.
+        image = page([0], lineHeight=800)
+        image[395:397] = colors.greyscale.WHITE
+        image[395:397, :10] = 20
+        image[396, 300] = colors.greyscale.BLACK
+
+        self.assertEqual(self.bands(image, 2), [(0, 395), (395, 800)])
+
+    def testSingleBand(self):
+
+        image = page([100])
+        self.assertEqual(self.bands(image, 1), [(0, 800)])
+
+def slantedPage():
+    # A page with no blank rows to cut along: lines of "glyphs" sloping down to the right, a dark strip down
+    # the left edge which is one pixel wide at the top, a tall frame with glyphs inside it (which aren't
+    # characters, since they're inside another outline), and a U whose arms are only joined at the bottom.
+
+    image = numpy.empty((1200, 900), numpy.uint8)
+    image[:] = colors.greyscale.WHITE
+    image[:, 0] = colors.greyscale.BLACK
+    image[600:, 1] = colors.greyscale.BLACK
+
+    for lineTop in range(20, 1160, 45):
+        for column in range(30):
+            x = 60 + 18*column
+            y = lineTop + column
+            image[y:y+30, x:x+12] = colors.greyscale.BLACK
+            image[y+8:y+22, x+4:x+8] = colors.greyscale.WHITE     # a hole, as in an 'o'
+
+    image[250:950, 650:880] = colors.greyscale.WHITE
+    image[250:950, 650:880][[0, 1, 2, -3, -2, -1], :] = colors.greyscale.BLACK
+    image[250:950, 650:880][:, [0, 1, 2, -3, -2, -1]] = colors.greyscale.BLACK
+    for y in range(270, 930, 40):
+        image[y:y+20, 700:720] = colors.greyscale.BLACK
+
+    image[100:700, 600:606] = colors.greyscale.BLACK
+    image[100:700, 630:636] = colors.greyscale.BLACK
+    image[694:700, 600:636] = colors.greyscale.BLACK
+
+    return image
+
+class BandsTest(unittest.TestCase):
+
+    def contours(self, image, threads, denoise):
+        characters = CharacterSet(image, threads=threads, denoise=denoise).characters
+        return sorted( character.contour.tostring() for character in characters )
+
+    def testSameAsOneBand(self):
+
+        image = slantedPage()
+        characterSet = CharacterSet(image)
+        for threads in [2, 3, 4, 7]:
+            cuts = [ top for top, bottom in characterSet.getBands(image, threads)[1:] ]
+            self.assertTrue(all( numpy.any(image[cut, 50:-50] <= colors.greyscale.MID_GREY) for cut in cuts ))
+
+            for denoise in [False, True]:
+                self.assertEqual(self.contours(image, threads, denoise), self.contours(image, 1, denoise))
+
+    def testFrameContentsAreLeftOut(self):
+
+        # the glyphs inside the frame aren't characters, whichever band they're in; only the frame is.
+        for threads in [1, 4]:
+            characters = CharacterSet(slantedPage(), threads=threads).characters
+            inFrame = [ character for character in characters if 660 < character.x < 870 and 260 < character.y < 940 ]
+            self.assertEqual([ cv2.boundingRect(character.contour) for character in inFrame ], [(650, 250, 230, 700)])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,175 @@
+import os
+import time
+import shutil
+import tempfile
+import unittest
+import multiprocessing
+
+import workqueue
+from workqueue import WorkQueue
+from store import Store
+from tests import fakes
+
+def analyseFake(path):
+    # stands in for workqueue.analysePage, without any images. A path ending in 'crash' kills its worker
+    # outright the first time it's tried, as a machine going down would.
+
+    if path.endswith('crash'):
+        marker = path + '.tried'
+        if not os.path.exists(marker):
+            open(marker, 'w').close()
+            os._exit(1)
+
+    return fakes.pageArrays(path)
+
+def runWorker(queuePath, leaseSeconds):
+    workqueue.work(queuePath, analyseFake, leaseSeconds=leaseSeconds, pollSeconds=0.05)
+
+class WorkQueueTest(unittest.TestCase):
+
+    def setUp(self):
+        self.folder = tempfile.mkdtemp()
+        self.queuePath = os.path.join(self.folder, 'queue.db')
+        self.storePath = os.path.join(self.folder, 'store')
+
+    def tearDown(self):
+        shutil.rmtree(self.folder)
+
+    def paths(self, *names):
+        return [ os.path.join(self.folder, name) for name in names ]
+
+    def pageNums(self, queue):
+        return dict(queue.connection.execute('SELECT path, pageNum FROM jobs').fetchall())
+
+    def testAddingAgainOnlyAddsNewPages(self):
+
+        queue = WorkQueue(self.queuePath)
+        queue.add(self.paths('a', 'c', 'e'), self.storePath)
+        queue.add(self.paths('a', 'b', 'c', 'd', 'e'), self.storePath)
+
+        pageNums = self.pageNums(queue)
+        self.assertEqual(len(pageNums), 5)
+        self.assertEqual(sorted(pageNums.values()), range(5))
+        self.assertEqual([ pageNums[path] for path in self.paths('a', 'c', 'e') ], [0, 1, 2])
+        queue.close()
+
+    def testSecondFolderCarriesOnNumbering(self):
+
+        queue = WorkQueue(self.queuePath)
+        queue.add(self.paths('one/a', 'one/b'), self.storePath)
+        queue.add(self.paths('two/a', 'two/b'), self.storePath)
+        queue.add(self.paths('three/a'), os.path.join(self.folder, 'other store'))
+
+        pageNums = self.pageNums(queue)
+        self.assertEqual([ pageNums[path] for path in self.paths('one/a', 'one/b', 'two/a', 'two/b') ], [0, 1, 2, 3])
+        self.assertEqual(pageNums[self.paths('three/a')[0]], 0)
+        queue.close()
+
+    def testGivenPageNumbers(self):
+
+        queue = WorkQueue(self.queuePath)
+        queue.add(self.paths('a', 'b'), self.storePath, [10, 20])
+        self.assertEqual(sorted(self.pageNums(queue).values()), [10, 20])
+        queue.close()
+
+    def testClaimsAreExclusive(self):
+
+        queue = WorkQueue(self.queuePath)
+        queue.add(self.paths('a', 'b'), self.storePath)
+
+        first = queue.claim('first')
+        second = queue.claim('second')
+        self.assertNotEqual(first.path, second.path)
+        self.assertIsNone(queue.claim('third'))
+        self.assertEqual(queue.counts()['running'], 2)
+
+        queue.complete(first, 'first')
+        queue.complete(second, 'second')
+        self.assertTrue(queue.isFinished())
+        queue.close()
+
+    def testExpiredLeaseGoesToAnotherWorker(self):
+
+        queue = WorkQueue(self.queuePath, leaseSeconds=0.1)
+        queue.add(self.paths('a'), self.storePath)
+
+        job = queue.claim('dead')
+        self.assertIsNone(queue.claim('alive'))
+        time.sleep(0.2)
+        self.assertEqual(queue.counts()['pending'], 1)
+
+        retry = queue.claim('alive')
+        self.assertEqual(retry.id, job.id)
+        self.assertEqual(retry.attempts, 2)
+
+        # the dead worker has lost the job, so it can no longer renew or fail it.
+        self.assertFalse(queue.renew(job, 'dead'))
+        queue.fail(job, 'dead', 'too late')
+        self.assertTrue(queue.renew(retry, 'alive'))
+        queue.close()
+
+    def testFailingJobsAreGivenUpOn(self):
+
+        queue = WorkQueue(self.queuePath, maxAttempts=2)
+        queue.add(self.paths('a'), self.storePath)
+
+        job = queue.claim('worker')
+        queue.fail(job, 'worker', 'first error')
+        self.assertEqual(queue.counts()['pending'], 1)
+
+        job = queue.claim('worker')
+        queue.fail(job, 'worker', 'second error')
+        self.assertIsNone(queue.claim('worker'))
+        self.assertTrue(queue.isFinished())
+        self.assertEqual(queue.failures(), [(self.paths('a')[0], 'second error')])
+        queue.close()
+
+    def runProcesses(self, count, leaseSeconds=workqueue.LEASE_SECONDS):
+
+        processes = [ multiprocessing.Process(target=runWorker, args=(self.queuePath, leaseSeconds))
+                      for i in range(count) ]
+        for process in processes:
+            process.start()
+        for process in processes:
+            process.join(60)
+            self.assertFalse(process.is_alive())
+
+    def checkStore(self, paths):
+
+        store = Store(self.storePath)
+        self.assertEqual(store.pages(), range(len(paths)))
+        self.assertEqual([ store.page(pageNum).source for pageNum in store.pages() ], paths)
+        store.close()
+
+    def testWorkersInSeveralProcesses(self):
+
+        paths = self.paths(*[ 'page%02i' %i for i in range(20) ])
+        queue = WorkQueue(self.queuePath)
+        queue.add(paths, self.storePath)
+        queue.close()
+
+        self.runProcesses(3)
+
+        queue = WorkQueue(self.queuePath)
+        self.assertEqual(queue.counts()['done'], 20)
+        queue.close()
+        self.checkStore(paths)
+
+    def testJobOfDeadWorkerIsFinished(self):
+
+        paths = self.paths('page0', 'page1', 'page2crash', 'page3', 'page4')
+        queue = WorkQueue(self.queuePath)
+        queue.add(paths, self.storePath)
+        queue.close()
+
+        self.runProcesses(2, leaseSeconds=0.5)
+
+        queue = WorkQueue(self.queuePath)
+        self.assertEqual(queue.counts()['done'], 5)
+        attempts = dict(queue.connection.execute('SELECT path, attempts FROM jobs').fetchall())
+        self.assertEqual(attempts[paths[2]], 2)
+        queue.close()
+        self.checkStore(paths)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -1,24 +1,35 @@
 import cv2
 import numpy
 import math
+from collections import deque
 
 import colors
 import geometry as g
-from box import Box
+from box import BoxArray
 from dimension import Dimension
+from parameters import Parameters
+from multiprocessing.pool import ThreadPool
 from scipy import spatial
 
 def threshold(image, threshold=colors.greyscale.MID_GREY, method=cv2.THRESH_BINARY_INV):
     retval, dst = cv2.threshold(image, threshold, colors.greyscale.WHITE, method)
     return dst
 
+def binarise(greyscaleImage):
+    # ink becomes white and paper black, as cv2.findContours expects.
+
+    image = threshold(greyscaleImage)
+    return threshold(image, cv2.THRESH_OTSU, method=cv2.THRESH_BINARY)
+
 class Character:
 
-    def __init__(self, x, y):
+    def __init__(self, x, y, contour=None):
 
         self.coordinate = [x, y]
         self.x = x
         self.y = y
+        self.contour = contour      # the outline of the glyph, in the format returned by cv2.findContours
+        self.isIllustration = False     # true for the characters standing in for illustrations (see addIllustrations)
 
         self.nearestNeighbours = []
         self.parentWord = None
@@ -61,80 +72,368 @@ class Character:
 
 class CharacterSet:
 
-    def __init__(self, sourceImage):
+    def __init__(self, sourceImage, axisAligned=False, threads=1, parameters=None, boxes=None, illustrations=None,
+                 denoise=False):
+        # boxes is the BoxArray of every contour on the page, if it has already been found (see findBoxes).
+        # This lets a parameter sweep trace the contours once and reuse them.
+        #
+        # illustrations is a list of (x, y, width, height) rectangles (see texture.py). They are blanked out
+        # before the contours are traced, so that the specks of ink in them never become characters, and
+        # each is then added back as one big character.
+        #
+        # With denoise, specks and scanning artefacts are dropped as soon as the contours are traced (see
+        # dropNoise), before anything is measured or built for them one by one.
 
-        self.characters = self.getCharacters(sourceImage)
-        self.NNTree = spatial.KDTree([char.toArray() for char in self.characters])
+        self.axisAligned = axisAligned      # true when the page has been deskewed, so boxes can skip minAreaRect.
+        self.threads = threads              # how many bands of the page to process at once.
+        self.parameters = parameters if parameters is not None else Parameters()
+        self.illustrations = illustrations if illustrations is not None else []
+        self.denoise = denoise
+        self.pageShape = sourceImage.shape[:2]      # bands are cut from the page, but edges are the page's
 
-    def getCharacters(self, sourceImage):
+        if len(self.illustrations) > 0 and boxes is None:
+            sourceImage = self.maskIllustrations(sourceImage)
 
-        characters = []
+        if boxes is None and threads <= 1:
+            boxes = self.findBoxes(sourceImage)
+        self.boxes = boxes      # every contour on the page, before filtering (None if it was split into bands)
 
-        image = sourceImage.copy()
-        image = threshold(image)
-        image = threshold(image, cv2.THRESH_OTSU, method=cv2.THRESH_BINARY)
+        if boxes is not None:
+            self.characters = self.selectCharacters(boxes)
+        else:
+            self.characters = self.getCharactersInBands(sourceImage)
+
+        if len(self.illustrations) > 0:
+            self.characters = self.addIllustrations(self.characters)
+
+        self.NNTree = None      # built by getWords, unless the characters are searched in groups
+        self.maxDistance = None     # the furthest apart two neighbouring characters can be, set by getWords
+
+    def getCharacters(self, sourceImage, offset=(0, 0)):
+
+        return self.selectCharacters(self.findBoxes(sourceImage, offset))
+
+    def findBoxes(self, sourceImage, offset=(0, 0)):
+        # measures every top-level contour in the image in one go.
+
+        image = binarise(sourceImage)
 
         if False:
             self.display(image)
 
-        for contour in self.getContours(image):
-            try:
-                box = Box(contour)
-
-                moments = cv2.moments(contour)
-                centroidX = int( moments['m10'] / moments['m00'] )
-                centroidY = int( moments['m01'] / moments['m00'] )
-                character = Character(centroidX, centroidY)
-                
-            except ZeroDivisionError:
-                continue
-                
-            if box.area > 50:
-                characters.append(character)
+        contours = self.getContours(image, offset=offset)
+        if self.denoise:
+            contours = self.dropNoise(contours)
+
+        return BoxArray(contours, self.axisAligned)
+
+    def dropNoise(self, contours):
+        # Drops the contours which can't be characters, using only their bounding boxes (which are found for
+        # all of them at once): specks whose box is no bigger than a character's minimum area (a contour's
+        # minAreaRect is never bigger than its bounding box, so none of these would have been kept anyway),
+        # and anything within edgeCloseness of the edge of the page, where scanning leaves dark strips and
+        # the shadows of the binding. On old, foxed paper most of the contours are noise.
+
+        points, starts = BoxArray.flatten(contours)
+        bounds = BoxArray.getBounds(points, starts)
+
+        isSpeck = bounds[:,2] * bounds[:,3] <= self.parameters.minCharacterArea
+        isEdge = BoxArray.boundsTouchingEdge(bounds, self.pageShape, self.parameters.edgeCloseness)
+
+        return [ contour for contour, isNoise in zip(contours, isSpeck | isEdge) if not isNoise ]
+
+    def selectCharacters(self, boxes):
+        # keeps the contours with a center of mass and a reasonable size.
+
+        characters = []
+        boxes = boxes.select((boxes.m00 > 0) & (boxes.area > self.parameters.minCharacterArea))
+
+        for (centroidX, centroidY), contour in zip(boxes.centroids.astype(int), boxes.contours):
+            characters.append(Character(int(centroidX), int(centroidY), contour))
 
         return characters
 
-    def getContours(self, sourceImage, threshold=-1):
+    def maskIllustrations(self, sourceImage):
+        # a copy of the image with every illustration painted over in the paper's colour.
 
         image = sourceImage.copy()
-        blobs = []
-        topLevelContours = []
-
-        contours, hierarchy = cv2.findContours(image, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE)
+        for x, y, width, height in self.illustrations:
+            image[y:y+height, x:x+width] = colors.greyscale.WHITE
+        return image
 
-        for i in range(len(hierarchy[0])):
+    def addIllustrations(self, characters, illustrations=None, reach=None):
+        # Adds one character per illustration (by default, self.illustrations). Any character within `reach`
+        # pixels of an illustration is taken to be part of it. By default that is a cell and a half of the
+        # texture grid, which the illustrations were found on, so that the rigging sticking out past a ship's
+        # hull is caught, say, or the waves drawn under it. Those are taken out, and their outlines joined to
+        # the illustration's.
+
+        bounds = BoxArray([ character.contour for character in characters ], axisAligned=True).bounds.reshape(-1, 4)
+        if reach is None:
+            reach = 1.5 * self.parameters.textureCellSize
+        left, top = bounds[:,0] - reach, bounds[:,1] - reach
+        right, bottom = bounds[:,0] + bounds[:,2] + reach, bounds[:,1] + bounds[:,3] + reach
+
+        isPart = numpy.zeros(len(characters), bool)
+        added = []
+        for x, y, width, height in (illustrations if illustrations is not None else self.illustrations):
+            isTouching = (left <= x + width) & (right >= x) & (top <= y + height) & (bottom >= y) & ~isPart
+            isPart |= isTouching
+
+            corners = numpy.array([ [[x, y]], [[x + width, y]], [[x + width, y + height]], [[x, y + height]] ],
+                                  numpy.int32)
+            contour = numpy.vstack([corners] + [ characters[i].contour for i in numpy.flatnonzero(isTouching) ])
+            centerX, centerY = contour.reshape(-1, 2).min(axis=0) + numpy.ptp(contour.reshape(-1, 2), axis=0) // 2
+            illustration = Character(int(centerX), int(centerY), contour)
+            illustration.isIllustration = True
+            added.append(illustration)
+
+        return [ character for character, part in zip(characters, isPart) if not part ] + added
+
+    def reanalyseRegion(self, sourceImage, region, figure=False):
+        # Finds the characters in one (x, y, width, height) region of the page again, e.g. after an operator
+        # has corrected it (see Page.reanalyse). With figure, everything in the region becomes one figure,
+        # as with addIllustrations, but without reaching past the region: the operator has drawn it exactly,
+        # and the caption beneath is text. Otherwise the region is traced again, without masking out
+        # illustrations.
+        # Returns the characters which were taken out and those which were added.
+
+        bounds = self.characterBounds()
+
+        if figure:
+            remaining = self.addIllustrations(self.characters, [region], reach=0)
+            kept = set( id(character) for character in remaining )
+            removed = [ character for character in self.characters if id(character) not in kept ]
+            added = remaining[-1:]
+        else:
+            # grow the region until no character sticks out of it, so that every glyph is traced whole.
+            left, top, right, bottom = region[0], region[1], region[0] + region[2], region[1] + region[3]
+            while True:
+                isInside = (bounds[:,0] <= right) & (bounds[:,0] + bounds[:,2] >= left) & \
+                           (bounds[:,1] <= bottom) & (bounds[:,1] + bounds[:,3] >= top)
+                if not numpy.any(isInside):
+                    break
+                newLeft = min(left, bounds[isInside,0].min())
+                newTop = min(top, bounds[isInside,1].min())
+                newRight = max(right, (bounds[isInside,0] + bounds[isInside,2]).max())
+                newBottom = max(bottom, (bounds[isInside,1] + bounds[isInside,3]).max())
+                if (newLeft, newTop, newRight, newBottom) == (left, top, right, bottom):
+                    break
+                left, top, right, bottom = newLeft, newTop, newRight, newBottom
+
+            height, width = sourceImage.shape[:2]
+            left, top = max(int(left), 0), max(int(top), 0)
+            right, bottom = min(int(right) + 1, width), min(int(bottom) + 1, height)
+
+            removed = [ character for character, inside in zip(self.characters, isInside) if inside ]
+            added = self.getCharacters(sourceImage[top:bottom, left:right], (left, top))
+            remaining = [ character for character, inside in zip(self.characters, isInside) if not inside ] + added
+
+        self.characters = remaining
+        self.NNTree = None      # the characters have changed
+        return removed, added
+
+    def characterBounds(self):
+        # the (x, y, width, height) box around each character.
+        contours = [ character.contour for character in self.characters ]
+        return BoxArray(contours, axisAligned=True).bounds.reshape(-1, 4)
+
+    def getCharactersInBands(self, sourceImage):
+        # Splits the page into horizontal bands and finds the characters in each band on a separate thread
+        # (OpenCV releases the GIL while it thresholds and traces contours). Each band is traced along with
+        # bandOverlap rows either side of it, so that a glyph across a cut is traced whole by both bands,
+        # and mergeBands keeps one copy of it. The characters are the same as tracing the page in one go.
+
+        height = sourceImage.shape[0]
+        overlap = int(math.ceil(self.parameters.bandOverlap))
+        bands = self.getBands(sourceImage, self.threads)
+        tracedBands = [ (max(top - overlap, 0), min(bottom + overlap, height)) for top, bottom in bands ]
+
+        pool = ThreadPool(self.threads)
+        try:
+            # a strip one pixel wide is only two points, but may be part of something wider outside the band.
+            traced = pool.map(lambda (top, bottom): self.getContours(binarise(sourceImage[top:bottom]),
+                                                                     offset=(0, top), minPoints=0), tracedBands)
+            merged = self.mergeBands(sourceImage, bands, tracedBands, traced)
+            if self.denoise:
+                merged = pool.map(self.dropNoise, merged)
+            results = pool.map(lambda contours: self.selectCharacters(BoxArray(contours, self.axisAligned)), merged)
+        finally:
+            pool.close()
+
+        return [ character for band in results for character in band ]
+
+    def mergeBands(self, sourceImage, bands, tracedBands, traced):
+        # Picks one copy of each contour out of the overlapping bands, returning a list of contours for each
+        # band. A contour belongs to the band that its top row is in. It's only kept if it's a root (see
+        # getContours) in every band which traced it whole, since a band which traced just part of an
+        # outline around it can't tell that it's inside one.
+        #
+        # Anything which goes on past the rows its band traced (a tall figure, or a strip down the edge of
+        # the page) is traced again by itself (see traceWhole), and whatever lies within its bounds is only
+        # kept if it's a root there too.
+        #
+        # (cv2.findContours may clear the outermost pixels of the image it's given, so a contour counts as
+        # cut off if it comes within a pixel of a band's edge.)
+
+        height = sourceImage.shape[0]
+        isWhole = lambda top, bottom, tracedTop, tracedBottom: ((tracedTop == 0) | (top > tracedTop + 1)) & \
+                                                               ((tracedBottom == height) | (bottom < tracedBottom - 1))
+
+        bandBounds = []
+        bandKeys = []
+        for contours in traced:
+            points, starts = BoxArray.flatten(contours)
+            bandBounds.append(BoxArray.getBounds(points, starts))
+            bandKeys.append(set( contour.tostring() for contour in contours ))
+
+        candidates = []     # (band, contour, (x, y, width, height))
+        wholes = {}         # the roots traced again around each cut off contour, by its key
+        for i, (contours, bounds) in enumerate(zip(traced, bandBounds)):
+            top, bottom = bounds[:,1], bounds[:,1] + bounds[:,3]
+            isOwn = (top >= bands[i][0]) & (top < bands[i][1])
+            isCutOff = ~isWhole(top, bottom, *tracedBands[i])
+
+            for j in numpy.flatnonzero(isOwn):
+                if not isCutOff[j]:
+                    candidates.append((i, contours[j], tuple(bounds[j])))
+                    continue
+                whole = self.traceWhole(sourceImage, contours[j], bounds[j])
+                if whole is not None and whole[0].tostring() not in wholes:
+                    wholes[whole[0].tostring()] = whole
+                    points, starts = BoxArray.flatten([whole[0]])
+                    candidates.append((i, whole[0], tuple(BoxArray.getBounds(points, starts)[0])))
+
+        merged = [ [] for band in bands ]
+        for i, contour, (x, y, boxWidth, boxHeight) in candidates:
+            key = contour.tostring()
+            if not all( key in bandKeys[k] for k in range(len(traced))
+                        if k != i and isWhole(y, y + boxHeight, *tracedBands[k]) ):
+                continue
+            if not all( key in roots for other, roots, (left, top, right, bottom) in wholes.values()
+                        if left <= x and top <= y and x + boxWidth <= right and y + boxHeight <= bottom ):
+                continue
+            if len(contour) > 2:
+                merged[i].append(contour)
+
+        return merged
+
+    def traceWhole(self, sourceImage, contour, bounds):
+        # Traces the whole of something that was cut off at the edge of a band, in a rectangle around it
+        # which is grown until nothing is cut off. Returns its contour, the keys (contour.tostring()) of the
+        # roots in the rectangle, and the rectangle's (left, top, right, bottom) edges; or None if it turns
+        # out to lie inside something else.
+
+        height, width = sourceImage.shape[:2]
+        grow = int(math.ceil(self.parameters.bandOverlap))
+        firstPoint = tuple(float(value) for value in contour.reshape(-1, 2)[0])
+        x, y, boundsWidth, boundsHeight = bounds
+        left, top = max(x - 2, 0), max(y - grow, 0)
+        right, bottom = min(x + boundsWidth + 2, width), min(y + boundsHeight + grow, height)
+
+        while True:
+            image = binarise(sourceImage[top:bottom, left:right])
+            contours, hierarchy = cv2.findContours(image, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE, offset=(left, top))
+            parents = hierarchy[0][:,3]
+
+            # the outline of the glyph that the point is on: it's inside the outline, but not inside any of
+            # the outline's holes. Outlines and holes take turns going down the hierarchy.
+            depths = numpy.zeros(len(contours), int)
+            for i in range(len(contours)):
+                parent = parents[i]
+                while parent >= 0:
+                    depths[i] += 1
+                    parent = parents[parent]
+            whole = None
+            for i in numpy.flatnonzero(depths % 2 == 0):
+                if cv2.pointPolygonTest(contours[i], firstPoint, False) >= 0 and \
+                        not any( cv2.pointPolygonTest(contours[hole], firstPoint, False) > 0
+                                 for hole in numpy.flatnonzero(parents == i) ):
+                    whole = i
+                    break
+            if whole is None or parents[whole] >= 0:
+                return None
+            whole = contours[whole]
+
+            wholeLeft, wholeTop, wholeWidth, wholeHeight = cv2.boundingRect(whole)
+            wholeRight, wholeBottom = wholeLeft + wholeWidth, wholeTop + wholeHeight
+            isCutOff = [left > 0 and wholeLeft <= left + 1, top > 0 and wholeTop <= top + 1,
+                        right < width and wholeRight >= right - 1, bottom < height and wholeBottom >= bottom - 1]
+            if not any(isCutOff):
+                roots = [ contour for contour, parent in zip(contours, parents) if parent < 0 ]
+                return whole, set( root.tostring() for root in roots ), (left, top, right, bottom)
+
+            left = max(wholeLeft - grow, 0) if isCutOff[0] else left
+            top = max(wholeTop - grow, 0) if isCutOff[1] else top
+            right = min(wholeRight + grow, width) if isCutOff[2] else right
+            bottom = min(wholeBottom + grow, height) if isCutOff[3] else bottom
+
+    def getBands(self, sourceImage, count):
+        # Returns (top, bottom) row ranges which split the image into roughly `count` equal bands. Each cut
+        # is made at the row with the least ink within a quarter of a band of where an even split would put
+        # it, nearest to the even split if there are several. The edgeCloseness columns down either side are
+        # left out of the count, as a dark strip there would otherwise cover every row. The fewer glyphs
+        # cross a cut, the less mergeBands has to sort out.
+
+        height, width = sourceImage.shape[:2]
+        margin = min(int(self.parameters.edgeCloseness), (width - 1) // 2)
+        ink = (sourceImage[:, margin:width - margin] <= colors.greyscale.MID_GREY).sum(axis=1)
+
+        cuts = [0]
+        reach = max(height // (4 * count), 1)
+        for target in numpy.arange(1, count) * height // count:
+            rows = numpy.arange(max(target - reach, 0), min(target + reach + 1, height))
+            best = rows[numpy.lexsort((numpy.abs(rows - target), ink[rows]))[0]]
+            if cuts[-1] < best < height:
+                cuts.append(int(best))
+        cuts.append(height)
+
+        return zip(cuts[:-1], cuts[1:])
+
+    def getContours(self, sourceImage, threshold=-1, offset=(0, 0), minPoints=3):
 
-            if len(contours[i]) > 2:    # 1- and 2-point contours have a divide-by-zero error in calculating the center of mass.
+        image = sourceImage.copy()
 
-                # bind each contour with its corresponding hierarchy context description.
-                obj = {'contour': contours[i], 'context': hierarchy[0][i]}
-                blobs.append(obj)
+        contours, hierarchy = cv2.findContours(image, cv2.RETR_TREE, cv2.CHAIN_APPROX_SIMPLE, offset=offset)
+        if hierarchy is None:   # a blank image
+            return []
 
-        for blob in blobs:
-            parent = blob['context'][3]
-            if parent <= threshold: # no parent, therefore a root
-                topLevelContours.append(blob['contour'])
+        # Keep the roots (contours with no parent), going by the hierarchy table as a whole rather than one
+        # contour at a time. 1- and 2-point contours have a divide-by-zero error in calculating the center of
+        # mass, so they're left out, unless minPoints says otherwise.
+        lengths = numpy.array(map(len, contours))
+        isRoot = (hierarchy[0][:,3] <= threshold) & (lengths >= minPoints)
 
-        return topLevelContours
+        return [ contours[i] for i in numpy.flatnonzero(isRoot) ]
 
-    def getWords(self):
+    def getWords(self, groups=None):
+        # groups optionally splits the characters into independent sets of indices (such as the blocks found
+        # by layout.xyCut), and then a character's neighbours are only looked for within its own set.
 
         words = []
-        
-        # find the average distance between nearest neighbours
-        NNDistances = []
-        for character in self.characters:
-            result = self.NNTree.query(character.toArray(), k=2)  # we only want nearest neighbour, but the first result will be the point matching itself.
-            nearestNeighbourDistance = result[0][1]
-            NNDistances.append(nearestNeighbourDistance)
-        avgNNDistance = sum(NNDistances)/len(NNDistances)
-
-        maxDistance = avgNNDistance*2
-        k = 2
-        for character in self.characters:
-            queryResult = self.NNTree.query(character.coordinate, k=k)
-            distances = queryResult[0]
-            neighbours = queryResult[1]
+        if len(self.characters) == 0:
+            self.maxDistance = 0.0
+            return words
+
+        # Query every character at once. We only want the nearest neighbour, but the first result will be the
+        # point matching itself. The query is spread over our threads, since cKDTree releases the GIL.
+        k = self.parameters.neighbourCount
+        if groups is None:
+            coordinates = [ character.toArray() for character in self.characters ]
+            self.NNTree = spatial.cKDTree(coordinates)
+            allDistances, allNeighbours = self.NNTree.query(coordinates, k=k, n_jobs=self.threads)
+        else:
+            allDistances, allNeighbours = self.queryGroups(groups, k)
+
+        # Find the average distance between nearest neighbours (a character alone in its group has none). If
+        # no character has a neighbour, each one is a word of its own.
+        NNDistances = allDistances[:,1]
+        NNDistances = NNDistances[numpy.isfinite(NNDistances)]
+        avgNNDistance = sum(NNDistances)/len(NNDistances) if len(NNDistances) > 0 else 0.0
+
+        maxDistance = avgNNDistance*self.parameters.neighbourDistanceFactor
+        self.maxDistance = maxDistance      # kept for regroupWords
+        for character, distances, neighbours in zip(self.characters, allDistances, allNeighbours):
             for i in range(1,k):
                 if distances[i] < maxDistance:
                     neighbour = self.characters[neighbours[i]]
@@ -145,9 +444,112 @@ class CharacterSet:
                 if len(character.nearestNeighbours) >= 0:
                     word = Word([character])
                     words.append(word)
-                    
+
+        self.measureWords(words)
+
         return words
 
+    def regroupWords(self, words, removed, added):
+        # Brings the words up to date after some characters have been removed and others added (see
+        # reanalyseRegion), without grouping the whole page again. Only the characters near the change are
+        # looked at: the added ones, the characters within reach of them, and the rest of any word those (or
+        # the removed characters) belonged to. Their neighbours are found in a tree of every character, and
+        # they're grouped into words as getWords would. Returns the words which are gone and the new ones.
+
+        k = self.parameters.neighbourCount
+        coordinates = numpy.array([ character.toArray() for character in self.characters ], numpy.float64)
+        self.NNTree = spatial.cKDTree(coordinates.reshape(-1, 2))
+        index = dict( (id(character), i) for i, character in enumerate(self.characters) )
+
+        nearby = set()
+        if len(added) > 0:
+            for found in self.NNTree.query_ball_point([ character.toArray() for character in added ], self.maxDistance):
+                nearby.update(found)
+        nearby.update( index[id(character)] for character in added )
+
+        oldWords = dict( (id(character.parentWord), character.parentWord) for character in removed
+                         if character.parentWord is not None )
+
+        # keep taking in whole words until every character being regrouped links only to others which are.
+        while True:
+            for i in list(nearby):
+                word = self.characters[i].parentWord
+                if word is not None and id(word) not in oldWords:
+                    oldWords[id(word)] = word
+            for word in oldWords.values():
+                nearby.update( index[id(character)] for character in word.characters if id(character) in index )
+
+            regrouped = sorted(nearby)
+            distances, neighbours = self.NNTree.query(coordinates[regrouped], k=k)
+            distances, neighbours = distances.reshape(len(regrouped), k), neighbours.reshape(len(regrouped), k)
+
+            isLinked = distances[:,1:] < self.maxDistance
+            outside = set(neighbours[:,1:][isLinked].tolist()) - nearby
+            if len(outside) == 0:
+                break
+            nearby.update(outside)
+
+        for i in regrouped:
+            self.characters[i].nearestNeighbours = []
+            self.characters[i].parentWord = None
+
+        for i, rowDistances, rowNeighbours in zip(regrouped, distances, neighbours):
+            for j in range(1, k):
+                if rowDistances[j] < self.maxDistance:
+                    self.characters[i].nearestNeighbours.append(self.characters[rowNeighbours[j]])
+
+        newWords = []
+        for i in regrouped:
+            if self.characters[i].parentWord is None:
+                newWords.append(Word([self.characters[i]]))
+
+        self.measureWords(newWords)
+
+        return oldWords.values(), newWords
+
+    def queryGroups(self, groups, k):
+        # Finds the k nearest neighbours of every character within its own group, with one small tree per
+        # group. The groups are independent, so they are spread over our threads. Missing neighbours (in
+        # groups with fewer than k characters) have an infinite distance, as cKDTree.query would give.
+
+        coordinates = numpy.array([ character.toArray() for character in self.characters ], numpy.float64)
+        coordinates = coordinates.reshape(-1, 2)
+
+        def query(group):
+            distances, neighbours = spatial.cKDTree(coordinates[group]).query(coordinates[group], k=k)
+            isFound = neighbours < len(group)
+            return distances, numpy.where(isFound, group[numpy.minimum(neighbours, len(group)-1)], -1)
+
+        groups = [ numpy.asarray(group, numpy.int64) for group in groups if len(group) > 0 ]
+        if self.threads > 1:
+            pool = ThreadPool(self.threads)
+            try:
+                results = pool.map(query, groups)
+            finally:
+                pool.close()
+        else:
+            results = map(query, groups)
+
+        allDistances = numpy.full((len(coordinates), k), numpy.inf)
+        allNeighbours = numpy.full((len(coordinates), k), -1, numpy.int64)
+        for group, (distances, neighbours) in zip(groups, results):
+            allDistances[group] = distances
+            allNeighbours[group] = neighbours
+
+        return allDistances, allNeighbours
+
+    def measureWords(self, words):
+        # Now that every word has all of its characters, work out each word's outline and box. The boxes
+        # are all measured at once.
+
+        contours = [ numpy.vstack([ char.contour for char in word.characters ]) for word in words ]
+        boxes = BoxArray(contours, self.axisAligned)
+
+        for i, word in enumerate(words):
+            word.contour = contours[i]
+            word.box = boxes[i]
+            word.center = tuple(numpy.mean([ char.coordinate for char in word.characters ], axis=0))
+
     def paint(self, image, color=colors.BLUE):
 
         for character in self.characters:
@@ -161,6 +563,10 @@ class Word:
         
         self.characters = set(characters)
 
+        self.contour = None     # these are filled in by CharacterSet.measureWords once the word is complete.
+        self.box = None
+        self.center = None
+
         for character in characters:
             character.assignParentWord(self)
 
@@ -180,3 +586,174 @@ class Word:
         return image
         
 
+
+
+def getLines(words, axisAligned=False, angle=None):
+    # Groups words into text lines, working on a table of word measurements rather than on the words
+    # themselves. Everything here is linear in the number of words, apart from the sorts done in numpy.
+    #
+    #  1. Find the angle of the text (zero if the page has been deskewed), and rotate the word boxes so
+    #     that the lines run horizontally.
+    #  2. Build a projection profile from the middle half of each word's height. Descenders and ascenders
+    #     are left out, so there is a gap in the profile between every pair of lines.
+    #  3. Each run of non-empty rows is a line. Each word belongs to the run that its center falls in.
+    #  4. Order the words by line and then from left to right, and fit a box to each line in one go.
+
+    lines = LineCollection()
+    if len(words) == 0:
+        return lines
+
+    centers = numpy.array([ word.center for word in words ], numpy.float64)
+    corners = numpy.array([ word.box.points for word in words ], numpy.float64).reshape(-1, 4, 2)
+
+    # the angle can be given, e.g. when the words are one block of a page whose angle is already known.
+    if axisAligned:
+        angle = 0.0
+    elif angle is None:
+        angle = g.dominantAngle(centers, binSize=2.0)
+
+    radians = math.radians(angle)
+    sin, cos = math.sin(radians), math.cos(radians)
+    rotatedCenterX = centers[:,0]*cos + centers[:,1]*sin
+    rotatedCenterY = -centers[:,0]*sin + centers[:,1]*cos
+    rotatedCornerY = -corners[:,:,0]*sin + corners[:,:,1]*cos
+
+    # the middle half of each word, in rows relative to the top of the profile
+    origin = numpy.floor(min(rotatedCornerY.min(), rotatedCenterY.min()))
+    centerRow = numpy.around(rotatedCenterY - origin).astype(numpy.int64)
+    heights = rotatedCornerY.max(axis=1) - rotatedCornerY.min(axis=1)
+    coreTop = numpy.minimum(numpy.around(rotatedCenterY - heights/4 - origin).astype(numpy.int64), centerRow)
+    coreBottom = numpy.maximum(numpy.around(rotatedCenterY + heights/4 - origin).astype(numpy.int64), centerRow)
+
+    # Anything much taller than a word (figures, rules running down the page edge) would join up every line
+    # it spans, so those are left out of the profile and given a line of their own.
+    isTall = heights > 3 * numpy.median(heights)
+
+    numRows = int(coreBottom.max()) + 2
+    profile = numpy.zeros(numRows, numpy.int64)
+    numpy.add.at(profile, coreTop[~isTall], 1)
+    numpy.add.at(profile, coreBottom[~isTall]+1, -1)
+    isInk = numpy.cumsum(profile) > 0
+
+    # number the runs of non-empty rows, then look up the run for each word's center. Tall words are slotted
+    # in just after the run that their center is in (or follows).
+    runStarts = isInk & ~numpy.concatenate([[False], isInk[:-1]])
+    rowLabels = numpy.cumsum(runStarts).astype(numpy.float64)
+    labels = rowLabels[centerRow]
+    numTall = numpy.count_nonzero(isTall)
+    labels[isTall] += 0.5 + numpy.arange(numTall) / (2.0 * numTall + 2)
+
+    order = numpy.lexsort((rotatedCenterX, labels))
+    boundaries = numpy.flatnonzero(numpy.diff(labels[order])) + 1
+    groups = numpy.split(order, boundaries)
+
+    lineWords = [ [ words[i] for i in group ] for group in groups ]
+    contours = [ numpy.vstack([ word.contour for word in lineWordList ]) for lineWordList in lineWords ]
+    boxes = BoxArray(contours, axisAligned)
+
+    # Fit a baseline to every line at once, through the middle of the bottom edge of each word. Descenders
+    # sit below the baseline, so use a robust fit.
+    bottomCorners = numpy.argsort(rotatedCornerY, axis=1)[:,2:]
+    rows = numpy.arange(len(words))[:,numpy.newaxis]
+    bottoms = corners[rows, bottomCorners].mean(axis=1)
+    offsets = numpy.concatenate([[0], numpy.cumsum([ len(group) for group in groups ])])
+    baselines = g.fitLines(bottoms[order], offsets, robust='huber')
+
+    for i, lineWordList in enumerate(lineWords):
+        lines.append(Line(lineWordList, boxes[i], baselines.angles[i]))
+
+    return lines
+
+class Line:
+
+    def __init__(self, words, box, baselineAngle=None):
+
+        self.words = words      # ordered from left to right
+        self.box = box
+        self.baselineAngle = baselineAngle      # in degrees, if a baseline has been fitted
+
+        # these describe the line's role on the page, and are filled in once the margin is known.
+        self.isFigure = False
+        self.isCentered = False
+        self.isParagraphStart = False
+        self.isParagraphEnd = False
+        self.isHorizontalRule = False
+
+    @property
+    def contour(self):
+        return numpy.vstack([ word.contour for word in self.words ])
+
+    @property
+    def hasIllustration(self):
+        # true if the line holds an illustration, which makes it a figure however short it is.
+        return any(character.isIllustration for word in self.words for character in word.characters)
+
+    def paint(self, image, color=colors.GREEN, box=False, centerLine=False):
+
+        if box:
+            image = self.box.paint(image, color)
+
+        if centerLine:
+            line = g.Line([self.box.center.left, self.box.center.right])
+            image = line.paint(image, color)
+
+        if not (box or centerLine):
+            for word in self.words:
+                image = word.paint(image, color)
+
+        return image
+
+class LineCollection:
+    # An ordered queue of text lines, from the top of the page to the bottom. The content stage consumes
+    # lines from the front with pull(), so this is backed by a deque.
+
+    def __init__(self, lines=[]):
+
+        self.lines = deque(lines)
+
+    def append(self, line):
+        self.lines.append(line)
+
+    def pull(self):
+        # removes and returns the first line. Raises IndexError if there are no lines left.
+        return self.lines.popleft()
+
+    def peekStart(self):
+        # returns the first line without removing it. Raises IndexError if there are no lines left.
+        return self.lines[0]
+
+    def copy(self):
+        return LineCollection(self.lines)
+
+    @property
+    def avgAngle(self):
+        # Baselines through a few words give a steadier angle than the box around a line, so use those
+        # where we have them.
+
+        if len(self.lines) == 0:
+            return g.Angle(degrees=0)
+
+        angles = []
+        for line in self.lines:
+            if line.baselineAngle is not None and len(line.words) >= 3:
+                angles.append(g.Angle(degrees=line.baselineAngle))
+            else:
+                angles.append(g.Angle(degrees=line.box.angle))
+
+        return g.Angle.average(angles)
+
+    def __getitem__(self, key):
+        return self.lines.__getitem__(key)
+
+    def __len__(self):
+        return self.lines.__len__()
+
+    def __iter__(self):
+        return self.lines.__iter__()
+
+    def paint(self, image, color=colors.GREEN):
+
+        for line in self.lines:
+            image = line.paint(image, color, box=True)
+
+        return image
@@ -0,0 +1,126 @@
+import cv2
+import numpy
+from scipy import ndimage
+
+# Finds the illustrations on a page (engravings, maps, halftones) from the texture of the ink, before any
+# contours are traced. The page is cut into a grid of square cells and each cell is measured:
+#
+#  - how many separate specks of ink start in it. Text has a few glyphs per cell; hatching and halftone
+#    dots have dozens.
+#  - how much of it is ink, and how much the grey levels vary. Solid shading is dense but, unlike a dark
+#    scanning strip, still varies.
+#
+# Textured cells are joined up into regions, and regions of only a few cells are dropped. This is all done
+# with whole-image numpy operations, so it costs about as much as thresholding the page again.
+#
+# isBlank uses the same kind of measurements, on a shrunken copy of the page, to spot pages with nothing on
+# them before any work is done on them at all.
+
+DENSE_INK = 0.4         # cells with more ink than this (as a fraction) are shading,
+MIN_VARIANCE = 1000     # as long as their grey levels vary by at least this much
+BLANK_CONTRAST = 60     # pixels this much darker than the paper are ink, when checking for blank pages
+
+def cellStats(binary, greyscale, cellSize):
+    # Returns (components, density, variance) arrays with one entry per cell. A component is counted where
+    # an ink pixel has no ink above it or to its left, which is close enough to a count of specks for
+    # telling text from texture. Partial cells along the right and bottom edges are left out.
+
+    rows, columns = binary.shape[0] // cellSize, binary.shape[1] // cellSize
+    height, width = rows * cellSize, columns * cellSize
+
+    isInk = binary[:height, :width] > 0
+    isStart = isInk.copy()
+    isStart[1:] &= ~isInk[:-1]
+    isStart[:,1:] &= ~isInk[:,:-1]
+
+    cells = lambda image: image.reshape(rows, cellSize, columns, cellSize)
+    components = cells(isStart).sum(axis=(1, 3))
+    density = cells(isInk).mean(axis=(1, 3))
+    variance = cells(greyscale[:height, :width].astype(numpy.float32)).var(axis=(1, 3))
+
+    return components, density, variance
+
+def findIllustrations(binary, greyscale, cellSize=32, minComponents=40, minCells=4):
+    # binary is the thresholded page (ink is white), as from text.binarise. Returns an (x, y, width, height)
+    # rectangle around each illustration, in pixels.
+
+    cellSize = max(int(round(cellSize)), 1)
+    components, density, variance = cellStats(binary, greyscale, cellSize)
+
+    isTextured = (components >= minComponents) | ((density > DENSE_INK) & (variance > MIN_VARIANCE))
+    isTextured = ndimage.binary_closing(isTextured, numpy.ones((3, 3), bool))
+
+    labels, count = ndimage.label(isTextured, numpy.ones((3, 3), bool))
+    if count == 0:
+        return []
+
+    sizes = ndimage.sum(isTextured, labels, range(1, count+1))
+    rectangles = [ (cell[1].start, cell[0].start, cell[1].stop - cell[1].start, cell[0].stop - cell[0].start)
+                   for cell, size in zip(ndimage.find_objects(labels), sizes) if size >= minCells ]
+
+    # The ink of an illustration's densest cells runs on into the cells around them, so each rectangle is
+    # padded by half a cell. That also joins up the parts of an illustration that are only a cell apart.
+    padding = cellSize // 2
+    padded = [ (x * cellSize - padding, y * cellSize - padding, width * cellSize + 2*padding,
+                height * cellSize + 2*padding) for x, y, width, height in rectangles ]
+
+    pageHeight, pageWidth = binary.shape[:2]
+    illustrations = []
+    for x, y, width, height in mergeOverlapping(padded):
+        left, top = max(x, 0), max(y, 0)
+        right, bottom = min(x + width, pageWidth), min(y + height, pageHeight)
+        illustrations.append((left, top, right - left, bottom - top))
+
+    return illustrations
+
+def mergeOverlapping(rectangles):
+    # Joins any (x, y, width, height) rectangles that overlap into the rectangle around both, until none
+    # overlap. The parts of one illustration are often only joined diagonally, or not at all.
+
+    rectangles = list(rectangles)
+    merged = True
+    while merged:
+        merged = False
+        for i in range(len(rectangles)):
+            for j in range(i+1, len(rectangles)):
+                if overlaps(rectangles[i], rectangles[j]):
+                    rectangles[i] = union(rectangles[i], rectangles.pop(j))
+                    merged = True
+                    break
+            if merged:
+                break
+
+    return rectangles
+
+def overlaps(first, second):
+    return first[0] < second[0] + second[2] and second[0] < first[0] + first[2] and \
+           first[1] < second[1] + second[3] and second[1] < first[1] + first[3]
+
+def union(first, second):
+    left, top = min(first[0], second[0]), min(first[1], second[1])
+    right = max(first[0] + first[2], second[0] + second[2])
+    bottom = max(first[1] + first[3], second[1] + second[3])
+    return (left, top, right - left, bottom - top)
+
+def isBlank(greyscale, sampleSize=4, edgeCloseness=50, maxInk=0.001, maxComponents=50):
+    # True if a page has next to no ink on it: a blank verso, an endpaper, the back of a plate. Faint
+    # show-through from the other side isn't dark enough to count, and neither are specks of dust, as long
+    # as there aren't too many. The page is shrunk by sampleSize first and the strips along its edges (where
+    # scanning leaves dark bands) are left out, so this costs next to nothing next to finding characters.
+
+    sampleSize = max(int(round(sampleSize)), 1)
+    # cut to a whole number of samples first, which INTER_AREA shrinks many times faster.
+    rows, columns = max(greyscale.shape[0] // sampleSize, 1), max(greyscale.shape[1] // sampleSize, 1)
+    small = cv2.resize(greyscale[:rows*sampleSize, :columns*sampleSize], (columns, rows),
+                       interpolation=cv2.INTER_AREA)
+
+    edge = int(round(edgeCloseness / sampleSize))
+    if small.shape[0] > 2*edge and small.shape[1] > 2*edge:
+        small = small[edge:small.shape[0]-edge, edge:small.shape[1]-edge]
+
+    isInk = small < numpy.median(small) - BLANK_CONTRAST
+    if isInk.mean() >= maxInk:
+        return False
+
+    labels, count = ndimage.label(isInk)
+    return count < maxComponents
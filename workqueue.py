@@ -0,0 +1,315 @@
+#!/usr/bin/python
+
+import os
+import sys
+import time
+import socket
+import sqlite3
+import threading
+import traceback
+import multiprocessing
+
+import page as pageModule
+import pipeline
+import sources
+from page import Page
+from store import Store
+
+# A queue of page jobs for spreading a batch over any number of worker processes, on one machine or on
+# several machines that share a filesystem. There is no server: the queue is a SQLite database with one row
+# per page, and workers claim jobs from it inside a transaction, so no two workers can claim the same job.
+#
+# A claim is a lease, which the worker keeps renewing for as long as it's working on the page. If a worker
+# dies (or its machine does), its lease runs out and the job goes back to the other workers. A job that
+# keeps failing is given up on after MAX_ATTEMPTS tries. Results go into a Store (see store.py), which any
+# number of processes can append to; if a job does end up being run twice, the later copy of the page
+# simply replaces the earlier one.
+#
+#   workqueue.py add [queue file] [image folder] [store folder]
+#   workqueue.py work [queue file] [number of processes]
+#   workqueue.py status [queue file]
+#
+# SQLite relies on the filesystem's locks, so a shared filesystem needs working locks (NFS with lockd, SMB).
+
+LEASE_SECONDS = 120     # how long a claim lasts without being renewed
+MAX_ATTEMPTS = 3        # a job which has failed (or whose worker has died) this many times is given up on
+POLL_SECONDS = 5        # how long an idle worker waits before checking for jobs with expired leases
+
+SCHEMA = '''
+    CREATE TABLE IF NOT EXISTS jobs (
+        id INTEGER PRIMARY KEY,
+        path TEXT NOT NULL UNIQUE,
+        store TEXT NOT NULL,
+        pageNum INTEGER NOT NULL,
+        status TEXT NOT NULL DEFAULT 'pending',     -- pending, running, done or failed
+        worker TEXT,
+        leaseExpires REAL,
+        attempts INTEGER NOT NULL DEFAULT 0,
+        error TEXT
+    )'''
+
+STATUSES = ['pending', 'running', 'done', 'failed']
+
+class Job:
+
+    def __init__(self, id, path, store, pageNum, attempts):
+
+        self.id = id
+        self.path = path
+        self.store = store          # the folder of the Store that the page's structure goes into
+        self.pageNum = pageNum
+        self.attempts = attempts    # including this one
+
+class WorkQueue:
+
+    def __init__(self, path, leaseSeconds=LEASE_SECONDS, maxAttempts=MAX_ATTEMPTS):
+
+        self.path = path
+        self.leaseSeconds = leaseSeconds
+        self.maxAttempts = maxAttempts
+
+        # transactions are started by hand (see transaction), so that claims can take the write lock up front.
+        self.connection = sqlite3.connect(path, timeout=60, isolation_level=None)
+        self.connection.execute(SCHEMA)
+
+    def transaction(self):
+        # BEGIN IMMEDIATE takes the database's write lock straight away, so that two workers can't both
+        # read the same job as free before either marks it as taken.
+
+        self.connection.execute('BEGIN IMMEDIATE')
+        return self.connection
+
+    def add(self, paths, storePath, pageNums=None):
+        # Adds a job for each image. Images which are already in the queue are left alone, so adding a
+        # folder again only adds new pages. Unless pageNums says otherwise, the new pages are numbered in the
+        # order given, carrying on after the last page already going into the store. A page number is never
+        # given out twice, since the store would then keep only one of the two pages; a page which turns up
+        # later (even one that sorts before the others) goes at the end.
+
+        connection = self.transaction()
+        try:
+            if pageNums is None:
+                existing = set( row[0] for row in connection.execute('SELECT path FROM jobs') )
+                newPaths = []
+                for path in paths:
+                    if path not in existing:
+                        existing.add(path)
+                        newPaths.append(path)
+                paths = newPaths
+
+                lastPageNum = connection.execute('SELECT MAX(pageNum) FROM jobs WHERE store = ?',
+                                                 (storePath,)).fetchone()[0]
+                firstPageNum = lastPageNum + 1 if lastPageNum is not None else 0
+                pageNums = range(firstPageNum, firstPageNum + len(paths))
+
+            connection.executemany('INSERT OR IGNORE INTO jobs (path, store, pageNum) VALUES (?, ?, ?)',
+                                   [ (path, storePath, pageNum) for path, pageNum in zip(paths, pageNums) ])
+            connection.execute('COMMIT')
+        except:
+            connection.execute('ROLLBACK')
+            raise
+
+    def claim(self, worker):
+        # Returns the next job that is waiting (or whose worker's lease has run out), or None if there isn't
+        # one right now.
+
+        now = time.time()
+        connection = self.transaction()
+        try:
+            row = connection.execute('''
+                SELECT id, path, store, pageNum, attempts FROM jobs
+                WHERE (status = 'pending' OR (status = 'running' AND leaseExpires < ?)) AND attempts < ?
+                ORDER BY id LIMIT 1''', (now, self.maxAttempts)).fetchone()
+
+            if row is not None:
+                connection.execute('''
+                    UPDATE jobs SET status = 'running', worker = ?, leaseExpires = ?, attempts = attempts + 1
+                    WHERE id = ?''', (worker, now + self.leaseSeconds, row[0]))
+            connection.execute('COMMIT')
+        except:
+            connection.execute('ROLLBACK')
+            raise
+
+        if row is None:
+            return None
+
+        jobId, path, store, pageNum, attempts = row
+        return Job(jobId, path, store, pageNum, attempts + 1)
+
+    def renew(self, job, worker):
+        # Extends the lease on a job. Returns False if the job is no longer ours (our lease ran out and
+        # another worker took it).
+
+        cursor = self.connection.execute('''
+            UPDATE jobs SET leaseExpires = ? WHERE id = ? AND worker = ? AND status = 'running' ''',
+            (time.time() + self.leaseSeconds, job.id, worker))
+        return cursor.rowcount == 1
+
+    def complete(self, job, worker):
+
+        self.connection.execute('''
+            UPDATE jobs SET status = 'done', leaseExpires = NULL, error = NULL
+            WHERE id = ? AND worker = ?''', (job.id, worker))
+
+    def fail(self, job, worker, error):
+        # puts the job back in the queue, unless it has used up its attempts.
+
+        status = 'failed' if job.attempts >= self.maxAttempts else 'pending'
+        self.connection.execute('''
+            UPDATE jobs SET status = ?, leaseExpires = NULL, error = ?
+            WHERE id = ? AND worker = ? AND status = 'running' ''', (status, error, job.id, worker))
+
+    def counts(self):
+        # The number of jobs with each status. A running job whose lease has run out is really waiting to be
+        # claimed again, or has failed if that was its last attempt.
+
+        counts = dict( (status, 0) for status in STATUSES )
+        rows = self.connection.execute('''
+            SELECT CASE WHEN status = 'running' AND leaseExpires < ? AND attempts >= ? THEN 'failed'
+                        WHEN status = 'running' AND leaseExpires < ? THEN 'pending'
+                        ELSE status END, COUNT(*)
+            FROM jobs GROUP BY 1''', (time.time(), self.maxAttempts, time.time()))
+        for status, count in rows:
+            counts[status] = count
+
+        return counts
+
+    def isFinished(self):
+        counts = self.counts()
+        return counts['pending'] == 0 and counts['running'] == 0
+
+    def failures(self):
+        # (path, error) pairs for the jobs which have been given up on.
+        return self.connection.execute('''
+            SELECT path, error FROM jobs WHERE status = 'failed' OR (status = 'running' AND leaseExpires < ?
+            AND attempts >= ?) ORDER BY id''', (time.time(), self.maxAttempts)).fetchall()
+
+    def close(self):
+        self.connection.close()
+
+class Heartbeat(threading.Thread):
+    # Renews a job's lease in the background while the page is being analysed. It has its own connection,
+    # since SQLite connections can't be shared between threads.
+
+    def __init__(self, queuePath, job, worker, leaseSeconds):
+
+        threading.Thread.__init__(self)
+        self.daemon = True
+
+        self.queuePath = queuePath
+        self.job = job
+        self.worker = worker
+        self.leaseSeconds = leaseSeconds
+        self.stopping = threading.Event()
+        self.isLost = False     # set if another worker took the job over
+
+    def run(self):
+
+        queue = WorkQueue(self.queuePath, self.leaseSeconds)
+        try:
+            while not self.stopping.wait(self.leaseSeconds / 3.0):
+                if not queue.renew(self.job, self.worker):
+                    self.isLost = True
+                    return
+        finally:
+            queue.close()
+
+    def stop(self):
+        self.stopping.set()
+        self.join()
+
+def analysePage(path):
+    return Page(path, image=pipeline.decode(path)).analyse()
+
+def workerName():
+    return '%s:%i' %(socket.gethostname(), os.getpid())
+
+def work(queuePath, analyse=analysePage, leaseSeconds=LEASE_SECONDS, maxAttempts=MAX_ATTEMPTS,
+         pollSeconds=POLL_SECONDS):
+    # Claims and analyses pages until every job is done or has failed. analyse(path) returns a Page, as
+    # analysePage does. Returns the number of pages this worker analysed.
+
+    pageModule.stopwatch.verbose = False
+
+    worker = workerName()
+    queue = WorkQueue(queuePath, leaseSeconds, maxAttempts)
+    stores = {}
+    pageCount = 0
+
+    try:
+        while True:
+            job = queue.claim(worker)
+            if job is None:
+                if queue.isFinished():
+                    return pageCount
+                time.sleep(pollSeconds)     # other workers still hold leases, which may yet run out
+                continue
+
+            heartbeat = Heartbeat(queuePath, job, worker, leaseSeconds)
+            heartbeat.start()
+            try:
+                page = analyse(job.path)
+                if job.store not in stores:
+                    stores[job.store] = Store(job.store)
+                stores[job.store].append(job.pageNum, page)
+            except Exception:
+                heartbeat.stop()
+                queue.fail(job, worker, traceback.format_exc())
+                print "%s failed %s (attempt %i)" %(worker, os.path.basename(job.path), job.attempts)
+                continue
+
+            heartbeat.stop()
+            if heartbeat.isLost:
+                continue    # our lease ran out part way through, and the job went to another worker
+
+            queue.complete(job, worker)
+            pageCount += 1
+            print "%s analysed %s" %(worker, os.path.basename(job.path))
+    finally:
+        for store in stores.values():
+            store.close()
+        queue.close()
+
+def workInProcesses(queuePath, processes):
+    # runs `processes` workers on this machine. Others can be started on other machines at the same time.
+
+    workers = [ multiprocessing.Process(target=work, args=(queuePath,)) for i in range(processes) ]
+    for process in workers:
+        process.start()
+    for process in workers:
+        process.join()
+
+def printStatus(queuePath):
+
+    queue = WorkQueue(queuePath)
+    counts = queue.counts()
+    print '\t'.join('%s %i' %(status, counts[status]) for status in STATUSES)
+    for path, error in queue.failures():
+        print
+        print path
+        print error
+    queue.close()
+
+if __name__ == '__main__':
+
+    if len(sys.argv) < 3 or sys.argv[1] not in ('add', 'work', 'status'):
+        print "usage: workqueue.py add|work|status [queue file] ..."
+        sys.exit(2)
+
+    command, queuePath = sys.argv[1], sys.argv[2]
+
+    if command == 'add':
+        inputFolder = sys.argv[3] if len(sys.argv) > 3 else 'images'
+        storeFolder = sys.argv[4] if len(sys.argv) > 4 else 'store'
+        paths = list(sources.folderPages(os.path.abspath(inputFolder)))
+        queue = WorkQueue(queuePath)
+        queue.add(paths, os.path.abspath(storeFolder))
+        queue.close()
+    elif command == 'work':
+        processes = int(sys.argv[3]) if len(sys.argv) > 3 else 1
+        if processes > 1:
+            workInProcesses(queuePath, processes)
+        else:
+            work(queuePath)
+
+    printStatus(queuePath)